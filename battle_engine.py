@@ -0,0 +1,173 @@
+"""
+Batched Monte Carlo battle engine for Iran War Game
+Draws the randomness of many battles at once instead of calling
+GameLogic.calculate_battle_result in a Python loop.
+NumPy is used when available, otherwise a pure-Python fallback runs.
+"""
+
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is not bundled in the APK builds
+    np = None
+
+# z-score of a two-sided 95% confidence interval
+Z_95 = 1.959963984540054
+
+
+class BattleEngine:
+    def __init__(self, battle_randomness: float = 0.3, use_numpy: Optional[bool] = None):
+        self.battle_randomness = battle_randomness
+        if use_numpy is None:
+            use_numpy = np is not None
+        self.use_numpy = use_numpy and np is not None
+
+    def simulate(self, attacking_soldiers: int, defending_soldiers: int, simulations: int = 100,
+                 attacker_barracks: int = 0, defender_barracks: int = 0,
+                 rng: Optional[random.Random] = None) -> Dict:
+        """
+        Simulate many battles with the rules of GameLogic.calculate_battle_result
+        Returns win probability and average losses with 95% confidence intervals
+        """
+        if simulations <= 0:
+            raise ValueError("simulations must be positive")
+        if rng is None:
+            rng = random  # module-level functions share the global generator
+
+        if self.use_numpy:
+            wins, att_sum, att_sq, def_sum, def_sq = self._simulate_numpy(
+                attacking_soldiers, defending_soldiers, simulations,
+                attacker_barracks, defender_barracks, rng
+            )
+        else:
+            wins, att_sum, att_sq, def_sum, def_sq = self._simulate_python(
+                attacking_soldiers, defending_soldiers, simulations,
+                attacker_barracks, defender_barracks, rng
+            )
+
+        return {
+            'win_probability': wins / simulations,
+            'avg_attacker_losses': att_sum / simulations,
+            'avg_defender_losses': def_sum / simulations,
+            'win_probability_ci': wilson_interval(wins, simulations),
+            'avg_attacker_losses_ci': mean_interval(att_sum, att_sq, simulations),
+            'avg_defender_losses_ci': mean_interval(def_sum, def_sq, simulations),
+            'simulations': simulations
+        }
+
+    def draw_rolls(self, count: int, rng: Optional[random.Random] = None) -> List[List[float]]:
+        """
+        Draw the four uniform [0, 1) rolls of count battles in one call
+        A game's own rng is always drawn with rng.random(), so its battles
+        replay the same with or without NumPy; only unseeded draws use NumPy.
+        """
+        if rng is None:
+            if self.use_numpy:
+                return np.random.default_rng().random((count, 4)).tolist()
+            rng = random
+        draw = rng.random
+        return [[draw(), draw(), draw(), draw()] for _ in range(count)]
+
+    def resolve(self, attacking_soldiers: int, defending_soldiers: int, rolls: List[float],
+                attacker_barracks: int = 0, defender_barracks: int = 0) -> Tuple[bool, int, int]:
+        """
+        Resolve one battle from pre-drawn rolls with calculate_battle_result rules
+        Returns: (attacker_wins, remaining_attackers, remaining_defenders)
+        """
+        r = self.battle_randomness
+        attack_roll, defense_roll, attacker_casualty_roll, defender_casualty_roll = rolls
+
+        attack_power = attacking_soldiers * (1 + attacker_barracks * 0.1) * (1 - r + 2 * r * attack_roll)
+        defense_power = defending_soldiers * (1 + defender_barracks * 0.15 + 0.2) * (1 - r + 2 * r * defense_roll)
+
+        attacker_casualties = int(defending_soldiers * 0.3 + int(attacker_casualty_roll * (defending_soldiers // 4 + 1)))
+        defender_casualties = int(attacking_soldiers * 0.4 + int(defender_casualty_roll * (attacking_soldiers // 3 + 1)))
+
+        if attack_power > defense_power:
+            return True, max(1, max(0, attacking_soldiers - attacker_casualties) // 2), 0
+        return False, 0, max(1, max(0, defending_soldiers - defender_casualties))
+
+    def _simulate_numpy(self, attackers, defenders, n, attacker_barracks, defender_barracks, rng):
+        """Vectorized simulation, returns (wins, loss sums and sums of squares)"""
+        generator = np.random.default_rng(rng.getrandbits(64))
+        r = self.battle_randomness
+
+        attack_power = attackers * (1 + attacker_barracks * 0.1) * (1 + generator.uniform(-r, r, n))
+        defense_power = defenders * (1 + defender_barracks * 0.15 + 0.2) * (1 + generator.uniform(-r, r, n))
+
+        attacker_casualties = np.floor(defenders * 0.3 + generator.integers(0, defenders // 4, n, endpoint=True))
+        defender_casualties = np.floor(attackers * 0.4 + generator.integers(0, attackers // 3, n, endpoint=True))
+
+        remaining_attackers = np.maximum(0, attackers - attacker_casualties.astype(np.int64))
+        remaining_defenders = np.maximum(0, defenders - defender_casualties.astype(np.int64))
+
+        wins = attack_power > defense_power
+        remaining_attackers = np.where(wins, np.maximum(1, remaining_attackers // 2), 0)
+        remaining_defenders = np.where(wins, 0, np.maximum(1, remaining_defenders))
+
+        attacker_losses = (attackers - remaining_attackers).astype(np.float64)
+        defender_losses = (defenders - remaining_defenders).astype(np.float64)
+
+        return (int(wins.sum()),
+                float(attacker_losses.sum()), float(np.dot(attacker_losses, attacker_losses)),
+                float(defender_losses.sum()), float(np.dot(defender_losses, defender_losses)))
+
+    def _simulate_python(self, attackers, defenders, n, attacker_barracks, defender_barracks, rng):
+        """Pure-Python simulation with the per-battle overhead stripped out"""
+        r = self.battle_randomness
+        spread = 2 * r
+        draw = rng.random
+
+        attack_base = attackers * (1 + attacker_barracks * 0.1)
+        defense_base = defenders * (1 + defender_barracks * 0.15 + 0.2)
+        attacker_casualties_base = defenders * 0.3
+        defender_casualties_base = attackers * 0.4
+        attacker_spread = defenders // 4 + 1
+        defender_spread = attackers // 3 + 1
+
+        wins = 0
+        att_sum = att_sq = def_sum = def_sq = 0
+        for _ in range(n):
+            attack_power = attack_base * (1 - r + spread * draw())
+            defense_power = defense_base * (1 - r + spread * draw())
+            attacker_casualties = int(attacker_casualties_base + int(draw() * attacker_spread))
+            defender_casualties = int(defender_casualties_base + int(draw() * defender_spread))
+
+            if attack_power > defense_power:
+                wins += 1
+                remaining_attackers = max(1, max(0, attackers - attacker_casualties) // 2)
+                remaining_defenders = 0
+            else:
+                remaining_attackers = 0
+                remaining_defenders = max(1, defenders - defender_casualties)
+
+            attacker_losses = attackers - remaining_attackers
+            defender_losses = defenders - remaining_defenders
+            att_sum += attacker_losses
+            att_sq += attacker_losses * attacker_losses
+            def_sum += defender_losses
+            def_sq += defender_losses * defender_losses
+
+        return wins, att_sum, att_sq, def_sum, def_sq
+
+
+def wilson_interval(successes: int, trials: int, z: float = Z_95) -> Tuple[float, float]:
+    """Wilson score interval for a binomial proportion"""
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def mean_interval(total: float, total_sq: float, count: int, z: float = Z_95) -> Tuple[float, float]:
+    """Normal-approximation interval for a sample mean"""
+    mean = total / count
+    if count < 2:
+        return mean, mean
+    variance = max(0.0, (total_sq - total * mean) / (count - 1))
+    margin = z * math.sqrt(variance / count)
+    return mean - margin, mean + margin
@@ -0,0 +1,226 @@
+"""
+Precomputed battle odds for Iran War Game
+Tabulates P(win) and expected losses of GameLogic.calculate_battle_result over
+a grid of (attackers, defenders, attacker barracks, defender barracks).
+The table is computed exactly (no sampling), stored as a compact binary file
+and memory-mapped lazily on first lookup.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from typing import Dict, Optional
+
+DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'battle_odds.bin')
+
+# Cells are native float32 (little-endian on every platform we ship to)
+# magic, format version, randomness, max attackers, max defenders,
+# max attacker barracks, max defender barracks, reserved (keeps cells 4-byte aligned)
+HEADER = struct.Struct('<4sHfHHHHH')
+MAGIC = b'IWBO'
+FORMAT_VERSION = 1
+# win probability, expected attacker losses, expected defender losses
+FIELDS_PER_CELL = 3
+
+
+def win_probability(attacking_soldiers: int, defending_soldiers: int, attacker_barracks: int = 0,
+                    defender_barracks: int = 0, battle_randomness: float = 0.3) -> float:
+    """Exact P(attack_power > defense_power) for uniform randomness factors"""
+    attack_base = attacking_soldiers * (1 + attacker_barracks * 0.1)
+    defense_base = defending_soldiers * (1 + defender_barracks * 0.15 + 0.2)
+    if attack_base <= 0:
+        return 0.0
+    if defense_base <= 0:
+        return 1.0
+
+    # P(X > t * Y) with X, Y ~ U[low, high]
+    low = 1 - battle_randomness
+    high = 1 + battle_randomness
+    width = high - low
+    t = defense_base / attack_base
+
+    certain_until = min(low / t, high)  # below this y every x wins
+    always_win = max(0.0, certain_until - low)
+
+    start = max(low, low / t)
+    end = min(high, high / t)
+    partial_win = 0.0
+    if end > start:
+        partial_win = (high * (end - start) - t * (end * end - start * start) / 2) / width
+
+    return min(1.0, max(0.0, (always_win + partial_win) / width))
+
+
+def expected_remaining_on_win(attacking_soldiers: int, defending_soldiers: int) -> float:
+    """Expected surviving attackers given the attacker wins"""
+    spread = defending_soldiers // 4 + 1
+    total = 0
+    for k in range(spread):
+        casualties = int(defending_soldiers * 0.3 + k)
+        total += max(1, max(0, attacking_soldiers - casualties) // 2)
+    return total / spread
+
+
+def expected_remaining_on_loss(attacking_soldiers: int, defending_soldiers: int) -> float:
+    """Expected surviving defenders given the defender wins"""
+    spread = attacking_soldiers // 3 + 1
+    total = 0
+    for k in range(spread):
+        casualties = int(attacking_soldiers * 0.4 + k)
+        total += max(1, max(0, defending_soldiers - casualties))
+    return total / spread
+
+
+class BattleOddsTable:
+    def __init__(self, path: str = DEFAULT_TABLE_PATH, max_soldiers: int = 100, max_barracks: int = 4,
+                 battle_randomness: float = 0.3):
+        self.path = path
+        self.max_attackers = max_soldiers
+        self.max_defenders = max_soldiers
+        self.max_attacker_barracks = max_barracks
+        self.max_defender_barracks = max_barracks
+        self.battle_randomness = battle_randomness
+        self._cells = None
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    def covers(self, attacking_soldiers: int, defending_soldiers: int,
+               attacker_barracks: int = 0, defender_barracks: int = 0) -> bool:
+        """Check if a battle lies inside the precomputed grid"""
+        return (0 <= attacking_soldiers <= self.max_attackers and
+                0 <= defending_soldiers <= self.max_defenders and
+                0 <= attacker_barracks <= self.max_attacker_barracks and
+                0 <= defender_barracks <= self.max_defender_barracks)
+
+    def lookup(self, attacking_soldiers: int, defending_soldiers: int,
+               attacker_barracks: int = 0, defender_barracks: int = 0) -> Optional[Dict]:
+        """O(1) odds lookup, returns None outside the grid"""
+        if not self.covers(attacking_soldiers, defending_soldiers, attacker_barracks, defender_barracks):
+            return None
+
+        cells = self._cells if self._cells is not None else self.load()
+        offset = self._index(attacking_soldiers, defending_soldiers,
+                             attacker_barracks, defender_barracks) * FIELDS_PER_CELL
+        p, attacker_losses, defender_losses = cells[offset:offset + FIELDS_PER_CELL]
+
+        return {
+            'win_probability': p,
+            'avg_attacker_losses': attacker_losses,
+            'avg_defender_losses': defender_losses,
+            'win_probability_ci': (p, p),
+            'avg_attacker_losses_ci': (attacker_losses, attacker_losses),
+            'avg_defender_losses_ci': (defender_losses, defender_losses),
+            'simulations': 0
+        }
+
+    def load(self):
+        """Memory-map the table file, building it first if missing or stale"""
+        with self._lock:
+            if self._cells is not None:
+                return self._cells
+
+            cells = None
+            if not self._read_header_matches():
+                cells = self.build()
+                try:
+                    self.save(cells)
+                except OSError:
+                    # Read-only install directory: keep the table in memory
+                    self._cells = memoryview(cells)
+                    return self._cells
+
+            try:
+                with open(self.path, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self._mmap = None
+            if self._mmap is None or not self._mapped_table_matches():
+                # Replaced or cut short by another process meanwhile: use a table of our own
+                if self._mmap is not None:
+                    self._mmap.close()
+                    self._mmap = None
+                self._cells = memoryview(cells if cells is not None else self.build())
+                return self._cells
+            self._cells = memoryview(self._mmap)[HEADER.size:].cast('f')
+            return self._cells
+
+    def build(self) -> array:
+        """Compute the whole grid"""
+        r = self.battle_randomness
+        barracks_pairs = [(ab, db) for ab in range(self.max_attacker_barracks + 1)
+                          for db in range(self.max_defender_barracks + 1)]
+        cells = array('f')
+
+        for attackers in range(self.max_attackers + 1):
+            for defenders in range(self.max_defenders + 1):
+                # Casualty rolls do not depend on barracks, only P(win) does
+                remaining_on_win = expected_remaining_on_win(attackers, defenders)
+                remaining_on_loss = expected_remaining_on_loss(attackers, defenders)
+                for attacker_barracks, defender_barracks in barracks_pairs:
+                    p = win_probability(attackers, defenders, attacker_barracks, defender_barracks, r)
+                    cells.append(p)
+                    cells.append(attackers - p * remaining_on_win)
+                    cells.append(defenders - (1 - p) * remaining_on_loss)
+
+        return cells
+
+    def save(self, cells: array):
+        """Write the table atomically to disk"""
+        # A unique temp file: shard workers and bot processes may build the table at the same time
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                        prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._header())
+                cells.tofile(f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def close(self):
+        """Release the memory map"""
+        with self._lock:
+            if self._cells is not None:
+                self._cells.release()
+                self._cells = None
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+    def _header(self) -> bytes:
+        return HEADER.pack(MAGIC, FORMAT_VERSION, self.battle_randomness,
+                           self.max_attackers, self.max_defenders,
+                           self.max_attacker_barracks, self.max_defender_barracks, 0)
+
+    def _read_header_matches(self) -> bool:
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER.size)
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+        except OSError:
+            return False
+        return header == self._header() and size == self._expected_size()
+
+    def _expected_size(self) -> int:
+        return HEADER.size + self._cell_count() * FIELDS_PER_CELL * 4
+
+    def _mapped_table_matches(self) -> bool:
+        """Check the mapped file itself, not the path that was checked before it was opened"""
+        return len(self._mmap) == self._expected_size() and self._mmap[:HEADER.size] == self._header()
+
+    def _cell_count(self) -> int:
+        return ((self.max_attackers + 1) * (self.max_defenders + 1) *
+                (self.max_attacker_barracks + 1) * (self.max_defender_barracks + 1))
+
+    def _index(self, attackers, defenders, attacker_barracks, defender_barracks) -> int:
+        index = attackers * (self.max_defenders + 1) + defenders
+        index = index * (self.max_attacker_barracks + 1) + attacker_barracks
+        return index * (self.max_defender_barracks + 1) + defender_barracks
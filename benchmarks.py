@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for Iran War Game engine
+Run: python benchmarks.py
+"""
+
+import copy
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import HTTPServer
+from game_logic import GameLogic
+from iran_map import IranMap
+from main import BoundedThreadingHTTPServer, GameHandler, GameState
+from battle_engine import BattleEngine, np
+from bots import EngineRules, search, snapshot
+from concurrent.futures import ProcessPoolExecutor
+from map_format import SCHEMA_GAME, MapPack, write_pack
+from map_generator import generate_map
+from replays import Replay, ReplayEngine, record_replay
+from state_sync import StateCache, StateSync
+from wire_codec import decode_message, encode_message
+
+
+def simulate_battle_outcome_loop(game_logic, attacker_soldiers, defender_soldiers, simulations):
+    """Reference implementation: one calculate_battle_result call per sample"""
+    wins = 0
+    total_attacker_losses = 0
+    total_defender_losses = 0
+
+    for _ in range(simulations):
+        attacker_wins, remaining_attackers, remaining_defenders = game_logic.calculate_battle_result(
+            attacker_soldiers, defender_soldiers
+        )
+        if attacker_wins:
+            wins += 1
+        total_attacker_losses += (attacker_soldiers - remaining_attackers)
+        total_defender_losses += (defender_soldiers - remaining_defenders)
+
+    return {
+        'win_probability': wins / simulations,
+        'avg_attacker_losses': total_attacker_losses / simulations,
+        'avg_defender_losses': total_defender_losses / simulations
+    }
+
+
+def best_of(repeats, func, *args):
+    """Return (best elapsed seconds, last result) of several runs"""
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_simulate_battle_outcome(simulations=10000, repeats=3):
+    """Compare the loop simulation with the batched engine (speed and statistics)"""
+    game_logic = GameLogic()
+    engines = [('python', BattleEngine(use_numpy=False))]
+    if np is not None:
+        engines.append(('numpy', BattleEngine(use_numpy=True)))
+
+    print(f"simulate_battle_outcome, {simulations} simulations, best of {repeats}")
+    print(f"{'battle':>10} {'engine':>8} {'seconds':>10} {'speedup':>8} {'P(win)':>8} {'z':>6}")
+
+    for attackers, defenders in [(10, 10), (30, 20), (60, 40), (100, 100)]:
+        loop_time, loop_result = best_of(
+            repeats, simulate_battle_outcome_loop, game_logic, attackers, defenders, simulations
+        )
+        print(f"{attackers:>4}v{defenders:<5} {'loop':>8} {loop_time:>10.4f} {1.0:>8.1f} "
+              f"{loop_result['win_probability']:>8.3f} {'':>6}")
+
+        for name, engine in engines:
+            engine_time, result = best_of(repeats, engine.simulate, attackers, defenders, simulations)
+            # Two-proportion z statistic; |z| < 3 means the distributions agree
+            p = (loop_result['win_probability'] + result['win_probability']) / 2
+            stderr = math.sqrt(max(p * (1 - p), 1e-12) * 2 / simulations)
+            z = (result['win_probability'] - loop_result['win_probability']) / stderr
+            print(f"{'':>10} {name:>8} {engine_time:>10.4f} {loop_time / engine_time:>8.1f} "
+                  f"{result['win_probability']:>8.3f} {z:>6.2f}")
+
+
+def bench_battle_odds(lookups=100000):
+    """Time precomputed odds lookups against a 100-sample simulation"""
+    game_logic = GameLogic()
+    game_logic.odds_table.load()
+    battles = [(random.randint(1, 100), random.randint(1, 100)) for _ in range(lookups)]
+
+    start = time.perf_counter()
+    for attackers, defenders in battles:
+        game_logic.odds_table.lookup(attackers, defenders)
+    lookup_time = (time.perf_counter() - start) / lookups
+
+    start = time.perf_counter()
+    for attackers, defenders in battles[:1000]:
+        game_logic.battle_engine.simulate(attackers, defenders, 100)
+    simulate_time = (time.perf_counter() - start) / 1000
+
+    print(f"battle odds: lookup {lookup_time * 1e6:.2f} us, "
+          f"100-sample simulation {simulate_time * 1e6:.1f} us, "
+          f"speedup {simulate_time / lookup_time:.0f}x")
+
+
+def bench_game_regions(games=1000):
+    """Per-game region memory and creation time: dict copies vs shared topology"""
+    iran_map = IranMap()
+
+    for name, factory in [('get_regions', iran_map.get_regions),
+                          ('new_game_regions', iran_map.new_game_regions)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        tables = [factory() for _ in range(games)]
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tables
+        print(f"{name:>17}: {memory / games:>8.0f} bytes/game, {elapsed / games * 1e6:>6.1f} us/game")
+
+
+def bench_attack_queries(queries=20000):
+    """Valid-target and frontier queries: neighbor lists vs bitmasks"""
+    game_logic = GameLogic()
+    iran_map = IranMap()
+    region_ids = list(iran_map.regions)
+    owned = random.sample(region_ids, 12)
+    targets = [random.choice(region_ids) for _ in range(queries)]
+
+    owned_mask = iran_map.topology.mask_of(owned)
+
+    for name, regions, neighbors in [('lists', owned, iran_map.region_neighbors),
+                                     ('bitmask', owned_mask, iran_map.topology)]:
+        start = time.perf_counter()
+        for target in targets:
+            game_logic.is_valid_attack_target(regions, target, neighbors)
+        elapsed = time.perf_counter() - start
+        print(f"is_valid_attack_target with {name:>7}: {elapsed / queries * 1e6:.2f} us/query")
+
+    start = time.perf_counter()
+    for _ in range(queries):
+        iran_map.topology.frontier_mask(owned_mask)
+    print(f"frontier_mask: {(time.perf_counter() - start) / queries * 1e6:.2f} us/query")
+
+
+def bench_territory(captures=20000):
+    """Largest territory after every capture: clusters rebuilt from scratch vs the incremental tracker"""
+    iran_map = IranMap()
+    regions = iran_map.new_game_regions()
+    region_ids = list(regions)
+    moves = [(random.choice(region_ids), random.choice(['p1', 'p2', 'p3'])) for _ in range(captures)]
+
+    start = time.perf_counter()
+    for region_id, owner in moves:
+        regions[region_id]['owner'] = owner
+        max(map(len, iran_map.get_region_clusters(iran_map.topology.ids_of(regions.owned_mask(owner)))))
+    bfs_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for region_id, owner in moves:
+        regions[region_id]['owner'] = owner
+        regions.territory.largest_territory(owner)
+    tracker_time = time.perf_counter() - start
+
+    print(f"largest territory per capture: rebuilt {bfs_time / captures * 1e6:.1f} us, "
+          f"union-find {tracker_time / captures * 1e6:.1f} us")
+
+
+def bench_large_maps(sizes=(1000, 10000, 100000), path_queries=20, players=4):
+    """Generated maps: build, state serialization, path queries and victory checks"""
+    game_logic = GameLogic()
+    print(f"{'regions':>8} {'build s':>8} {'game ms':>8} {'json ms':>8} {'json KB':>8} "
+          f"{'path ms':>8} {'victory ms':>10}")
+
+    for size in sizes:
+        rng = random.Random(size)
+        start = time.perf_counter()
+        game_map = IranMap.generated(size, seed=size)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        regions = game_map.new_game_regions()
+        region_ids = list(regions)
+        for region_id in region_ids:
+            regions[region_id]['owner'] = f'player_{rng.randrange(players)}'
+            regions[region_id]['soldiers'] = 10
+        game_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        payload = json.dumps(regions.to_dict(), ensure_ascii=False)
+        json_time = time.perf_counter() - start
+
+        pairs = [(rng.choice(region_ids), rng.choice(region_ids)) for _ in range(path_queries)]
+        start = time.perf_counter()
+        for a, b in pairs:
+            game_map.path(a, b)
+        path_time = (time.perf_counter() - start) / path_queries
+
+        start = time.perf_counter()
+        game_logic.get_territory_victory(regions)
+        victory_time = time.perf_counter() - start
+
+        print(f"{size:>8} {build_time:>8.2f} {game_time * 1e3:>8.1f} {json_time * 1e3:>8.1f} "
+              f"{len(payload.encode()) / 1024:>8.0f} {path_time * 1e3:>8.2f} {victory_time * 1e3:>10.3f}")
+
+
+def bench_map_pack(size=100000, path='bench_map.iwm'):
+    """Open a packed map and read one region vs building the same map as dicts"""
+    regions, neighbors = generate_map(size, seed=1)
+    write_pack({'bench': (regions, neighbors, SCHEMA_GAME)}, path)
+    region_id = next(iter(regions))
+    del regions, neighbors
+
+    start = time.perf_counter()
+    map_data = MapPack(path).get('bench')
+    map_data.record(0)
+    open_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    map_data[region_id]
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dict(map_data.items())
+    map_data.neighbor_map()
+    dict_time = time.perf_counter() - start
+
+    print(f"{size} regions: open + first record {open_time * 1e3:.2f} ms, "
+          f"first lookup by id {lookup_time * 1e3:.1f} ms, full dicts {dict_time * 1e3:.0f} ms")
+    os.remove(path)
+
+
+def bench_state_diffs(actions=500):
+    """Broadcast bytes per attack: full game state vs versioned diff"""
+    game_logic = GameLogic()
+    iran_map = IranMap()
+    regions = iran_map.new_game_regions()
+    players = {player_id: {'name': player_id, 'coins': 100, 'regions': []} for player_id in ('p1', 'p2')}
+    for i, region_id in enumerate(regions):
+        owner = 'p1' if i % 2 else 'p2'
+        regions[region_id]['owner'] = owner
+        regions[region_id]['soldiers'] = 20
+        players[owner]['regions'].append(region_id)
+    sync = StateSync()
+    sync.commit(regions, players, {})
+
+    snapshot_bytes = diff_bytes = 0
+    for _ in range(actions):
+        owner = random.choice(list(players))
+        source = random.choice(players[owner]['regions'] or list(regions))
+        targets = [neighbor for neighbor in iran_map.get_neighbors(source) if regions[neighbor]['owner'] != owner]
+        if targets:
+            game_logic.resolve_battles(regions, [(source, targets[0], 5)], iran_map.region_neighbors, players, owner)
+        regions[source]['soldiers'] += 3
+        diff = sync.commit(regions, players, {})
+        diff_bytes += len(json.dumps(diff, ensure_ascii=False).encode())
+        snapshot_bytes += len(json.dumps({'players': players, 'regions': regions.to_dict()},
+                                         ensure_ascii=False).encode())
+
+    print(f"bytes per action: full state {snapshot_bytes / actions:.0f}, diff {diff_bytes / actions:.0f}")
+
+
+def bench_state_cache(viewers=50, versions=200):
+    """Serving one game state to many pollers: json.dumps per reply vs per-version cache"""
+    iran_map = IranMap()
+    regions = iran_map.new_game_regions()
+    players = {player_id: {'name': player_id, 'coins': 100, 'regions': []} for player_id in ('p1', 'p2')}
+    region_ids = list(regions)
+
+    def build():
+        return {'players': players, 'regions': regions.to_dict()}
+
+    def serve_uncached():
+        for version in range(versions):
+            regions[region_ids[version % len(region_ids)]]['soldiers'] += 1
+            for _ in range(viewers):
+                json.dumps({'success': True, 'game_state': build()}, ensure_ascii=False).encode('utf-8')
+
+    def serve_cached():
+        cache = StateCache()
+        for version in range(versions):
+            regions[region_ids[version % len(region_ids)]]['soldiers'] += 1
+            for _ in range(viewers):
+                cache.reply('bench', version, build)
+
+    uncached_time, _ = best_of(3, serve_uncached)
+    cached_time, _ = best_of(3, serve_cached)
+    replies = viewers * versions
+    print(f"{viewers} viewers x {versions} versions: per-reply dumps {uncached_time / replies * 1e6:.1f} us, "
+          f"cached {cached_time / replies * 1e6:.1f} us per reply ({uncached_time / cached_time:.0f}x)")
+
+
+def bench_wire_codec(sizes=(25, 1000), players=4, repeats=20):
+    """Socket payload size and encode time: JSON vs the compact wire format"""
+    print(f"{'regions':>8} {'message':>10} {'json B':>9} {'compact B':>10} {'json us':>9} {'compact us':>11}")
+    for size in sizes:
+        rng = random.Random(size)
+        game_map = IranMap() if size == 25 else IranMap.generated(size, seed=size)
+        regions = game_map.new_game_regions()
+        region_ids = list(regions)
+        # Socket ids as owners, as in server.py
+        owners = [f'{rng.getrandbits(80):020x}' for _ in range(players)]
+        for region_id in region_ids:
+            regions[region_id]['owner'] = rng.choice(owners)
+            regions[region_id]['soldiers'] = rng.randint(1, 100)
+        regions.take_changes()
+
+        attack_from, attack_to = rng.sample(region_ids, 2)
+        regions[attack_from]['soldiers'] = 1
+        regions[attack_to]['owner'] = regions[attack_from]['owner']
+        regions[attack_to]['soldiers'] = 9
+        attack = {'attacker': owners[0], 'from_region': attack_from, 'to_region': attack_to,
+                  'diff': {'version': 2, 'regions': regions.take_changes()}}
+        for region_id in region_ids:
+            regions[region_id]['soldiers'] -= 1
+        reduction = {'diff': {'version': 3, 'regions': regions.take_changes()}}
+        snapshot = {'game_state': {'version': 3, 'regions': regions.to_dict()}}
+
+        for name, payload in (('attack', attack), ('reduction', reduction), ('snapshot', snapshot)):
+            json_time, json_body = best_of(repeats, lambda: json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+            compact_time, compact_body = best_of(repeats, encode_message, payload, regions.topology)
+            assert json.loads(json.dumps(decode_message(compact_body, region_ids)[0])) == json.loads(json_body)
+            print(f"{size:>8} {name:>10} {len(json_body):>9} {len(compact_body):>10} "
+                  f"{json_time * 1e6:>9.0f} {compact_time * 1e6:>11.0f}")
+
+
+def bench_replay(actions=20000, seeks=50):
+    """Replay file size, fast-forward speed, and seeking to a turn from keyframes vs from the start"""
+    rng = random.Random(actions)
+    game = GameState('bench', 'host')
+    for n in range(3):
+        game.add_player(f'player {n}')
+    game.start_game()
+    for _ in range(actions):
+        player_id = game.get_current_player()
+        moves = [(source, target) for source in game.regions if game.regions[source]['owner'] == player_id
+                 and game.regions[source]['soldiers'] > 2 for target in game.neighbors.get(source, [])
+                 if game.regions[target]['owner'] != player_id]
+        if moves:
+            game.execute_attack(player_id, *rng.choice(moves), 2)
+        else:
+            game.execute_attacks(player_id, [])  # nothing to attack with, pass the turn
+
+    encode_time, data = best_of(1, record_replay, game, game.init_args(), 'main:GameState')
+    replay = Replay(data)
+    engine = ReplayEngine(replay, GameState)
+    run_time, _ = best_of(1, engine.run)
+    print(f"{replay.action_count} actions, {replay.turn_count} turns: {len(data)} bytes "
+          f"({len(data) / replay.action_count:.1f} B/action), recorded in {encode_time * 1e3:.0f} ms, "
+          f"fast-forward {replay.action_count / run_time:.0f} actions/s")
+
+    turns = [rng.randrange(replay.turn_count) for _ in range(seeks)]
+
+    def seek_from_start():
+        for turn in turns:
+            GameState.replay(*game.init_args(), game.action_log[:replay.turn_starts[turn]])
+
+    def seek_from_keyframes():
+        for turn in turns:
+            engine.seek_turn(turn)
+
+    start_time, _ = best_of(1, seek_from_start)
+    keyframe_time, _ = best_of(1, seek_from_keyframes)
+    print(f"seek to a turn: from the start {start_time / seeks * 1e3:.1f} ms, "
+          f"from keyframes {keyframe_time / seeks * 1e3:.2f} ms ({start_time / keyframe_time:.0f}x)")
+
+
+def bench_bots(clones=10000, budget=1.0, workers=os.cpu_count() or 1):
+    """Cloning the compact bot state vs deep-copying regions, and MCTS playouts per move budget"""
+    iran_map = IranMap()
+    game = GameState('bench', 'host', regions=iran_map.get_regions(), neighbors=iran_map.region_neighbors)
+    for n in range(3):
+        game.add_player(f'player {n}')
+    game.start_game()
+    board, state = snapshot(game, game.get_current_player(), EngineRules(), game.neighbors)
+
+    clone_time, _ = best_of(3, lambda: [state.clone() for _ in range(clones)])
+    deepcopy_time, _ = best_of(1, lambda: [copy.deepcopy(game.regions) for _ in range(clones // 10)])
+    print(f"{len(board.region_ids)} regions: clone {clone_time / clones * 1e6:.1f} us, "
+          f"deepcopy of regions {deepcopy_time / (clones // 10) * 1e6:.0f} us")
+
+    tree = search(board, state, budget, 1)
+    playouts = sum(visits for visits, _ in tree.values())
+    print(f"1 process: {playouts} playouts in {budget:.1f} s over {len(tree)} root moves")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        trees = list(pool.map(search, [board] * workers, [state] * workers, [budget] * workers, range(workers)))
+    playouts = sum(visits for tree in trees for visits, _ in tree.values())
+    print(f"{workers} processes (root parallel): {playouts} playouts in {budget:.1f} s")
+
+
+class SingleRequestHandler(GameHandler):
+    """GameHandler as the old single-threaded server ran it, one request per connection"""
+    protocol_version = 'HTTP/1.0'
+
+
+def _post(connection, path, data):
+    connection.request('POST', path, json.dumps(data).encode('utf-8'), {'Content-Type': 'application/json'})
+    return json.loads(connection.getresponse().read())
+
+
+def _slow_client(port, pause, stop):
+    """Phone on a flaky link: sends each header line of its request after a pause"""
+    lines = [b'POST /api/get_game_state HTTP/1.1\r\n', b'Host: hotspot\r\n',
+             b'Content-Type: application/json\r\n', b'Content-Length: 2\r\n', b'\r\n{}']
+    while not stop.is_set():
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            for line in lines:
+                sock.sendall(line)
+                stop.wait(pause)
+            sock.recv(65536)
+
+
+def _hotspot_latencies(server, clients, requests, slow_pause):
+    """Latencies of clients - 1 fast clients while one slow client runs alongside"""
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    setup = http.client.HTTPConnection('127.0.0.1', port)
+    game_id = _post(setup, '/api/create_game', {'player_name': 'host'})['game_id']
+    region_ids = list(IranMap().regions)
+
+    stop = threading.Event()
+    slow = threading.Thread(target=_slow_client, args=(port, slow_pause, stop), daemon=True)
+    slow.start()
+    latencies = []
+
+    def fast_client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        player_id = _post(connection, '/api/join_game', {'game_id': game_id, 'player_name': f'p{index}'})['player_id']
+        for i in range(requests):
+            start = time.perf_counter()
+            if i % 5:
+                _post(connection, '/api/get_game_state', {'game_id': game_id})
+            else:
+                _post(connection, '/api/attack', {'game_id': game_id, 'player_id': player_id, 'soldiers': 5,
+                                                  'from_region': random.choice(region_ids),
+                                                  'to_region': random.choice(region_ids)})
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+
+    workers = [threading.Thread(target=fast_client, args=(i,)) for i in range(clients - 1)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stop.set()
+    server.shutdown()
+    server.server_close()
+    latencies.sort()
+    return latencies
+
+
+def bench_hotspot_load(clients=8, requests=100, slow_pause=0.2):
+    """p50/p99 request latency of the hotspot server with 8 clients, one of them slow"""
+    GameHandler.log_message = lambda *args: None
+    modes = (
+        ('single thread', HTTPServer(('127.0.0.1', 0), SingleRequestHandler)),
+        ('worker pool', BoundedThreadingHTTPServer(('127.0.0.1', 0), GameHandler)),
+    )
+    for name, server in modes:
+        latencies = _hotspot_latencies(server, clients, requests, slow_pause)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name}: {len(latencies)} requests, p50 {p50 * 1e3:.1f} ms, p99 {p99 * 1e3:.1f} ms")
+
+
+BENCHMARKS = {
+    'battle': bench_simulate_battle_outcome,
+    'odds': bench_battle_odds,
+    'regions': bench_game_regions,
+    'masks': bench_attack_queries,
+    'territory': bench_territory,
+    'large_maps': bench_large_maps,
+    'map_pack': bench_map_pack,
+    'diffs': bench_state_diffs,
+    'state_cache': bench_state_cache,
+    'wire_codec': bench_wire_codec,
+    'replay': bench_replay,
+    'bots': bench_bots,
+    'hotspot_load': bench_hotspot_load,
+}
+
+if __name__ == '__main__':
+    random.seed(1)
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
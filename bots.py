@@ -0,0 +1,422 @@
+"""
+Headless bot players for Iran War Game servers
+A bot picks its next move with Monte Carlo Tree Search over a compact copy
+of the game: owners, soldiers, barracks and coins live in flat arrays that
+a playout clones with one copy per array, while the map links and player
+order are shared by every clone. Search is root parallel: each worker
+process grows its own tree from the same position until the move's time
+budget runs out, and the root visit counts of all trees pick the move.
+The SEARCH_WORKERS processes are shared by every bot of the server: a move
+claims the ones that are free, so concurrent moves split them instead of
+queueing behind each other or taking more cores.
+
+Playouts resolve battles with the rules of the server the bot plays on
+(ThresholdRules for server.py, EngineRules for GameLogic battles,
+HotspotRules for the hotspot app) and give every player with regions one
+move in turn.
+
+move := (ATTACK, from_index, to_index, soldiers) | (BUILD, region_index) | (PASS,)
+"""
+
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from battle_engine import BattleEngine
+from map_topology import BUILDING_SLOTS, BUILDING_TYPES
+
+ATTACK = 0
+BUILD = 1
+PASS = 2
+PASS_MOVE = (PASS,)
+
+# Seconds of search per move
+MOVE_BUDGET = 1.0
+# Search processes of the whole server, half the cores unless $IRANWAR_BOT_WORKERS says otherwise
+SEARCH_WORKERS_ENV = 'IRANWAR_BOT_WORKERS'
+SEARCH_WORKERS = int(os.environ.get(SEARCH_WORKERS_ENV) or 0) or max(1, (os.cpu_count() or 2) // 2)
+# Moves played past the tree before a position is scored
+PLAYOUT_MOVES = 16
+# UCT exploration weight for rewards in [0, 1]
+EXPLORATION = 1.0
+# Barracks a bot stacks on one region at most
+MAX_BARRACKS = 4
+
+
+class EngineRules:
+    """Battles of GameLogic.resolve_battles, barracks bought with coins"""
+    build_cost = 200
+
+    def __init__(self, battle_randomness: float = 0.3):
+        self.engine = BattleEngine(battle_randomness, use_numpy=False)
+
+    def battle(self, state: 'SimState', source: int, target: int, soldiers: int,
+               rng: random.Random) -> Tuple[bool, int]:
+        """(attacker_wins, soldiers left in target)"""
+        rolls = [rng.random(), rng.random(), rng.random(), rng.random()]
+        attacker_wins, remaining_attackers, remaining_defenders = self.engine.resolve(
+            soldiers, state.soldiers[target], rolls, state.barracks[source], state.barracks[target]
+        )
+        return attacker_wins, remaining_attackers if attacker_wins else remaining_defenders
+
+
+class ThresholdRules:
+    """Battles of Game.execute_attack in server.py: more than 0.8 of the defenders wins, no dice"""
+    build_cost = 200
+
+    def battle(self, state: 'SimState', source: int, target: int, soldiers: int,
+               rng: random.Random) -> Tuple[bool, int]:
+        """(attacker_wins, soldiers left in target)"""
+        defenders = state.soldiers[target]
+        if soldiers > defenders * 0.8:
+            return True, max(1, soldiers - defenders // 2)
+        return False, defenders - soldiers // 2
+
+
+class HotspotRules:
+    """Battles of GameState.execute_attack in the hotspot app, which has no buildings"""
+    build_cost = None
+
+    def battle(self, state: 'SimState', source: int, target: int, soldiers: int,
+               rng: random.Random) -> Tuple[bool, int]:
+        """(attacker_wins, soldiers left in target)"""
+        attacker_strength = soldiers + int(rng.random() * 6) - 2                 # randint(-2, 3)
+        defender_strength = state.soldiers[target] + int(rng.random() * 6) - 1   # randint(-1, 4)
+        if attacker_strength > defender_strength:
+            return True, max(1, attacker_strength - defender_strength)
+        return False, max(1, defender_strength - attacker_strength)
+
+
+class Board:
+    """Immutable part of a position, shared by every clone and pickled once per search"""
+
+    def __init__(self, region_ids: Sequence[str], neighbors: Sequence[Sequence[int]],
+                 player_ids: Sequence[str], rules):
+        self.region_ids = tuple(region_ids)
+        # Region index -> indices it can attack
+        self.neighbors = tuple(tuple(links) for links in neighbors)
+        self.player_ids = tuple(player_ids)
+        self.rules = rules
+
+
+class SimState:
+    """Mutable part of a position: owner player index (-1 for none), soldiers and barracks per region"""
+    __slots__ = ('owners', 'soldiers', 'barracks', 'coins', 'turn')
+
+    def __init__(self, owners: array, soldiers: array, barracks: array, coins: array, turn: int):
+        self.owners = owners
+        self.soldiers = soldiers
+        self.barracks = barracks
+        self.coins = coins
+        self.turn = turn  # player index to move
+
+    def clone(self) -> 'SimState':
+        return SimState(self.owners[:], self.soldiers[:], self.barracks[:], self.coins[:], self.turn)
+
+
+def legal_moves(board: Board, state: SimState) -> List[Tuple]:
+    """Moves of the player to move: all-in or half attacks on each enemy neighbor, barracks, pass"""
+    player = state.turn
+    owners, soldiers = state.owners, state.soldiers
+    cost = board.rules.build_cost
+    can_build = cost is not None and state.coins[player] >= cost
+    moves = [PASS_MOVE]
+    for source, targets in enumerate(board.neighbors):
+        if owners[source] != player:
+            continue
+        available = soldiers[source] - 1
+        half = soldiers[source] // 2
+        frontier = False
+        for target in targets:
+            if owners[target] == player:
+                continue
+            frontier = True
+            if available >= 1:
+                moves.append((ATTACK, source, target, available))
+                if 2 <= half < available:
+                    moves.append((ATTACK, source, target, half))
+        if frontier and can_build and state.barracks[source] < MAX_BARRACKS:
+            moves.append((BUILD, source))
+    return moves
+
+
+def is_legal(board: Board, state: SimState, move: Tuple) -> bool:
+    """Whether a move found in another playout of the same tree node still applies here"""
+    kind = move[0]
+    if kind == ATTACK:
+        _, source, target, soldiers = move
+        return (state.owners[source] == state.turn and state.owners[target] != state.turn
+                and state.soldiers[source] > soldiers)
+    if kind == BUILD:
+        return (state.owners[move[1]] == state.turn and state.coins[state.turn] >= board.rules.build_cost
+                and state.barracks[move[1]] < MAX_BARRACKS)
+    return True
+
+
+def apply_move(board: Board, state: SimState, move: Tuple, rng: random.Random):
+    """Play a legal move for the player to move and pass the turn on"""
+    player = state.turn
+    kind = move[0]
+    if kind == ATTACK:
+        _, source, target, soldiers = move
+        attacker_wins, remaining = board.rules.battle(state, source, target, soldiers, rng)
+        state.soldiers[source] -= soldiers
+        state.soldiers[target] = remaining
+        if attacker_wins:
+            state.owners[target] = player
+    elif kind == BUILD:
+        state.coins[player] -= board.rules.build_cost
+        state.barracks[move[1]] += 1
+
+    # Next player that still holds a region
+    count = len(board.player_ids)
+    for step in range(1, count + 1):
+        following = (player + step) % count
+        if following in state.owners:
+            state.turn = following
+            return
+
+
+def playout_move(board: Board, state: SimState, rng: random.Random) -> Tuple:
+    """Cheap policy for playouts: a random all-in attack that outnumbers its target, else pass"""
+    player = state.turn
+    owners, soldiers = state.owners, state.soldiers
+    chosen = PASS_MOVE
+    seen = 0
+    for source, targets in enumerate(board.neighbors):
+        if owners[source] != player or soldiers[source] < 2:
+            continue
+        available = soldiers[source] - 1
+        for target in targets:
+            if owners[target] != player and available > soldiers[target]:
+                # Reservoir sampling keeps the choice uniform without building a list
+                seen += 1
+                if rng.random() * seen < 1:
+                    chosen = (ATTACK, source, target, available)
+    return chosen
+
+
+def rewards(board: Board, state: SimState) -> List[float]:
+    """Score of every player in [0, 1]: mostly share of regions, partly share of soldiers"""
+    count = len(board.player_ids)
+    regions = [0] * count
+    troops = [0] * count
+    for owner, soldiers in zip(state.owners, state.soldiers):
+        if owner >= 0:
+            regions[owner] += 1
+            troops[owner] += soldiers
+    total_regions = len(state.owners) or 1
+    total_troops = sum(troops) or 1
+    return [0.8 * regions[player] / total_regions + 0.2 * troops[player] / total_troops
+            for player in range(count)]
+
+
+class _Node:
+    __slots__ = ('move', 'player', 'children', 'untried', 'visits', 'value')
+
+    def __init__(self, move: Optional[Tuple], player: int):
+        self.move = move
+        self.player = player  # who made move; the node's value is from that player's side
+        self.children: List['_Node'] = []
+        self.untried: Optional[List[Tuple]] = None  # filled on the first visit
+        self.visits = 0
+        self.value = 0.0
+
+    def select(self) -> '_Node':
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child: child.value / child.visits
+                   + EXPLORATION * math.sqrt(log_visits / child.visits))
+
+
+def search(board: Board, state: SimState, time_budget: float, seed: int) -> Dict[Tuple, Tuple[int, float]]:
+    """
+    Grow one UCT tree from state for time_budget seconds
+    The tree is open loop: battles are random, so a node stands for a move
+    sequence and its moves are checked against each playout's own state.
+    Returns root move -> (visits, total value).
+    """
+    rng = random.Random(seed)
+    root = _Node(None, -1)
+    deadline = time.monotonic() + time_budget
+    iterations = 0
+    while iterations == 0 or time.monotonic() < deadline:
+        iterations += 1
+        node = root
+        position = state.clone()
+        path = [root]
+
+        # Selection down the expanded part of the tree
+        while not node.untried and node.children:
+            node = node.select()
+            if not is_legal(board, position, node.move):
+                break  # this playout's battles went another way, play it out from here
+            apply_move(board, position, node.move, rng)
+            path.append(node)
+        else:
+            # Expansion of one untried move
+            if node.untried is None:
+                node.untried = legal_moves(board, position)
+                rng.shuffle(node.untried)
+            if node.untried:
+                child = _Node(node.untried.pop(), position.turn)
+                node.children.append(child)
+                apply_move(board, position, child.move, rng)
+                path.append(child)
+
+        for _ in range(PLAYOUT_MOVES):
+            apply_move(board, position, playout_move(board, position, rng), rng)
+
+        scores = rewards(board, position)
+        for visited in path:
+            visited.visits += 1
+            if visited.player >= 0:
+                visited.value += scores[visited.player]
+    return {child.move: (child.visits, child.value) for child in root.children}
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_free_workers = 0
+_workers_freed = threading.Condition()
+
+
+def start_search_pool(workers: int = SEARCH_WORKERS) -> bool:
+    """
+    Fork the search processes; servers call this first, before they serve
+    Forked workers only need this module, where spawned ones would re-import
+    the server's __main__. Forking once up front, before request and timer
+    threads run, keeps a lock held by one of them out of the children.
+    Without a pool (not started, Android, or broken) bots search in-process.
+    """
+    global _pool, _free_workers
+    if workers < 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return False
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        # With fork the executor starts every worker on its first task
+        pool.submit(int).result()
+    except (ImportError, OSError, NotImplementedError, BrokenProcessPool):
+        return False
+    with _workers_freed:
+        _pool, _free_workers = pool, workers
+    return True
+
+
+def _claim_workers(wanted: int) -> Tuple[Optional[ProcessPoolExecutor], int]:
+    """The pool and up to wanted of its free processes, waiting for one if all are busy"""
+    global _free_workers
+    with _workers_freed:
+        _workers_freed.wait_for(lambda: _free_workers > 0 or _pool is None)
+        if _pool is None:
+            return None, 0
+        taken = min(wanted, _free_workers)
+        _free_workers -= taken
+        return _pool, taken
+
+
+def _release_workers(count: int):
+    global _free_workers
+    with _workers_freed:
+        _free_workers += count
+        _workers_freed.notify_all()
+
+
+def _discard_pool():
+    """Stop using a broken pool; forking a new one from a threaded server is not safe"""
+    global _pool
+    with _workers_freed:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+        _workers_freed.notify_all()
+
+
+def best_move(board: Board, state: SimState, time_budget: float = MOVE_BUDGET,
+              workers: int = SEARCH_WORKERS) -> Tuple:
+    """
+    Most visited root move over one tree per claimed search process
+    A move uses at most workers processes of the shared pool, fewer when other
+    moves hold them, and searches in-process when there is no pool.
+    """
+    moves = legal_moves(board, state)
+    if len(moves) == 1:
+        return moves[0]  # only pass, nothing to search
+    trees = None
+    pool, claimed = _claim_workers(workers) if workers >= 1 and _pool is not None else (None, 0)
+    if claimed:
+        try:
+            futures = [pool.submit(search, board, state, time_budget, random.getrandbits(64))
+                       for _ in range(claimed)]
+            trees = [future.result() for future in futures]
+        except (BrokenProcessPool, OSError, RuntimeError):
+            _discard_pool()  # a worker died; bots search in-process from now on
+        finally:
+            _release_workers(claimed)
+    if trees is None:
+        trees = [search(board, state, time_budget, random.getrandbits(64))]
+
+    totals: Dict[Tuple, List] = {}
+    for tree in trees:
+        for move, (visits, value) in tree.items():
+            total = totals.setdefault(move, [0, 0.0])
+            total[0] += visits
+            total[1] += value
+    return max(totals, key=lambda move: (totals[move][0], totals[move][1] / totals[move][0]))
+
+
+def _barracks(buildings) -> int:
+    # Servers keep a counter dict per region; the hotspot app keeps a list
+    return buildings.get('barracks', 0) if isinstance(buildings, dict) else 0
+
+
+def snapshot(game, player_id: str, rules, neighbors: Optional[Dict[str, List[str]]] = None) -> Tuple[Board, SimState]:
+    """
+    Compact position of game with player_id to move (caller holds game.lock)
+    Players follow the game's turn order, or join order for real-time games.
+    neighbors is the region_id -> attackable region_ids map of games whose
+    regions are plain dicts; GameRegions tables bring their own.
+    """
+    player_ids = list(game.turn_order) or list(game.players)
+    player_index = {pid: index for index, pid in enumerate(player_ids)}
+    regions = game.regions
+    topology = getattr(regions, 'topology', None)
+    if topology is not None:
+        region_ids = topology.region_ids
+        links = topology.neighbor_indices
+        owners = array('b', [player_index.get(owner, -1) for owner in regions.owners])
+        soldiers = array('i', regions.soldiers)
+        barracks = array('H', regions.buildings[BUILDING_SLOTS['barracks']::len(BUILDING_TYPES)])
+    else:
+        region_ids = tuple(regions)
+        index = {region_id: i for i, region_id in enumerate(region_ids)}
+        links = [[index[neighbor] for neighbor in neighbors.get(region_id, []) if neighbor in index]
+                 for region_id in region_ids]
+        owners = array('b', [player_index.get(regions[region_id]['owner'], -1) for region_id in region_ids])
+        soldiers = array('i', [regions[region_id]['soldiers'] for region_id in region_ids])
+        barracks = array('H', [_barracks(regions[region_id]['buildings']) for region_id in region_ids])
+    coins = array('i', [game.players[pid].get('coins', 0) for pid in player_ids])
+    board = Board(region_ids, links, player_ids, rules)
+    return board, SimState(owners, soldiers, barracks, coins, player_index[player_id])
+
+
+def game_move(board: Board, move: Tuple) -> Optional[Tuple]:
+    """A search move in region ids: ('attack', from, to, soldiers), ('build', region, 'barracks') or None to pass"""
+    if move[0] == ATTACK:
+        return 'attack', board.region_ids[move[1]], board.region_ids[move[2]], move[3]
+    if move[0] == BUILD:
+        return 'build', board.region_ids[move[1]], 'barracks'
+    return None
+
+
+def think(game, player_id: str, rules, neighbors: Optional[Dict[str, List[str]]] = None,
+          time_budget: float = MOVE_BUDGET, workers: int = SEARCH_WORKERS) -> Optional[Tuple]:
+    """Next move of player_id; holds game.lock only to copy the position, not while searching"""
+    with game.lock:
+        board, state = snapshot(game, player_id, rules, neighbors)
+    return game_move(board, best_move(board, state, time_budget, workers))
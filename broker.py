@@ -0,0 +1,172 @@
+"""
+Local pub/sub broker for sharded Iran War Game servers
+A stand-in for Redis pub/sub over a unix socket: shard processes publish
+Socket.IO room emits and lobby summaries on named channels and every
+subscriber of a channel receives them. BrokerManager plugs the broker into
+python-socketio, so a room emit reaches clients on every shard.
+
+frame := u8 op, u16 channel length, u32 payload length, channel, payload
+"""
+
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Dict, Iterator, Set, Tuple
+
+import socketio
+
+FRAME_HEADER = struct.Struct('<BHI')
+OP_SUBSCRIBE = 1
+OP_PUBLISH = 2
+OP_MESSAGE = 3
+# Seconds between reconnect attempts of a subscriber that lost the broker
+RECONNECT_DELAY = 1.0
+
+
+def send_frame(sock: socket.socket, op: int, channel: str, payload: bytes = b''):
+    name = channel.encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(op, len(name), len(payload)) + name + payload)
+
+
+def read_frame(stream) -> Tuple[int, str, bytes]:
+    """Next frame from a buffered socket file, EOFError when the peer closed"""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError
+    op, name_length, payload_length = FRAME_HEADER.unpack(header)
+    body = stream.read(name_length + payload_length)
+    if len(body) < name_length + payload_length:
+        raise EOFError
+    return op, body[:name_length].decode('utf-8'), body[name_length:]
+
+
+class _Subscriber:
+    __slots__ = ('sock', 'lock')
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()  # one frame at a time from concurrent publishers
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        subscriber = _Subscriber(self.request)
+        try:
+            while True:
+                op, channel, payload = read_frame(self.rfile)
+                if op == OP_SUBSCRIBE:
+                    self.server.subscribe(channel, subscriber)
+                elif op == OP_PUBLISH:
+                    self.server.publish(channel, payload)
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.server.unsubscribe(subscriber)
+
+
+class Broker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket pub/sub server, one thread per connected shard"""
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        if os.path.exists(path):
+            os.unlink(path)  # left over from a previous run
+        self.channels: Dict[str, Set[_Subscriber]] = {}
+        self.channels_lock = threading.Lock()
+        super().__init__(path, _BrokerHandler)
+
+    def subscribe(self, channel: str, subscriber: _Subscriber):
+        with self.channels_lock:
+            self.channels.setdefault(channel, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self.channels_lock:
+            for subscribers in self.channels.values():
+                subscribers.discard(subscriber)
+
+    def publish(self, channel: str, payload: bytes):
+        with self.channels_lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                with subscriber.lock:
+                    send_frame(subscriber.sock, OP_MESSAGE, channel, payload)
+            except OSError:
+                self.unsubscribe(subscriber)
+
+    def start(self) -> threading.Thread:
+        """Serve on a daemon thread"""
+        thread = threading.Thread(target=self.serve_forever, name='broker', daemon=True)
+        thread.start()
+        return thread
+
+
+class BrokerClient:
+    """Connection of one process to the broker: publish from any thread, listen on one"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._publisher = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def publish(self, channel: str, payload: bytes):
+        """Send payload to every subscriber of channel, reconnecting once if the broker restarted"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect()
+                    send_frame(self._publisher, OP_PUBLISH, channel, payload)
+                    return
+                except OSError:
+                    if self._publisher is not None:
+                        self._publisher.close()
+                    self._publisher = None
+                    if attempt:
+                        raise
+
+    def listen(self, *channels: str) -> Iterator[Tuple[str, bytes]]:
+        """(channel, payload) of every message on channels, resubscribing after a broker restart"""
+        while True:
+            try:
+                sock = self._connect()
+            except OSError:
+                time.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                for channel in channels:
+                    send_frame(sock, OP_SUBSCRIBE, channel)
+                stream = sock.makefile('rb')
+                while True:
+                    op, channel, payload = read_frame(stream)
+                    if op == OP_MESSAGE:
+                        yield channel, payload
+            except (EOFError, OSError):
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                sock.close()
+
+
+class BrokerManager(socketio.PubSubManager):
+    """python-socketio client manager that shares emits between shards through the broker"""
+    name = 'iranwar-broker'
+
+    def __init__(self, path: str, channel: str = 'socketio', write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = BrokerClient(path)
+
+    def _publish(self, data):
+        self.broker.publish(self.channel, pickle.dumps(data))
+
+    def _listen(self):
+        for _, message in self.broker.listen(self.channel):
+            yield message
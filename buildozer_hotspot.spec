@@ -9,7 +9,7 @@ package.domain = ir.iranwargame.hotspot
 source.main = hotspot_game_app.py
 
 # شامل کردن فایل‌ها
-source.include_exts = py,png,jpg,jpeg,txt,json
+source.include_exts = py,png,jpg,jpeg,txt,json,iwm
 
 # حذف فایل‌های غیرضروری
 source.exclude_exts = spec,pyc,pyo
@@ -13,7 +13,7 @@ package.domain = ir.iranwargame
 source.main = standalone_apk_app.py
 
 # شامل کردن فایل‌های اضافی
-source.include_exts = py,png,jpg,kv,atlas,json,txt,gif,svg
+source.include_exts = py,png,jpg,kv,atlas,json,txt,gif,svg,iwm
 
 # شامل کردن پوشه‌های اضافی
 source.include_patterns = assets/*,static/*,templates/*
@@ -5,6 +5,11 @@ import sys
 import threading
 import time
 from typing import Dict, List, Optional
+from urllib.parse import quote
+from map_format import load_map
+from room_outbox import BATCH_EVENT
+from state_sync import apply_diff
+from wire_codec import CODECS, ResyncRequired, decode_message
 
 # Initialize Pygame
 pygame.init()
@@ -36,6 +41,8 @@ class GameClient:
         self.game_state = "menu"  # menu, waiting, playing
         self.game_id = None
         self.player_id = None
+        self.reconnect_token = None
+        self.region_ids = None
         self.player_name = ""
         self.game_data = {}
         self.selected_region = None
@@ -43,7 +50,8 @@ class GameClient:
         self.server_ip = "localhost"
         self.server_port = 5000
         
-        # Socket.IO client
+        # Socket.IO client; event name -> handler, also for events unpacked from a batch
+        self.message_handlers = {}
         self.sio = socketio.Client()
         self.setup_socket_events()
         
@@ -62,32 +70,13 @@ class GameClient:
         """Create simplified Iran map regions"""
         regions = {}
         
-        # Define regions with approximate positions and neighbors
-        region_data = [
-            {"id": "tehran", "name": "تهران", "pos": (500, 300), "neighbors": ["qazvin", "semnan", "qom"]},
-            {"id": "isfahan", "name": "اصفهان", "pos": (450, 400), "neighbors": ["qom", "yazd", "chaharmahal"]},
-            {"id": "shiraz", "name": "شیراز", "pos": (400, 500), "neighbors": ["isfahan", "bushehr", "kerman"]},
-            {"id": "mashhad", "name": "مشهد", "pos": (650, 200), "neighbors": ["semnan", "khorasan"]},
-            {"id": "tabriz", "name": "تبریز", "pos": (350, 150), "neighbors": ["ardabil", "zanjan"]},
-            {"id": "ahvaz", "name": "اهواز", "pos": (300, 450), "neighbors": ["lorestan", "bushehr"]},
-            {"id": "qazvin", "name": "قزوین", "pos": (450, 250), "neighbors": ["tehran", "zanjan"]},
-            {"id": "semnan", "name": "سمنان", "pos": (550, 250), "neighbors": ["tehran", "mashhad"]},
-            {"id": "qom", "name": "قم", "pos": (475, 350), "neighbors": ["tehran", "isfahan"]},
-            {"id": "yazd", "name": "یزد", "pos": (500, 450), "neighbors": ["isfahan", "kerman"]},
-            {"id": "kerman", "name": "کرمان", "pos": (550, 500), "neighbors": ["yazd", "shiraz"]},
-            {"id": "bushehr", "name": "بوشهر", "pos": (350, 500), "neighbors": ["shiraz", "ahvaz"]},
-            {"id": "zanjan", "name": "زنجان", "pos": (400, 200), "neighbors": ["tabriz", "qazvin"]},
-            {"id": "ardabil", "name": "اردبیل", "pos": (350, 100), "neighbors": ["tabriz"]},
-            {"id": "lorestan", "name": "لرستان", "pos": (350, 400), "neighbors": ["ahvaz"]},
-            {"id": "chaharmahal", "name": "چهارمحال", "pos": (400, 450), "neighbors": ["isfahan"]},
-            {"id": "khorasan", "name": "خراسان", "pos": (700, 250), "neighbors": ["mashhad"]},
-        ]
-        
-        for region in region_data:
-            regions[region["id"]] = {
+        # Same map file as the server (maps.iwm)
+        map_data = load_map('iran')
+        for region_id, region in map_data.items():
+            regions[region_id] = {
                 "name": region["name"],
                 "pos": region["pos"],
-                "neighbors": region["neighbors"],
+                "neighbors": map_data.neighbors(region_id),
                 "owner": None,
                 "soldiers": 0,
                 "buildings": {"barracks": 0, "factory": 0, "bank": 0},
@@ -98,65 +87,142 @@ class GameClient:
     
     def setup_socket_events(self):
         """Setup Socket.IO event handlers"""
+        @self.sio.on(BATCH_EVENT)
+        def events(batch):
+            # A burst coalesced by a room outbox (offline_server.py), handled in order
+            for item in batch:
+                handler = self.message_handlers.get(item['event'])
+                if handler is not None:
+                    handler(item['data'])
+        
         @self.sio.event
         def connect():
             print("Connected to server")
             self.add_message("متصل به سرور شد")
+            if self.reconnect_token:
+                # Back after a dropped connection: take over the old player slot
+                self.sio.emit('rejoin_game', {
+                    'game_id': self.game_id,
+                    'reconnect_token': self.reconnect_token,
+                    'version': self.game_data.get('version', -1)
+                })
         
         @self.sio.event
         def disconnect():
             print("Disconnected from server")
             self.add_message("اتصال قطع شد")
         
-        @self.sio.event
+        @self.on_message
         def game_created(data):
             self.game_id = data['game_id']
             self.player_id = data['player_id']
+            self.reconnect_token = data['reconnect_token']
             self.game_data = data['game_state']
             self.game_state = "waiting"
             self.add_message(f"بازی {self.game_id} ایجاد شد")
         
-        @self.sio.event
+        @self.on_message
         def player_joined(data):
-            self.game_data = data['game_state']
+            if 'game_state' in data:
+                # Only the joining player gets the full snapshot
+                self.game_id = data['game_state']['game_id']
+                self.player_id = data['player_id']
+                self.reconnect_token = data['reconnect_token']
+                self.game_data = data['game_state']
+                self.game_state = "waiting"
+            else:
+                self.apply_diff(data['diff'])
             self.add_message(f"{data['player_name']} به بازی پیوست")
         
-        @self.sio.event
+        @self.on_message
         def game_started(data):
             self.game_data = data['game_state']
             self.game_state = "playing"
             self.add_message("بازی شروع شد!")
         
-        @self.sio.event
+        @self.on_message
         def attack_success(data):
-            self.game_data = data['game_state']
+            self.apply_diff(data['diff'])
             self.add_message("حمله موفق بود!")
         
-        @self.sio.event
+        @self.on_message
         def attack_failed(data):
             self.add_message("حمله ناموفق بود!")
         
-        @self.sio.event
+        @self.on_message
         def build_success(data):
-            self.game_data = data['game_state']
+            self.apply_diff(data['diff'])
             self.add_message("ساخت موفق بود!")
         
-        @self.sio.event
+        @self.on_message
         def build_failed(data):
             self.add_message("ساخت ناموفق بود!")
         
-        @self.sio.event
+        @self.on_message
         def error(data):
             self.add_message(f"خطا: {data['message']}")
         
-        @self.sio.event
+        @self.on_message
         def game_state_update(data):
             self.game_data = data
         
-        @self.sio.event
+        @self.on_message
         def soldiers_reduced(data):
-            self.game_data = data['game_state']
+            self.apply_diff(data['diff'])
             self.add_message("سربازها کاهش یافتند!")
+        
+        @self.on_message
+        def attacks_resolved(data):
+            self.apply_diff(data['diff'])
+        
+        @self.on_message
+        def rejoined(data):
+            self.player_id = data['player_id']
+            if 'game_state' in data:
+                self.game_data = data['game_state']
+            else:
+                for diff in data['diffs']:
+                    self.apply_diff(diff)
+            self.add_message("اتصال دوباره برقرار شد")
+        
+        @self.on_message
+        def player_reconnected(data):
+            self.apply_diff(data['diff'])
+        
+        @self.on_message
+        def player_disconnected(data):
+            self.apply_diff(data['diff'])
+        
+        @self.on_message
+        def state_diff(data):
+            self.apply_diff(data)
+        
+        @self.on_message
+        def state_diffs(data):
+            for diff in data['diffs']:
+                self.apply_diff(diff)
+    
+    def on_message(self, handler):
+        """Register handler for the socket event of its name, compact payloads arrive decoded"""
+        def receive(data):
+            if isinstance(data, bytes):
+                try:
+                    data, self.region_ids = decode_message(data, self.region_ids)
+                except ResyncRequired:
+                    # No full state yet to resolve diffs against: ask for one
+                    self.sio.emit('resync', {'game_id': self.game_id, 'version': None})
+                    return
+            handler(data)
+        self.message_handlers[handler.__name__] = handler
+        self.sio.on(handler.__name__, receive)
+        return handler
+    
+    def apply_diff(self, diff):
+        """Merge a state diff, asking the server to resync on a version gap"""
+        if not self.game_data:
+            return
+        if not apply_diff(self.game_data, diff):
+            self.sio.emit('resync', {'game_id': self.game_id, 'version': self.game_data.get('version', 0)})
     
     def add_message(self, message):
         """Add message to message list"""
@@ -164,10 +230,16 @@ class GameClient:
         if len(self.messages) > 10:
             self.messages.pop(0)
     
-    def connect_to_server(self):
-        """Connect to game server"""
+    def connect_to_server(self, game_id=None):
+        """Connect to game server, through a sharded router to the shard of game_id if given"""
         try:
-            self.sio.connect(f'http://{self.server_ip}:{self.server_port}')
+            if self.sio.connected:
+                self.sio.disconnect()
+            url = f'http://{self.server_ip}:{self.server_port}'
+            if game_id:
+                url += f'?game_id={quote(game_id)}'
+            # Servers that know the compact codec switch to it, others keep JSON
+            self.sio.connect(url, auth={'codecs': list(CODECS)})
             return True
         except Exception as e:
             self.add_message(f"خطا در اتصال: {str(e)}")
@@ -345,7 +417,7 @@ class GameClient:
                 if len(parts) >= 2:
                     self.player_name = parts[0]
                     game_id = parts[1]
-                    if self.connect_to_server():
+                    if self.connect_to_server(game_id):
                         self.sio.emit('join_game', {'game_id': game_id, 'player_name': self.player_name})
         
         elif self.input_rect.collidepoint(pos):
@@ -1,9 +1,93 @@
+// Compact wire format of server.py (wire_codec.py): JSON meta followed by packed region sections
+const BUILDING_TYPES = ['barracks', 'factory', 'bank'];
+const HAS_OWNER = 1, HAS_SOLDIERS = 2, HAS_BUILDINGS = 4, NO_OWNER = 0xFF;
+
+// Thrown for a diff that arrives before any full state; the receiver asks for one
+class ResyncRequired extends Error {}
+
+function decodeCompactMessage(buffer, regionIds) {
+    const view = new DataView(buffer);
+    const metaLength = view.getUint32(0, true);
+    const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, metaLength)));
+    const owners = meta.$owners || [];
+    delete meta.$owners;
+    
+    const sections = [];
+    let offset = 4 + metaLength;
+    while (offset < buffer.byteLength) {
+        const count = view.getUint32(offset, true);
+        offset += 4;
+        const records = [];
+        for (let i = 0; i < count; i++) {
+            const index = view.getUint32(offset, true);
+            const mask = view.getUint8(offset + 4);
+            offset += 5;
+            const fields = {};
+            if (mask & HAS_OWNER) {
+                const slot = view.getUint8(offset);
+                fields.owner = slot === NO_OWNER ? null : owners[slot];
+                offset += 1;
+            }
+            if (mask & HAS_SOLDIERS) {
+                fields.soldiers = view.getInt32(offset, true);
+                offset += 4;
+            }
+            if (mask & HAS_BUILDINGS) {
+                fields.buildings = {};
+                BUILDING_TYPES.forEach((building, slot) => {
+                    fields.buildings[building] = view.getUint16(offset + slot * 2, true);
+                });
+                offset += BUILDING_TYPES.length * 2;
+            }
+            records.push([index, fields]);
+        }
+        sections.push(records);
+    }
+    
+    // Swap section numbers back for region tables; full states bring the region ids of later diffs
+    const walk = (value) => {
+        if (Array.isArray(value)) {
+            return value.map(walk);
+        }
+        if (value === null || typeof value !== 'object') {
+            return value;
+        }
+        const result = {};
+        Object.entries(value).forEach(([key, item]) => {
+            if (key !== 'region_ids' && key !== 'region_static') {
+                result[key] = key === 'regions' && typeof item === 'number' ? item : walk(item);
+            }
+        });
+        if (typeof value.regions === 'number') {
+            const statics = value.region_static;
+            if (value.region_ids) {
+                regionIds = value.region_ids;
+            }
+            if (!regionIds) {
+                throw new ResyncRequired('compact diff received before a full state');
+            }
+            result.regions = {};
+            sections[value.regions].forEach(([index, fields]) => {
+                result.regions[regionIds[index]] = statics ? Object.assign({}, statics[index], fields) : fields;
+            });
+        }
+        return result;
+    };
+    const payload = walk(meta);
+    return { payload, regionIds };
+}
+
 class IranWarGame {
     constructor() {
         this.socket = null;
+        // Event name -> handler, also for events unpacked from a batch
+        this.messageHandlers = {};
         this.gameState = 'menu';
         this.gameId = null;
         this.playerId = null;
+        this.reconnectToken = null;
+        this.spectating = false;
+        this.regionIds = null;
         this.playerName = '';
         this.gameData = {};
         this.selectedRegion = null;
@@ -13,6 +97,12 @@ class IranWarGame {
         this.initializeElements();
         this.setupEventListeners();
         this.showScreen('main-menu');
+        
+        // ?spectate=<game_id> opens a read-only view of that game
+        const spectateId = new URLSearchParams(window.location.search).get('spectate');
+        if (spectateId) {
+            this.spectateGame(spectateId);
+        }
     }
     
     initializeElements() {
@@ -36,6 +126,7 @@ class IranWarGame {
         this.gameIdDisplay = document.getElementById('game-id-display');
         this.playersUl = document.getElementById('players-ul');
         this.startGameBtn = document.getElementById('start-game-btn');
+        this.addBotBtn = document.getElementById('add-bot-btn');
         this.leaveGameBtn = document.getElementById('leave-game-btn');
         
         // Game screen elements
@@ -69,6 +160,7 @@ class IranWarGame {
         
         // Waiting room events
         this.startGameBtn.addEventListener('click', () => this.startGame());
+        this.addBotBtn.addEventListener('click', () => this.addBot());
         this.leaveGameBtn.addEventListener('click', () => this.leaveGame());
         
         // Game events
@@ -104,17 +196,36 @@ class IranWarGame {
         });
     }
     
-    connectToServer() {
+    connectToServer(gameId = null) {
         if (this.socket && this.socket.connected) {
             return Promise.resolve();
         }
         
         return new Promise((resolve, reject) => {
-            this.socket = io();
+            // Offer the compact codec; servers that do not know it keep sending JSON.
+            // game_id lets a sharded deployment route the connection to the game's shard
+            this.socket = io({
+                auth: { codecs: ['compact', 'json'] },
+                query: gameId ? { game_id: gameId } : {}
+            });
+            this.socketEventsReady = false;
             
             this.socket.on('connect', () => {
                 console.log('Connected to server');
-                this.setupSocketEvents();
+                if (this.reconnectToken) {
+                    // Back after a dropped connection: take over the old player slot
+                    this.socket.emit('rejoin_game', {
+                        game_id: this.gameId,
+                        reconnect_token: this.reconnectToken,
+                        version: this.gameData.version
+                    });
+                } else if (this.spectating) {
+                    // The feed starts over with a full state
+                    this.socket.emit('spectate', { game_id: this.gameId });
+                } else if (!this.socketEventsReady) {
+                    this.setupSocketEvents();
+                    this.socketEventsReady = true;
+                }
                 resolve();
             });
             
@@ -127,9 +238,21 @@ class IranWarGame {
     }
     
     setupSocketEvents() {
-        this.socket.on('game_created', (data) => {
+        // A burst coalesced by a room outbox (offline_server.py), handled in order
+        this.socket.on('events', (batch) => {
+            batch.forEach(({ event, data }) => {
+                const handler = this.messageHandlers[event];
+                if (handler) {
+                    handler(data);
+                }
+            });
+        });
+        
+        this.onMessage('game_created', (data) => {
             this.gameId = data.game_id;
+            this.socket.io.opts.query = { game_id: data.game_id };
             this.playerId = data.player_id;
+            this.reconnectToken = data.reconnect_token;
             this.gameData = data.game_state;
             this.gameState = 'waiting';
             this.showScreen('waiting-room');
@@ -137,13 +260,23 @@ class IranWarGame {
             this.showNotification('بازی با موفقیت ایجاد شد', 'success');
         });
         
-        this.socket.on('player_joined', (data) => {
-            this.gameData = data.game_state;
+        this.onMessage('player_joined', (data) => {
+            if (data.game_state) {
+                // Only the joining player gets the full snapshot
+                this.gameId = data.game_state.game_id;
+                this.playerId = data.player_id;
+                this.reconnectToken = data.reconnect_token;
+                this.gameData = data.game_state;
+                this.gameState = 'waiting';
+                this.showScreen('waiting-room');
+            } else {
+                this.applyDiff(data.diff);
+            }
             this.updateWaitingRoom();
             this.showNotification(`${data.player_name} به بازی پیوست`, 'info');
         });
         
-        this.socket.on('game_started', (data) => {
+        this.onMessage('game_started', (data) => {
             this.gameData = data.game_state;
             this.gameState = 'playing';
             this.showScreen('game-screen');
@@ -152,55 +285,177 @@ class IranWarGame {
             this.showNotification('بازی شروع شد!', 'success');
         });
         
-        this.socket.on('attack_success', (data) => {
-            this.gameData = data.game_state;
+        this.onMessage('attack_success', (data) => {
+            this.applyDiff(data.diff);
             this.updateGameInterface();
             this.updateMap();
             this.showNotification('حمله موفق بود!', 'success');
             this.addMessage('حمله موفق بود!', 'success');
         });
         
-        this.socket.on('attack_failed', (data) => {
+        this.onMessage('attack_failed', (data) => {
             this.showNotification('حمله ناموفق بود!', 'error');
             this.addMessage('حمله ناموفق بود!', 'error');
         });
         
-        this.socket.on('build_success', (data) => {
-            this.gameData = data.game_state;
+        this.onMessage('build_success', (data) => {
+            this.applyDiff(data.diff);
             this.updateGameInterface();
             this.showNotification('ساخت موفق بود!', 'success');
             this.addMessage('ساخت موفق بود!', 'success');
         });
         
-        this.socket.on('build_failed', (data) => {
+        this.onMessage('build_failed', (data) => {
             this.showNotification('ساخت ناموفق بود!', 'error');
             this.addMessage('ساخت ناموفق بود!', 'error');
         });
         
-        this.socket.on('soldiers_reduced', (data) => {
-            this.gameData = data.game_state;
+        this.onMessage('soldiers_reduced', (data) => {
+            this.applyDiff(data.diff);
             this.updateGameInterface();
             this.updateMap();
             this.showNotification('سربازها کاهش یافتند!', 'warning');
             this.addMessage('سربازها کاهش یافتند!', 'warning');
         });
         
-        this.socket.on('game_over', (data) => {
+        this.onMessage('game_over', (data) => {
             this.gameState = 'game-over';
             this.showScreen('game-over');
             this.showGameOver(data);
         });
         
-        this.socket.on('player_disconnected', (data) => {
+        this.onMessage('state_diff', (diff) => {
+            this.applyDiff(diff);
+            this.refreshView();
+        });
+        
+        this.onMessage('state_diffs', (data) => {
+            data.diffs.forEach(diff => this.applyDiff(diff));
+            this.refreshView();
+        });
+        
+        this.onMessage('game_state_update', (state) => {
+            this.gameData = state;
+            this.refreshView();
+        });
+        
+        this.onMessage('spectator_frame', (frame) => {
+            // A full state, or the diffs since the previous frame; the ack asks for the next frame
+            if (frame.game_state) {
+                this.gameData = frame.game_state;
+            } else {
+                frame.diffs.forEach(diff => this.applyDiff(diff));
+            }
+            const gameState = this.gameData.game_state;
+            if (gameState !== this.gameState) {
+                this.gameState = gameState;
+                if (gameState === 'playing') {
+                    this.showScreen('game-screen');
+                    this.initializeGameMap();
+                } else {
+                    this.showScreen('waiting-room');
+                }
+            }
+            this.refreshView();
+            this.socket.emit('spectator_ack', { version: frame.version });
+        });
+        
+        this.onMessage('rejoined', (data) => {
+            this.playerId = data.player_id;
+            if (data.game_state) {
+                this.gameData = data.game_state;
+            } else {
+                data.diffs.forEach(diff => this.applyDiff(diff));
+            }
+            this.refreshView();
+            this.showNotification('اتصال دوباره برقرار شد', 'success');
+        });
+        
+        this.onMessage('player_reconnected', (data) => {
+            this.applyDiff(data.diff);
+            this.refreshView();
+        });
+        
+        this.onMessage('player_disconnected', (data) => {
+            this.applyDiff(data.diff);
             this.showNotification('بازیکنی از بازی خارج شد', 'warning');
             this.addMessage('بازیکنی از بازی خارج شد', 'warning');
         });
         
-        this.socket.on('error', (data) => {
+        this.onMessage('error', (data) => {
             this.showNotification(data.message, 'error');
         });
     }
     
+    onMessage(event, handler) {
+        // Compact payloads arrive as binary and are decoded before the handler sees them
+        this.messageHandlers[event] = handler;
+        this.socket.on(event, (data) => {
+            if (data instanceof ArrayBuffer) {
+                let decoded;
+                try {
+                    decoded = decodeCompactMessage(data, this.regionIds);
+                } catch (error) {
+                    if (!(error instanceof ResyncRequired)) {
+                        throw error;
+                    }
+                    this.socket.emit('resync', { game_id: this.gameId, version: null });
+                    return;
+                }
+                this.regionIds = decoded.regionIds;
+                data = decoded.payload;
+            }
+            handler(data);
+        });
+    }
+    
+    applyDiff(diff) {
+        // Merge a versioned state diff; a gap in versions asks the server to resync
+        if (!diff || this.gameData.version === undefined || diff.version <= this.gameData.version) {
+            return;
+        }
+        if (diff.version !== this.gameData.version + 1) {
+            this.socket.emit('resync', { game_id: this.gameId, version: this.gameData.version });
+            return;
+        }
+        
+        const players = this.gameData.players;
+        Object.entries(diff.players || {}).forEach(([playerId, fields]) => {
+            players[playerId] = Object.assign(players[playerId] || {}, fields);
+        });
+        (diff.removed_players || []).forEach(playerId => {
+            delete players[playerId];
+        });
+        Object.entries(diff.regions || {}).forEach(([regionId, fields]) => {
+            const region = this.gameData.regions[regionId];
+            if ('owner' in fields && fields.owner !== region.owner) {
+                // Player region lists are not sent, they follow ownership
+                const oldOwner = players[region.owner];
+                if (oldOwner && oldOwner.regions) {
+                    const index = oldOwner.regions.indexOf(regionId);
+                    if (index !== -1) oldOwner.regions.splice(index, 1);
+                }
+                const newOwner = players[fields.owner];
+                if (newOwner) {
+                    newOwner.regions = newOwner.regions || [];
+                    if (!newOwner.regions.includes(regionId)) newOwner.regions.push(regionId);
+                }
+            }
+            Object.assign(region, fields);
+        });
+        Object.assign(this.gameData, diff.game || {});
+        this.gameData.version = diff.version;
+    }
+    
+    refreshView() {
+        if (this.gameState === 'waiting') {
+            this.updateWaitingRoom();
+        } else if (this.gameState === 'playing') {
+            this.updateGameInterface();
+            this.updateMap();
+        }
+    }
+    
     async createGame() {
         const playerName = this.playerNameInput.value.trim();
         if (!playerName) {
@@ -240,7 +495,11 @@ class IranWarGame {
         this.playerName = playerName;
         
         try {
-            await this.connectToServer();
+            // A fresh connection, routed to the shard that hosts this game
+            if (this.socket) {
+                this.socket.disconnect();
+            }
+            await this.connectToServer(gameId);
             this.socket.emit('join_game', { 
                 player_name: playerName, 
                 game_id: gameId 
@@ -250,12 +509,29 @@ class IranWarGame {
         }
     }
     
+    async spectateGame(gameId) {
+        try {
+            await this.connectToServer(gameId);
+        } catch (error) {
+            this.showNotification('خطا در اتصال به سرور', 'error');
+            return;
+        }
+        this.gameId = gameId;
+        this.spectating = true;
+        this.socket.emit('spectate', { game_id: gameId });
+    }
+    
     startGame() {
         this.socket.emit('start_game', { game_id: this.gameId });
     }
     
+    addBot() {
+        this.socket.emit('add_bot', { game_id: this.gameId });
+    }
+    
     leaveGame() {
         if (this.socket) {
+            this.socket.emit('leave_game', { game_id: this.gameId });
             this.socket.disconnect();
         }
         this.resetGame();
@@ -266,6 +542,8 @@ class IranWarGame {
         this.gameState = 'menu';
         this.gameId = null;
         this.playerId = null;
+        this.reconnectToken = null;
+        this.spectating = false;
         this.playerName = '';
         this.gameData = {};
         this.selectedRegion = null;
@@ -308,7 +586,7 @@ class IranWarGame {
                 
                 const playerInfo = document.createElement('div');
                 playerInfo.innerHTML = `
-                    <strong>${player.name}</strong>
+                    <strong>${player.name}${player.is_bot ? ' (ربات)' : ''}</strong>
                     <small>سکه: ${player.coins} | سرباز: ${player.soldiers}</small>
                 `;
                 
@@ -318,11 +596,13 @@ class IranWarGame {
             });
         }
         
-        // Show start button only for host
+        // Show start and bot buttons only for host
         if (this.gameData.host === this.playerId) {
             this.startGameBtn.classList.remove('hidden');
+            this.addBotBtn.classList.remove('hidden');
         } else {
             this.startGameBtn.classList.add('hidden');
+            this.addBotBtn.classList.add('hidden');
         }
     }
     
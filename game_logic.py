@@ -1,6 +1,9 @@
 import random
 import math
 from typing import Dict, List, Optional, Tuple
+from battle_engine import BattleEngine
+from battle_odds import BattleOddsTable
+from map_topology import MapTopology, iter_bits
 
 class GameLogic:
     def __init__(self):
@@ -11,13 +14,19 @@ class GameLogic:
             'factory': {'income_multiplier': 1.5, 'cost': 500},
             'bank': {'income_bonus': 50, 'cost': 300}
         }
+        self.battle_engine = BattleEngine(self.battle_randomness)
+        self.odds_table = BattleOddsTable(battle_randomness=self.battle_randomness)
     
     def calculate_battle_result(self, attacking_soldiers: int, defending_soldiers: int, 
-                              attacker_buildings: Dict = None, defender_buildings: Dict = None) -> Tuple[bool, int, int]:
+                              attacker_buildings: Dict = None, defender_buildings: Dict = None,
+                              rng: Optional[random.Random] = None) -> Tuple[bool, int, int]:
         """
         Calculate battle result between attacking and defending forces
+        Pass the game's own rng so battles can be replayed from its seed
         Returns: (attacker_wins, remaining_attackers, remaining_defenders)
         """
+        if rng is None:
+            rng = random
         if attacker_buildings is None:
             attacker_buildings = {}
         if defender_buildings is None:
@@ -35,12 +44,12 @@ class GameLogic:
         defense_power *= (1 + defense_bonus + 0.2)  # Defender advantage
         
         # Add randomness
-        attack_power *= (1 + random.uniform(-self.battle_randomness, self.battle_randomness))
-        defense_power *= (1 + random.uniform(-self.battle_randomness, self.battle_randomness))
+        attack_power *= (1 + rng.uniform(-self.battle_randomness, self.battle_randomness))
+        defense_power *= (1 + rng.uniform(-self.battle_randomness, self.battle_randomness))
         
         # Calculate casualties
-        attacker_casualties = int(defending_soldiers * 0.3 + random.randint(0, defending_soldiers // 4))
-        defender_casualties = int(attacking_soldiers * 0.4 + random.randint(0, attacking_soldiers // 3))
+        attacker_casualties = int(defending_soldiers * 0.3 + rng.randint(0, defending_soldiers // 4))
+        defender_casualties = int(attacking_soldiers * 0.4 + rng.randint(0, attacking_soldiers // 3))
         
         # Apply casualties
         remaining_attackers = max(0, attacking_soldiers - attacker_casualties)
@@ -60,6 +69,95 @@ class GameLogic:
         
         return attacker_wins, remaining_attackers, remaining_defenders
     
+    def resolve_battles(self, regions: Dict, battles: List[Tuple[str, str, int]],
+                        region_neighbors: Dict, players: Dict = None,
+                        attacker_id: Optional[str] = None,
+                        rng: Optional[random.Random] = None) -> List[Dict]:
+        """
+        Resolve a batch of attacks in one pass and apply them to region state
+        Battles are (from_region, to_region, soldiers) and run in order, so a
+        later attack sees the result of earlier ones. Randomness for the whole
+        batch is drawn up front, and not at all when no battle is allowed.
+        Returns one result dict per battle.
+        """
+        if self.any_battle_allowed(regions, battles, region_neighbors, attacker_id):
+            rolls = self.battle_engine.draw_rolls(len(battles), rng)
+        else:
+            rolls = [None] * len(battles)
+        results = []
+        
+        for (from_region, to_region, soldiers), battle_rolls in zip(battles, rolls):
+            result = {
+                'from_region': from_region,
+                'to_region': to_region,
+                'soldiers': soldiers,
+                'valid': False,
+                'attacker_wins': False
+            }
+            results.append(result)
+            
+            if not self.battle_allowed(regions, from_region, to_region, soldiers, region_neighbors, attacker_id):
+                continue
+            
+            source = regions[from_region]
+            target = regions[to_region]
+            owner = source['owner']
+            
+            attacker_wins, remaining_attackers, remaining_defenders = self.battle_engine.resolve(
+                soldiers, target['soldiers'], battle_rolls,
+                source.get('buildings', {}).get('barracks', 0),
+                target.get('buildings', {}).get('barracks', 0)
+            )
+            
+            source['soldiers'] -= soldiers
+            if attacker_wins:
+                old_owner = target['owner']
+                if players is not None:
+                    if old_owner in players and to_region in players[old_owner]['regions']:
+                        players[old_owner]['regions'].remove(to_region)
+                    if owner in players:
+                        players[owner]['regions'].append(to_region)
+                target['owner'] = owner
+                target['soldiers'] = remaining_attackers
+            else:
+                target['soldiers'] = remaining_defenders
+            
+            result.update({
+                'valid': True,
+                'attacker': owner,
+                'attacker_wins': attacker_wins,
+                'remaining_attackers': remaining_attackers,
+                'remaining_defenders': remaining_defenders
+            })
+        
+        return results
+    
+    def battle_allowed(self, regions: Dict, from_region: str, to_region: str, soldiers: int,
+                       region_neighbors: Dict, attacker_id: Optional[str] = None) -> bool:
+        """Whether resolve_battles would fight this battle in the current state"""
+        if from_region not in regions or to_region not in regions:
+            return False
+        
+        source = regions[from_region]
+        owner = source['owner']
+        if owner is None or (attacker_id is not None and owner != attacker_id):
+            return False
+        if regions[to_region]['owner'] == owner:
+            return False
+        if to_region not in region_neighbors.get(from_region, []):
+            return False
+        return isinstance(soldiers, int) and 0 < soldiers < source['soldiers']
+    
+    def any_battle_allowed(self, regions: Dict, battles: List[Tuple[str, str, int]],
+                           region_neighbors: Dict, attacker_id: Optional[str] = None) -> bool:
+        """
+        Whether resolve_battles would change anything
+        The first battle of a batch to be fought is allowed before any other is
+        applied, so checking every battle against the current state is enough.
+        """
+        return any(self.battle_allowed(regions, from_region, to_region, soldiers, region_neighbors, attacker_id)
+                   for from_region, to_region, soldiers in battles)
+    
     def calculate_income(self, regions: List[Dict], buildings: Dict) -> int:
         """Calculate player's income based on regions and buildings"""
         base_income = len(regions) * 10  # 10 coins per region
@@ -90,6 +188,16 @@ class GameLogic:
     def is_valid_attack_target(self, attacker_regions: List[str], target_region: str, 
                               region_neighbors: Dict) -> bool:
         """Check if target region is valid for attack"""
+        if isinstance(region_neighbors, MapTopology):
+            # Bitmask path: any owned region that lists the target as neighbor.
+            # attacker_regions may already be an ownership mask.
+            topology = region_neighbors
+            if target_region not in topology.index:
+                return False
+            if not isinstance(attacker_regions, int):
+                attacker_regions = topology.mask_of(attacker_regions)
+            return bool(topology.incoming_masks[topology.index[target_region]] & attacker_regions)
+        
         # Check if attacker has a neighboring region
         for attacker_region in attacker_regions:
             if target_region in region_neighbors.get(attacker_region, []):
@@ -118,6 +226,18 @@ class GameLogic:
         
         return None
     
+    def get_territory_victory(self, regions, share: float = 0.5) -> Optional[str]:
+        """Player whose largest connected territory holds share of all regions"""
+        needed = len(regions) * share
+        for player_id in regions.owner_masks:
+            if regions.territory.largest_territory(player_id) >= needed:
+                return player_id
+        return None
+    
+    def calculate_territory_bonus(self, regions, player_id: str) -> int:
+        """Income bonus of 5 coins per region in the largest connected territory"""
+        return regions.territory.largest_territory(player_id) * 5
+    
     def calculate_region_value(self, region: Dict) -> int:
         """Calculate strategic value of a region"""
         base_value = 10
@@ -133,16 +253,7 @@ class GameLogic:
     def suggest_best_targets(self, attacker_regions: List[str], all_regions: Dict, 
                             region_neighbors: Dict) -> List[str]:
         """Suggest best targets for attack"""
-        possible_targets = []
-        
-        for attacker_region in attacker_regions:
-            neighbors = region_neighbors.get(attacker_region, [])
-            for neighbor in neighbors:
-                if neighbor not in attacker_regions:  # Not owned by attacker
-                    possible_targets.append(neighbor)
-        
-        # Remove duplicates
-        possible_targets = list(set(possible_targets))
+        possible_targets = self.frontier_targets(attacker_regions, region_neighbors)
         
         # Sort by strategic value
         target_values = []
@@ -154,29 +265,86 @@ class GameLogic:
         target_values.sort(key=lambda x: x[1], reverse=True)
         return [target for target, _ in target_values[:3]]  # Return top 3 targets
     
+    def suggest_likely_targets(self, attacker_regions: List[str], all_regions: Dict,
+                               region_neighbors: Dict) -> List[str]:
+        """Suggest targets by strategic value weighted by the odds of capturing them"""
+        possible_targets = self.frontier_targets(attacker_regions, region_neighbors)
+        
+        target_values = []
+        for target in possible_targets:
+            if target in all_regions:
+                value = self.calculate_region_value(all_regions[target])
+                win_probability = self.estimate_capture_probability(
+                    attacker_regions, target, all_regions, region_neighbors
+                )
+                target_values.append((target, value * win_probability, value))
+        
+        target_values.sort(key=lambda x: (x[1], x[2]), reverse=True)
+        return [target for target, _, _ in target_values[:3]]  # Return top 3 targets
+    
+    def frontier_targets(self, attacker_regions: List[str], region_neighbors: Dict) -> List[str]:
+        """Regions next to attacker_regions that the attacker does not own"""
+        if isinstance(region_neighbors, MapTopology):
+            owned_mask = region_neighbors.mask_of(attacker_regions)
+            return region_neighbors.ids_of(region_neighbors.frontier_mask(owned_mask))
+        
+        owned = set(attacker_regions)
+        return list({neighbor for attacker_region in attacker_regions
+                     for neighbor in region_neighbors.get(attacker_region, [])
+                     if neighbor not in owned})  # Not owned by attacker
+    
+    def estimate_capture_probability(self, attacker_regions: List[str], target_region: str,
+                                     all_regions: Dict, region_neighbors: Dict) -> float:
+        """Best win probability of attacking target from any adjacent owned region"""
+        target = all_regions[target_region]
+        defender_soldiers = target.get('soldiers', 0)
+        defender_barracks = target.get('buildings', {}).get('barracks', 0)
+        
+        if isinstance(region_neighbors, MapTopology):
+            topology = region_neighbors
+            sources = topology.incoming_masks[topology.index[target_region]] & topology.mask_of(attacker_regions)
+            attacker_regions = [topology.region_ids[i] for i in iter_bits(sources)]
+        else:
+            attacker_regions = [region for region in attacker_regions
+                                if target_region in region_neighbors.get(region, [])]
+        
+        best = 0.0
+        for attacker_region in attacker_regions:
+            source = all_regions.get(attacker_region, {})
+            # One soldier must stay behind in the source region
+            attacking_soldiers = source.get('soldiers', 0) - 1
+            if attacking_soldiers <= 0:
+                continue
+            odds = self.battle_odds(attacking_soldiers, defender_soldiers,
+                                    source.get('buildings', {}).get('barracks', 0), defender_barracks)
+            best = max(best, odds['win_probability'])
+        return best
+    
+    def battle_odds(self, attacker_soldiers: int, defender_soldiers: int,
+                    attacker_barracks: int = 0, defender_barracks: int = 0,
+                    simulations: int = 1000) -> Dict:
+        """Odds from the precomputed table, simulated when outside the grid"""
+        odds = self.odds_table.lookup(attacker_soldiers, defender_soldiers,
+                                      attacker_barracks, defender_barracks)
+        if odds is None:
+            odds = self.battle_engine.simulate(attacker_soldiers, defender_soldiers, simulations,
+                                               attacker_barracks, defender_barracks)
+        return odds
+    
     def simulate_battle_outcome(self, attacker_soldiers: int, defender_soldiers: int, 
-                               simulations: int = 100) -> Dict:
+                               simulations: int = 100, attacker_buildings: Dict = None,
+                               defender_buildings: Dict = None) -> Dict:
         """Simulate multiple battles to get probability of success"""
-        wins = 0
-        total_attacker_losses = 0
-        total_defender_losses = 0
-        
-        for _ in range(simulations):
-            attacker_wins, remaining_attackers, remaining_defenders = self.calculate_battle_result(
-                attacker_soldiers, defender_soldiers
-            )
-            
-            if attacker_wins:
-                wins += 1
-            
-            total_attacker_losses += (attacker_soldiers - remaining_attackers)
-            total_defender_losses += (defender_soldiers - remaining_defenders)
+        if attacker_buildings is None:
+            attacker_buildings = {}
+        if defender_buildings is None:
+            defender_buildings = {}
         
-        return {
-            'win_probability': wins / simulations,
-            'avg_attacker_losses': total_attacker_losses / simulations,
-            'avg_defender_losses': total_defender_losses / simulations
-        }
+        return self.battle_odds(
+            attacker_soldiers, defender_soldiers,
+            attacker_buildings.get('barracks', 0), defender_buildings.get('barracks', 0),
+            simulations
+        )
     
     def get_optimal_soldier_allocation(self, total_soldiers: int, regions: List[Dict], 
                                      threats: Dict) -> Dict:
@@ -208,3 +376,18 @@ class GameLogic:
                 allocation[region_id] = int(allocation[region_id] * scaling_factor)
         
         return allocation
+
+def parse_attacks(items, default_soldiers: int = 1) -> Optional[List[Tuple[str, str, int]]]:
+    """(from_region, to_region, soldiers) tuples of a JSON attack list, None if any item is malformed"""
+    if not isinstance(items, list):
+        return None
+    attacks = []
+    for attack in items:
+        if not isinstance(attack, dict):
+            return None
+        attack = (attack.get('from_region'), attack.get('to_region'), attack.get('soldiers', default_soldiers))
+        if not (isinstance(attack[0], str) and isinstance(attack[1], str)
+                and isinstance(attack[2], int) and not isinstance(attack[2], bool)):
+            return None
+        attacks.append(attack)
+    return attacks
@@ -1,249 +1,29 @@
 import random
-from typing import Dict, List, Tuple, Set
+from typing import Dict, List, Optional, Tuple, Set
+from map_topology import GameRegions, MapTopology
+from territory import connected_clusters
+from map_generator import generate_map
+from map_format import load_map
 
 class IranMap:
-    def __init__(self):
-        self.regions = self.create_regions()
-        self.region_neighbors = self.create_neighbor_map()
+    def __init__(self, regions: Optional[Dict] = None, region_neighbors: Optional[Dict[str, List[str]]] = None):
+        self.regions = regions if regions is not None else self.create_regions()
+        self.region_neighbors = region_neighbors if region_neighbors is not None else self.create_neighbor_map()
+        # Path tables are built on the first path query, not here
+        self.topology = MapTopology(self.regions, self.region_neighbors)
+    
+    @classmethod
+    def generated(cls, region_count: int, seed: Optional[int] = None) -> 'IranMap':
+        """Seeded synthetic map of region_count regions (see map_generator)"""
+        return cls(*generate_map(region_count, seed))
     
     def create_regions(self) -> Dict:
-        """Create Iran map regions with their properties"""
-        regions = {
-            "tehran": {
-                "name": "تهران",
-                "name_en": "Tehran",
-                "pos": (500, 300),
-                "strategic_value": 10,
-                "resource_type": "industrial",
-                "population": 100
-            },
-            "isfahan": {
-                "name": "اصفهان",
-                "name_en": "Isfahan",
-                "pos": (450, 400),
-                "strategic_value": 8,
-                "resource_type": "cultural",
-                "population": 80
-            },
-            "shiraz": {
-                "name": "شیراز",
-                "name_en": "Shiraz",
-                "pos": (400, 500),
-                "strategic_value": 7,
-                "resource_type": "cultural",
-                "population": 70
-            },
-            "mashhad": {
-                "name": "مشهد",
-                "name_en": "Mashhad",
-                "pos": (650, 200),
-                "strategic_value": 9,
-                "resource_type": "religious",
-                "population": 90
-            },
-            "tabriz": {
-                "name": "تبریز",
-                "name_en": "Tabriz",
-                "pos": (350, 150),
-                "strategic_value": 8,
-                "resource_type": "industrial",
-                "population": 85
-            },
-            "ahvaz": {
-                "name": "اهواز",
-                "name_en": "Ahvaz",
-                "pos": (300, 450),
-                "strategic_value": 9,
-                "resource_type": "oil",
-                "population": 75
-            },
-            "qazvin": {
-                "name": "قزوین",
-                "name_en": "Qazvin",
-                "pos": (450, 250),
-                "strategic_value": 5,
-                "resource_type": "agricultural",
-                "population": 50
-            },
-            "semnan": {
-                "name": "سمنان",
-                "name_en": "Semnan",
-                "pos": (550, 250),
-                "strategic_value": 4,
-                "resource_type": "mining",
-                "population": 40
-            },
-            "qom": {
-                "name": "قم",
-                "name_en": "Qom",
-                "pos": (475, 350),
-                "strategic_value": 7,
-                "resource_type": "religious",
-                "population": 60
-            },
-            "yazd": {
-                "name": "یزد",
-                "name_en": "Yazd",
-                "pos": (500, 450),
-                "strategic_value": 6,
-                "resource_type": "desert",
-                "population": 55
-            },
-            "kerman": {
-                "name": "کرمان",
-                "name_en": "Kerman",
-                "pos": (550, 500),
-                "strategic_value": 6,
-                "resource_type": "mining",
-                "population": 65
-            },
-            "bushehr": {
-                "name": "بوشهر",
-                "name_en": "Bushehr",
-                "pos": (350, 500),
-                "strategic_value": 8,
-                "resource_type": "port",
-                "population": 70
-            },
-            "zanjan": {
-                "name": "زنجان",
-                "name_en": "Zanjan",
-                "pos": (400, 200),
-                "strategic_value": 5,
-                "resource_type": "industrial",
-                "population": 45
-            },
-            "ardabil": {
-                "name": "اردبیل",
-                "name_en": "Ardabil",
-                "pos": (350, 100),
-                "strategic_value": 4,
-                "resource_type": "agricultural",
-                "population": 35
-            },
-            "lorestan": {
-                "name": "لرستان",
-                "name_en": "Lorestan",
-                "pos": (350, 400),
-                "strategic_value": 5,
-                "resource_type": "mountainous",
-                "population": 50
-            },
-            "chaharmahal": {
-                "name": "چهارمحال و بختیاری",
-                "name_en": "Chaharmahal",
-                "pos": (400, 450),
-                "strategic_value": 4,
-                "resource_type": "mountainous",
-                "population": 40
-            },
-            "khorasan": {
-                "name": "خراسان",
-                "name_en": "Khorasan",
-                "pos": (700, 250),
-                "strategic_value": 6,
-                "resource_type": "border",
-                "population": 60
-            },
-            "fars": {
-                "name": "فارس",
-                "name_en": "Fars",
-                "pos": (450, 520),
-                "strategic_value": 7,
-                "resource_type": "cultural",
-                "population": 75
-            },
-            "khuzestan": {
-                "name": "خوزستان",
-                "name_en": "Khuzestan",
-                "pos": (280, 480),
-                "strategic_value": 9,
-                "resource_type": "oil",
-                "population": 80
-            },
-            "mazandaran": {
-                "name": "مازندران",
-                "name_en": "Mazandaran",
-                "pos": (500, 180),
-                "strategic_value": 6,
-                "resource_type": "coastal",
-                "population": 65
-            },
-            "golestan": {
-                "name": "گلستان",
-                "name_en": "Golestan",
-                "pos": (580, 150),
-                "strategic_value": 5,
-                "resource_type": "agricultural",
-                "population": 50
-            },
-            "hamedan": {
-                "name": "همدان",
-                "name_en": "Hamedan",
-                "pos": (380, 300),
-                "strategic_value": 5,
-                "resource_type": "historical",
-                "population": 55
-            },
-            "kurdistan": {
-                "name": "کردستان",
-                "name_en": "Kurdistan",
-                "pos": (320, 250),
-                "strategic_value": 6,
-                "resource_type": "mountainous",
-                "population": 60
-            },
-            "west_azerbaijan": {
-                "name": "آذربایجان غربی",
-                "name_en": "West Azerbaijan",
-                "pos": (300, 150),
-                "strategic_value": 7,
-                "resource_type": "border",
-                "population": 70
-            },
-            "east_azerbaijan": {
-                "name": "آذربایجان شرقی",
-                "name_en": "East Azerbaijan",
-                "pos": (380, 120),
-                "strategic_value": 7,
-                "resource_type": "industrial",
-                "population": 75
-            }
-        }
-        
-        return regions
+        """Create Iran map regions with their properties (read-only, from maps.iwm)"""
+        return load_map('iran')
     
     def create_neighbor_map(self) -> Dict[str, List[str]]:
         """Create adjacency map for regions"""
-        neighbors = {
-            "tehran": ["qazvin", "semnan", "qom", "mazandaran"],
-            "isfahan": ["qom", "yazd", "chaharmahal", "lorestan"],
-            "shiraz": ["isfahan", "bushehr", "kerman", "fars"],
-            "mashhad": ["semnan", "khorasan", "golestan"],
-            "tabriz": ["ardabil", "zanjan", "east_azerbaijan"],
-            "ahvaz": ["lorestan", "bushehr", "khuzestan"],
-            "qazvin": ["tehran", "zanjan", "hamedan"],
-            "semnan": ["tehran", "mashhad", "mazandaran"],
-            "qom": ["tehran", "isfahan", "hamedan"],
-            "yazd": ["isfahan", "kerman", "fars"],
-            "kerman": ["yazd", "shiraz", "fars"],
-            "bushehr": ["shiraz", "ahvaz", "khuzestan"],
-            "zanjan": ["tabriz", "qazvin", "kurdistan"],
-            "ardabil": ["tabriz", "east_azerbaijan"],
-            "lorestan": ["ahvaz", "isfahan", "hamedan"],
-            "chaharmahal": ["isfahan", "lorestan"],
-            "khorasan": ["mashhad", "golestan"],
-            "fars": ["shiraz", "yazd", "kerman"],
-            "khuzestan": ["ahvaz", "bushehr"],
-            "mazandaran": ["tehran", "semnan", "golestan"],
-            "golestan": ["mazandaran", "mashhad", "khorasan"],
-            "hamedan": ["qazvin", "qom", "lorestan", "kurdistan"],
-            "kurdistan": ["zanjan", "hamedan", "west_azerbaijan"],
-            "west_azerbaijan": ["kurdistan", "east_azerbaijan"],
-            "east_azerbaijan": ["west_azerbaijan", "ardabil", "tabriz"]
-        }
-        
-        return neighbors
+        return load_map('iran').neighbor_map()
     
     def get_regions(self) -> Dict:
         """Get all regions with game properties"""
@@ -265,9 +45,13 @@ class IranMap:
         
         return game_regions
     
+    def new_game_regions(self) -> GameRegions:
+        """Get compact per-game region state backed by the shared topology"""
+        return self.topology.new_game_regions()
+    
     def are_neighbors(self, region1: str, region2: str) -> bool:
         """Check if two regions are neighbors"""
-        return region2 in self.region_neighbors.get(region1, [])
+        return self.topology.is_neighbor(region1, region2)
     
     def get_neighbors(self, region_id: str) -> List[str]:
         """Get all neighbors of a region"""
@@ -275,36 +59,23 @@ class IranMap:
     
     def get_distance(self, region1: str, region2: str) -> float:
         """Calculate distance between two regions"""
-        if region1 not in self.regions or region2 not in self.regions:
-            return float('inf')
-        
-        pos1 = self.regions[region1]["pos"]
-        pos2 = self.regions[region2]["pos"]
-        
-        return ((pos1[0] - pos2[0])**2 + (pos1[1] - pos2[1])**2)**0.5
+        return self.topology.distance(region1, region2)
     
     def get_shortest_path(self, start: str, end: str) -> List[str]:
         """Find shortest path between two regions using BFS"""
-        if start == end:
-            return [start]
-        
-        queue = [(start, [start])]
-        visited = {start}
-        
-        while queue:
-            current, path = queue.pop(0)
-            
-            for neighbor in self.get_neighbors(current):
-                if neighbor not in visited:
-                    new_path = path + [neighbor]
-                    
-                    if neighbor == end:
-                        return new_path
-                    
-                    queue.append((neighbor, new_path))
-                    visited.add(neighbor)
-        
-        return []  # No path found
+        return self.topology.path(start, end)
+    
+    def hops(self, region1: str, region2: str) -> int:
+        """Number of moves between two regions (-1 if unreachable)"""
+        return self.topology.hops(region1, region2)
+    
+    def distance(self, region1: str, region2: str) -> float:
+        """Precomputed distance between two regions"""
+        return self.topology.distance(region1, region2)
+    
+    def path(self, region1: str, region2: str) -> List[str]:
+        """Precomputed shortest path between two regions"""
+        return self.topology.path(region1, region2)
     
     def get_regions_by_resource(self, resource_type: str) -> List[str]:
         """Get all regions with specific resource type"""
@@ -338,13 +109,16 @@ class IranMap:
         avg_connectivity = sum(connectivity.values()) / len(connectivity)
         return [region_id for region_id, conn in connectivity.items() if conn > avg_connectivity]
     
-    def assign_regions_to_players(self, num_players: int) -> Dict[int, List[str]]:
+    def assign_regions_to_players(self, num_players: int,
+                                  rng: Optional[random.Random] = None) -> Dict[int, List[str]]:
         """Assign regions equally to players"""
+        if rng is None:
+            rng = random
         if num_players < 2 or num_players > 8:
             raise ValueError("Number of players must be between 2 and 8")
         
         regions_list = list(self.regions.keys())
-        random.shuffle(regions_list)
+        rng.shuffle(regions_list)
         
         regions_per_player = len(regions_list) // num_players
         assignments = {}
@@ -361,28 +135,5 @@ class IranMap:
         return assignments
     
     def get_region_clusters(self, regions: List[str]) -> List[List[str]]:
-        """Group regions into connected clusters"""
-        if not regions:
-            return []
-        
-        clusters = []
-        remaining = set(regions)
-        
-        while remaining:
-            # Start new cluster with any remaining region
-            cluster = []
-            queue = [remaining.pop()]
-            
-            while queue:
-                current = queue.pop(0)
-                cluster.append(current)
-                
-                # Add connected neighbors to queue
-                for neighbor in self.get_neighbors(current):
-                    if neighbor in remaining:
-                        queue.append(neighbor)
-                        remaining.remove(neighbor)
-            
-            clusters.append(cluster)
-        
-        return clusters
+        """Group regions into connected clusters, largest first"""
+        return connected_clusters(self.topology, regions)
@@ -0,0 +1,321 @@
+"""
+Write-ahead action journal and snapshots for Iran War Game servers
+Every logged game action is appended to a per-game binary log before the
+next fsync batch, and every SNAPSHOT_EVERY actions the game state, without
+its action log, is written to a snapshot file. After a crash a game is
+rebuilt from its snapshot plus the actions logged after it, so recovery
+replays at most SNAPSHOT_EVERY actions however long the match has run; the
+earlier records only refill the action log for replays.
+
+<game_id>.wal  := records
+record         := u32 payload length, u32 crc32 of payload, payload
+payload        := pickle of (kind, seq, version, data)
+<game_id>.snap := pickle of {init, seq, version, state, rng, regions}
+
+Finished games and games their server forgets have their files deleted.
+
+Only the server that wrote the files reads them back (they are pickles).
+"""
+
+import os
+import pickle
+import struct
+import threading
+import time
+import traceback
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+RECORD_HEADER = struct.Struct('<II')
+RECORD_INIT = 0    # data: constructor arguments of the game (game_id, host, seed)
+RECORD_ACTION = 1  # data: (action, args) as passed to log_action
+
+# Seconds writes wait for others before one fsync covers them all
+FSYNC_INTERVAL = 0.05
+# Logged actions between two snapshots, the most a recovery replays
+SNAPSHOT_EVERY = 200
+# A recovered game resumes its version this far ahead of the last one journaled,
+# past any commits made after that action, so clients never hold a newer version
+RESUME_VERSION_GAP = 1000
+
+WAL_SUFFIX = '.wal'
+SNAPSHOT_SUFFIX = '.snap'
+DATA_DIR_ENV = 'IRANWAR_DATA_DIR'
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'game_data')
+# Game attributes rebuilt by the constructor or held by the journal itself; the
+# action log is rebuilt from the log file, so snapshots stay the size of the state
+TRANSIENT = ('lock', 'sync', 'clock', 'game_map', 'region_data', 'neighbors', 'rng', 'regions', 'journal',
+             'action_log')
+
+
+def data_dir(name: str) -> str:
+    """Journal directory of one server, under $IRANWAR_DATA_DIR (game_data/ by default)"""
+    return os.path.join(os.environ.get(DATA_DIR_ENV, DEFAULT_DATA_DIR), name)
+
+
+def _clock(game):
+    """VersionClock of a game (StateSync games keep it in sync.clock)"""
+    sync = getattr(game, 'sync', None)
+    return sync.clock if sync is not None else game.clock
+
+
+def _finished(game) -> bool:
+    """Whether a game is over (Socket.IO servers call its status game_state)"""
+    return getattr(game, 'status', getattr(game, 'game_state', None)) == 'finished'
+
+
+def _frame(kind: int, seq: int, version: int, data) -> bytes:
+    payload = pickle.dumps((kind, seq, version, data), protocol=pickle.HIGHEST_PROTOCOL)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path: str) -> List[Tuple[int, int, int, object]]:
+    """Records of a log up to the first torn or corrupt one (the tail of an interrupted write)"""
+    return _scan(path)[0]
+
+
+def _scan(path: str) -> Tuple[List[Tuple[int, int, int, object]], int, int]:
+    """Intact records of a log, the length they take and the length of the file"""
+    records = []
+    try:
+        with open(path, 'rb') as wal:
+            data = wal.read()
+    except FileNotFoundError:
+        return records, 0, 0
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append(pickle.loads(payload))
+        offset += RECORD_HEADER.size + length
+    return records, offset, len(data)
+
+
+class Journal:
+    """
+    Action log and snapshots of every game of one server class
+    Disabled until recover() gives it a directory; track() and record() are
+    no-ops before that, so tools that build games in memory write nothing.
+    """
+
+    def __init__(self, game_class, transient: Iterable[str] = (), snapshot_every: int = SNAPSHOT_EVERY,
+                 fsync_interval: float = FSYNC_INTERVAL):
+        self.game_class = game_class
+        self.transient = frozenset(TRANSIENT) | frozenset(transient)
+        self.snapshot_every = snapshot_every
+        self.fsync_interval = fsync_interval
+        self.directory: Optional[str] = None
+        # game_id -> [constructor arguments, next action seq]
+        self._games: Dict[str, list] = {}
+        # Writes for the writer thread, in the order the games made them
+        self._pending: List[Tuple[str, str, bytes]] = []
+        self._queued = 0
+        self._written = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._files = {}
+
+    def _path(self, game_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, quote(game_id, safe='') + suffix)
+
+    def track(self, game, init_args: Tuple):
+        """Start journaling a new game; init_args rebuild it through game_class.replay"""
+        if self.directory is None:
+            return
+        with self._cond:
+            self._games[game.game_id] = [init_args, 0]
+            self._put('append', game.game_id, _frame(RECORD_INIT, 0, _clock(game).version, init_args))
+        game.journal = self
+
+    def record(self, game, action: str, args: Tuple):
+        """Append an action (called by log_action before it is logged or applied, under game.lock)"""
+        with self._cond:
+            entry = self._games.get(game.game_id)
+            if entry is None:
+                return
+            init_args, seq = entry
+            entry[1] += 1
+        # Encoded outside the journal lock; game.lock keeps this game's writes in order
+        snapshot = None
+        if seq and seq % self.snapshot_every == 0:
+            # State after actions 0..seq-1: the log can start over at seq
+            snapshot = self._snapshot(game, init_args, seq)
+        frame = _frame(RECORD_ACTION, seq, _clock(game).version, (action, args))
+        with self._cond:
+            if snapshot is not None:
+                self._put('snapshot', game.game_id, snapshot)
+            self._put('append', game.game_id, frame)
+
+    def forget(self, game_id: str):
+        """Stop journaling a removed game and delete its files"""
+        with self._cond:
+            if self._games.pop(game_id, None) is not None:
+                self._put('forget', game_id, b'')
+
+    def flush(self):
+        """Wait until everything recorded so far is on disk"""
+        with self._cond:
+            target = self._queued
+            self._cond.wait_for(lambda: self._written >= target)
+
+    def recover(self, directory: str) -> Dict:
+        """
+        Enable journaling into directory and rebuild the games found there
+        Each game is replayed from its snapshot and log tail, then snapshotted
+        again so the next recovery replays nothing it did. Finished games are
+        not rebuilt, their files are deleted.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        game_ids = {unquote(name[:-len(suffix)]) for name in os.listdir(directory)
+                    for suffix in (WAL_SUFFIX, SNAPSHOT_SUFFIX) if name.endswith(suffix)}
+        games = {}
+        for game_id in sorted(game_ids):
+            try:
+                game, init_args, seq = self._rebuild(game_id)
+            except Exception:
+                traceback.print_exc()  # one unreadable game must not keep the others down
+                continue
+            if _finished(game):
+                with self._cond:
+                    self._put('forget', game_id, b'')
+                continue
+            with self._cond:
+                self._games[game_id] = [init_args, seq]
+                self._put('snapshot', game_id, self._snapshot(game, init_args, seq))
+            game.journal = self
+            games[game_id] = game
+        return games
+
+    def _rebuild(self, game_id: str):
+        snapshot = None
+        try:
+            with open(self._path(game_id, SNAPSHOT_SUFFIX), 'rb') as file:
+                snapshot = pickle.load(file)
+        except FileNotFoundError:
+            pass
+        wal_path = self._path(game_id, WAL_SUFFIX)
+        records, intact, size = _scan(wal_path)
+        if intact < size:
+            # Cut a torn tail, or new records appended after it would be unreadable
+            with open(wal_path, 'r+b') as wal:
+                wal.truncate(intact)
+
+        if snapshot is not None:
+            init_args, seq, version = snapshot['init'], snapshot['seq'], snapshot['version']
+        elif records and records[0][0] == RECORD_INIT:
+            init_args, seq, version = records[0][3], 0, records[0][2]
+        else:
+            raise ValueError(f'no snapshot or start record for game {game_id}')
+
+        game = self.game_class.replay(*init_args, [])
+        if snapshot is not None:
+            self._restore(game, snapshot)
+        # The actions already in the snapshot only go back into the action log
+        logged = [(data[0],) + tuple(data[1]) for kind, record_seq, _, data in records
+                  if kind == RECORD_ACTION and record_seq < seq]
+        if len(logged) == seq:
+            game.action_log = logged
+        for kind, record_seq, record_version, data in records:
+            if kind != RECORD_ACTION or record_seq < seq:
+                continue  # already in the snapshot
+            if record_seq != seq:
+                break  # a gap: nothing after it can be replayed faithfully
+            action, args = data
+            getattr(game, action)(*args)
+            seq += 1
+            version = max(version, record_version)
+        _clock(game).resume(version + RESUME_VERSION_GAP)
+        return game, init_args, seq
+
+    def _snapshot(self, game, init_args: Tuple, seq: int) -> bytes:
+        regions = game.regions.dump() if hasattr(game.regions, 'dump') else game.regions
+        return pickle.dumps({
+            'init': init_args,
+            'seq': seq,
+            'version': _clock(game).version,
+            'state': {key: value for key, value in vars(game).items() if key not in self.transient},
+            'rng': game.rng.getstate(),
+            'regions': regions,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _restore(game, snapshot: Dict):
+        vars(game).update(snapshot['state'])
+        game.rng.setstate(snapshot['rng'])
+        if hasattr(game.regions, 'load'):
+            game.regions.load(snapshot['regions'])
+        else:
+            game.regions = snapshot['regions']
+
+    def _put(self, op: str, game_id: str, data: bytes):
+        """Queue a write (caller holds self._cond)"""
+        self._pending.append((op, game_id, data))
+        self._queued += 1
+        self._cond.notify_all()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='journal', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+            time.sleep(self.fsync_interval)  # let a burst of actions share one fsync
+            with self._cond:
+                batch, self._pending = self._pending, []
+            try:
+                self._write(batch)
+            except Exception:
+                traceback.print_exc()  # a full disk must not stop the game, only its journal
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+
+    def _write(self, batch: List[Tuple[str, str, bytes]]):
+        dirty = set()
+        for op, game_id, data in batch:
+            wal = self._files.get(game_id)
+            if op == 'append':
+                if wal is None:
+                    wal = self._files[game_id] = open(self._path(game_id, WAL_SUFFIX), 'ab')
+                wal.write(data)
+                dirty.add(game_id)
+            elif op == 'snapshot':
+                path = self._path(game_id, SNAPSHOT_SUFFIX)
+                with open(path + '.tmp', 'wb') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(path + '.tmp', path)
+                self._sync_directory()
+            elif op == 'forget':
+                dirty.discard(game_id)
+                if wal is not None:
+                    wal.close()
+                    del self._files[game_id]
+                for suffix in (WAL_SUFFIX, SNAPSHOT_SUFFIX):
+                    try:
+                        os.remove(self._path(game_id, suffix))
+                    except FileNotFoundError:
+                        pass
+        for game_id in dirty:
+            wal = self._files[game_id]
+            wal.flush()
+            os.fsync(wal.fileno())
+
+    def _sync_directory(self):
+        """Make a rename durable (not supported on every platform)"""
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -10,56 +10,48 @@ import sys
 import threading
 import time
 import socket
+import traceback
 import random
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import socketserver
+from bots import HotspotRules, start_search_pool, think
+from game_logic import parse_attacks
+from journal import Journal, data_dir
+from map_format import load_map
+from replays import REPLAY_MIMETYPE, record_replay
+from scheduler import Scheduler
+from state_sync import (SSE_KEEPALIVE, VersionClock, etag_matches, parse_version, state_cache, state_etag,
+                        wait_timeout)
 
-# Embedded game data and logic
-IRAN_REGIONS = {
-    'tehran': {'name': 'تهران', 'x': 400, 'y': 300, 'population': 15000000, 'type': 'capital'},
-    'isfahan': {'name': 'اصفهان', 'x': 380, 'y': 250, 'population': 5000000, 'type': 'cultural'},
-    'mashhad': {'name': 'مشهد', 'x': 500, 'y': 320, 'population': 3500000, 'type': 'religious'},
-    'shiraz': {'name': 'شیراز', 'x': 380, 'y': 200, 'population': 2000000, 'type': 'cultural'},
-    'tabriz': {'name': 'تبریز', 'x': 320, 'y': 380, 'population': 1800000, 'type': 'industrial'},
-    'ahvaz': {'name': 'اهواز', 'x': 300, 'y': 220, 'population': 1500000, 'type': 'industrial'},
-    'qom': {'name': 'قم', 'x': 390, 'y': 280, 'population': 1200000, 'type': 'religious'},
-    'karaj': {'name': 'کرج', 'x': 390, 'y': 310, 'population': 1100000, 'type': 'industrial'},
-    'urmia': {'name': 'ارومیه', 'x': 300, 'y': 380, 'population': 900000, 'type': 'cultural'},
-    'arak': {'name': 'اراک', 'x': 370, 'y': 270, 'population': 800000, 'type': 'industrial'},
-    'yazd': {'name': 'یزد', 'x': 420, 'y': 240, 'population': 700000, 'type': 'cultural'},
-    'ardabil': {'name': 'اردبیل', 'x': 340, 'y': 400, 'population': 650000, 'type': 'industrial'},
-    'bandar_abbas': {'name': 'بندرعباس', 'x': 420, 'y': 160, 'population': 600000, 'type': 'port'},
-    'abadan': {'name': 'آبادان', 'x': 280, 'y': 200, 'population': 400000, 'type': 'port'},
-    'kish': {'name': 'کیش', 'x': 430, 'y': 150, 'population': 50000, 'type': 'port'}
-}
-
-REGION_NEIGHBORS = {
-    'tehran': ['karaj', 'qom', 'arak'],
-    'isfahan': ['yazd', 'shiraz', 'arak'],
-    'mashhad': ['ardabil'],
-    'shiraz': ['isfahan', 'yazd'],
-    'tabriz': ['urmia', 'ardabil'],
-    'ahvaz': ['abadan'],
-    'qom': ['tehran', 'arak'],
-    'karaj': ['tehran'],
-    'urmia': ['tabriz'],
-    'arak': ['tehran', 'qom', 'isfahan'],
-    'yazd': ['isfahan', 'shiraz'],
-    'ardabil': ['tabriz', 'mashhad'],
-    'bandar_abbas': ['kish'],
-    'abadan': ['ahvaz'],
-    'kish': ['bandar_abbas']
-}
+# Game map, memory-mapped from maps.iwm (shared with standalone_apk_app.py)
+IRAN_REGIONS = load_map('hotspot')
+REGION_NEIGHBORS = IRAN_REGIONS.neighbor_map()
+
+# Worker threads serving requests; each held long-poll occupies one, and so does
+# an idle keep-alive connection for up to KEEPALIVE_TIMEOUT seconds
+MAX_WORKERS = 64
+# Seconds an idle keep-alive connection (or a stalled client) may hold a worker
+KEEPALIVE_TIMEOUT = 30
+# SSE streams run on their own threads outside the worker pool, at most this
+# many at once; further /api/events requests get 503 and retry later
+MAX_SSE_STREAMS = 256
+# Seconds of search per bot move
+BOT_BUDGET = 1.0
+# Seconds without activity after which a game is removed, journal files included
+GAME_TTL = 2 * 60 * 60
 
 # Global game state
 games = {}
+games_lock = threading.Lock()
 
 class GameState:
-    def __init__(self, game_id, host_name):
+    def __init__(self, game_id, host_name, seed=None, regions=None, neighbors=None):
         self.game_id = game_id
+        self.host_name = host_name
         self.players = {}
         self.regions = {}
         self.status = 'waiting'  # waiting, playing, finished
@@ -67,9 +59,25 @@ class GameState:
         self.turn_order = []
         self.created_time = time.time()
         self.last_activity = time.time()
+        # Every random draw of this game goes through its own generator, so a
+        # game is reproducible from (seed, action_log)
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.action_log = []
+        # Write-ahead log of this game's actions, set once it is journaled
+        self.journal = None
+        # State version that wait_state and the SSE stream block on
+        self.clock = VersionClock()
+        # Held by every request that reads or changes this game
+        self.lock = threading.RLock()
+        # Turn a bot player is already thinking about
+        self.bot_turn = None
+        # Embedded Iran map unless a generated one is given (map_generator.hotspot_regions)
+        self.region_data = regions if regions is not None else IRAN_REGIONS
+        self.neighbors = neighbors if neighbors is not None else REGION_NEIGHBORS
         
         # Initialize regions
-        for region_id, region_data in IRAN_REGIONS.items():
+        for region_id, region_data in self.region_data.items():
             self.regions[region_id] = {
                 **region_data,
                 'owner': None,
@@ -78,7 +86,7 @@ class GameState:
             }
         
         # Add host player
-        host_id = f'player_{random.randint(1000, 9999)}'
+        host_id = f'player_{self.rng.randint(1000, 9999)}'
         self.players[host_id] = {
             'id': host_id,
             'name': host_name,
@@ -87,17 +95,38 @@ class GameState:
             'soldiers': 50,
             'regions': [],
             'buildings': {},
-            'is_host': True
+            'is_host': True,
+            'is_bot': False
         }
     
-    def add_player(self, player_name):
+    @classmethod
+    def replay(cls, game_id, host_name, seed, action_log, regions=None, neighbors=None):
+        """Rebuild a game exactly from its seed and action log"""
+        game = cls(game_id, host_name, seed=seed, regions=regions, neighbors=neighbors)
+        for action, *args in action_log:
+            getattr(game, action)(*args)
+        return game
+    
+    def init_args(self):
+        """Arguments of replay() that rebuild this game before its first action"""
+        return self.game_id, self.host_name, self.seed
+    
+    def log_action(self, action, *args):
+        """Record a state-changing call for replay"""
+        if self.journal is not None:
+            self.journal.record(self, action, args)
+        self.action_log.append((action,) + args)
+    
+    def add_player(self, player_name, is_bot=False):
         if len(self.players) >= 8:
             return None
         
+        self.log_action('add_player', player_name, is_bot)
+        
         colors = ['#3498db', '#2ecc71', '#f39c12', '#9b59b6', '#1abc9c', '#e67e22', '#95a5a6']
         player_color = colors[len(self.players) - 1] if len(self.players) <= len(colors) else '#888888'
         
-        player_id = f'player_{random.randint(1000, 9999)}'
+        player_id = f'player_{self.rng.randint(1000, 9999)}'
         self.players[player_id] = {
             'id': player_id,
             'name': player_name,
@@ -106,7 +135,8 @@ class GameState:
             'soldiers': 50,
             'regions': [],
             'buildings': {},
-            'is_host': False
+            'is_host': False,
+            'is_bot': is_bot
         }
         
         self.last_activity = time.time()
@@ -116,13 +146,15 @@ class GameState:
         if len(self.players) < 2:
             return False
         
+        self.log_action('start_game')
+        
         self.status = 'playing'
         self.turn_order = list(self.players.keys())
-        random.shuffle(self.turn_order)
+        self.rng.shuffle(self.turn_order)
         
         # Distribute regions
         regions_list = list(self.regions.keys())
-        random.shuffle(regions_list)
+        self.rng.shuffle(regions_list)
         
         regions_per_player = len(regions_list) // len(self.players)
         region_index = 0
@@ -158,12 +190,14 @@ class GameState:
             return False, "سربازان کافی ندارید"
         
         # Check if regions are neighbors
-        if to_region not in REGION_NEIGHBORS.get(from_region, []):
+        if to_region not in self.neighbors.get(from_region, []):
             return False, "مناطق همسایه نیستند"
         
+        self.log_action('execute_attack', player_id, from_region, to_region, soldiers)
+        
         # Battle calculation
-        attacker_strength = soldiers + random.randint(-2, 3)
-        defender_strength = self.regions[to_region]['soldiers'] + random.randint(-1, 4)
+        attacker_strength = soldiers + self.rng.randint(-2, 3)
+        defender_strength = self.regions[to_region]['soldiers'] + self.rng.randint(-1, 4)
         
         # Execute attack
         self.regions[from_region]['soldiers'] -= soldiers
@@ -188,13 +222,72 @@ class GameState:
             self.next_turn()
             return False, f"حمله ناموفق! {remaining} سرباز دشمن باقی ماند"
     
+    def execute_attacks(self, player_id, attacks):
+        """Resolve a batch of (from_region, to_region, soldiers) attacks as one turn"""
+        if self.get_current_player() != player_id:
+            return False, "نوبت شما نیست", []
+        
+        self.log_action('execute_attacks', player_id, attacks)
+        
+        # Draw all battle randomness for the batch up front
+        rolls = [(self.rng.randint(-2, 3), self.rng.randint(-1, 4)) for _ in attacks]
+        results = []
+        
+        for (from_region, to_region, soldiers), (attack_roll, defense_roll) in zip(attacks, rolls):
+            result = {'from_region': from_region, 'to_region': to_region, 'soldiers': soldiers,
+                      'valid': False, 'attacker_wins': False}
+            results.append(result)
+            
+            if from_region not in self.regions or to_region not in self.regions:
+                continue
+            if self.regions[from_region]['owner'] != player_id:
+                continue
+            if self.regions[to_region]['owner'] == player_id:
+                continue
+            if self.regions[from_region]['soldiers'] <= soldiers:
+                continue
+            if to_region not in self.neighbors.get(from_region, []):
+                continue
+            
+            attacker_strength = soldiers + attack_roll
+            defender_strength = self.regions[to_region]['soldiers'] + defense_roll
+            self.regions[from_region]['soldiers'] -= soldiers
+            
+            if attacker_strength > defender_strength:
+                old_owner = self.regions[to_region]['owner']
+                if old_owner and old_owner in self.players:
+                    self.players[old_owner]['regions'].remove(to_region)
+                self.regions[to_region]['owner'] = player_id
+                self.regions[to_region]['soldiers'] = max(1, attacker_strength - defender_strength)
+                self.players[player_id]['regions'].append(to_region)
+                result['attacker_wins'] = True
+            else:
+                self.regions[to_region]['soldiers'] = max(1, defender_strength - attacker_strength)
+            result['valid'] = True
+        
+        self.next_turn()
+        captured = sum(1 for result in results if result['attacker_wins'])
+        return True, f"{captured} منطقه از {len(results)} حمله تصرف شد", results
+    
     def next_turn(self):
         self.current_turn += 1
         self.last_activity = time.time()
     
+    def changed(self):
+        """Advance the state version after a mutation, waking long-poll and SSE clients"""
+        state_cache.invalidate(self.game_id)
+        self.clock.advance()
+    
+    def cached_view(self, view):
+        """(version, cached encoding) of the current state, e.g. view=state_cache.reply"""
+        with self.lock:
+            version = self.clock.version
+            return version, view(self.game_id, version, self.get_state)
+    
     def get_state(self):
         return {
             'game_id': self.game_id,
+            'version': self.clock.version,
             'status': self.status,
             'players': self.players,
             'regions': self.regions,
@@ -309,6 +402,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             <div id="players-list" class="players-list"></div>
             <div class="controls">
                 <button id="start-btn" class="btn btn-success hidden" onclick="startGame()">شروع بازی</button>
+                <button id="add-bot-btn" class="btn btn-primary hidden" onclick="addBot()">افزودن ربات</button>
                 <button class="btn btn-danger" onclick="leaveGame()">خروج</button>
             </div>
         </div>
@@ -337,7 +431,8 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         let gameState = null;
         let myPlayerId = null;
         let selectedRegion = null;
-        let pollInterval = null;
+        let polling = false;
+        let stateVersion = -1;
 
         function showMenu() {
             hideAllScreens();
@@ -442,29 +537,31 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         }
 
         function startPolling() {
-            if (pollInterval) clearInterval(pollInterval);
-            pollInterval = setInterval(updateGameState, 2000);
+            if (polling) return;
+            polling = true;
+            stateVersion = -1;
+            waitForState();
         }
 
-        async function updateGameState() {
-            if (!myPlayerId) return;
-
-            try {
-                const gameId = document.getElementById('current-game-id').textContent;
-                const response = await fetch('/api/get_game_state', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({game_id: gameId})
-                });
-                
-                const result = await response.json();
-                if (result.success) {
-                    gameState = result.game_state;
-                    updateUI();
+        // Long-poll: the server answers only when the game version moves past stateVersion
+        async function waitForState() {
+            while (polling && myPlayerId) {
+                try {
+                    const gameId = document.getElementById('current-game-id').textContent;
+                    const response = await fetch(`/api/wait_state?game_id=${encodeURIComponent(gameId)}&since=${stateVersion}`);
+                    const result = await response.json();
+                    if (!result.success) break;
+                    if (result.changed) {
+                        gameState = result.game_state;
+                        stateVersion = result.version;
+                        updateUI();
+                    }
+                } catch (error) {
+                    console.error('خطا در بروزرسانی:', error);
+                    await new Promise(resolve => setTimeout(resolve, 2000));
                 }
-            } catch (error) {
-                console.error('خطا در بروزرسانی:', error);
             }
+            polling = false;
         }
 
         function updateUI() {
@@ -492,6 +589,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
                 div.innerHTML = `
                     <strong>${player.name}</strong>
                     ${player.is_host ? '<br><small>(میزبان)</small>' : ''}
+                    ${player.is_bot ? '<br><small>(ربات)</small>' : ''}
                 `;
                 playersList.appendChild(div);
             });
@@ -500,6 +598,9 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             if (gameState.players[myPlayerId]?.is_host && Object.keys(gameState.players).length >= 2) {
                 startBtn.classList.remove('hidden');
             }
+            if (gameState.players[myPlayerId]?.is_host) {
+                document.getElementById('add-bot-btn').classList.remove('hidden');
+            }
         }
 
         function updateGameScreen() {
@@ -578,6 +679,22 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             }
         }
 
+        async function addBot() {
+            try {
+                const gameId = document.getElementById('current-game-id').textContent;
+                const response = await fetch('/api/add_bot', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({game_id: gameId, player_id: myPlayerId})
+                });
+                
+                const result = await response.json();
+                showMessage(result.message, result.success ? 'success' : 'error');
+            } catch (error) {
+                showMessage('خطا در افزودن ربات', 'error');
+            }
+        }
+
         function showAttackDialog() {
             if (!selectedRegion) {
                 showMessage('ابتدا یک منطقه انتخاب کنید', 'error');
@@ -620,7 +737,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         }
 
         function leaveGame() {
-            if (pollInterval) clearInterval(pollInterval);
+            polling = false;
             gameState = null;
             myPlayerId = null;
             selectedRegion = null;
@@ -641,17 +758,142 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     </script>
 </body>
 </html>'''
+HTML_PAGE = HTML_TEMPLATE.encode('utf-8')
+
+# Action log and snapshots of every game, so a killed app resumes its matches
+journal = Journal(GameState, transient=('bot_turn',))
+# Idle expiry of every game
+scheduler = Scheduler()
+
+# Bots wait for their searches here, off the HTTP workers
+bot_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='bot')
+bot_rules = HotspotRules()
+
+def schedule_bot_turn(game):
+    """Start the move of a bot that has the turn, once per turn"""
+    with game.lock:
+        player_id = game.get_current_player()
+        if game.status != 'playing' or not game.players[player_id].get('is_bot') or game.bot_turn == game.current_turn:
+            return
+        game.bot_turn = game.current_turn
+        bot_executor.submit(play_bot_turn, game, player_id, game.current_turn)
+
+def play_bot_turn(game, player_id, turn):
+    """Search a bot's move without the game lock, then play it unless the turn moved on"""
+    try:
+        move = think(game, player_id, bot_rules, game.neighbors, time_budget=BOT_BUDGET)
+    except Exception:
+        traceback.print_exc()  # a failed search must not leave the game stuck on the bot, it passes instead
+        move = None
+    with game.lock:
+        if game.current_turn != turn or games.get(game.game_id) is not game:
+            return
+        if move is not None:
+            game.execute_attack(player_id, *move[1:])
+        if game.current_turn == turn:
+            game.execute_attacks(player_id, [])  # an empty batch passes the turn, also after a rejected move
+        game.changed()
+    # The next player may be a bot too
+    schedule_bot_turn(game)
+
+def stream_events(server, connection, game, version):
+    """Write one SSE 'state' event per game version to a detached connection until it or the game goes away"""
+    try:
+        while games.get(game.game_id) is game:
+            if game.clock.wait(version, SSE_KEEPALIVE) > version:
+                version, event = game.cached_view(state_cache.event)
+                connection.sendall(event)
+            else:
+                connection.sendall(b': keep-alive\n\n')
+    except (BrokenPipeError, ConnectionResetError, TimeoutError):
+        pass  # client went away or stopped reading
+    finally:
+        server.sse_slots.release()
+        server.close_detached(connection)
+
+def expire_game(game_id):
+    """Remove a game idle for GAME_TTL, or check again at its new deadline"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    deadline = game.last_activity + GAME_TTL
+    if time.time() < deadline:
+        scheduler.call_at(deadline, expire_game, game_id)
+        return
+    
+    with games_lock:
+        games.pop(game_id, None)
+    journal.forget(game_id)
+    state_cache.invalidate(game_id)
+    print(f'🗑️  بازی {game_id} به دلیل عدم فعالیت حذف شد')
+
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that serves connections from a fixed pool of worker threads"""
+    
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS, max_streams=MAX_SSE_STREAMS):
+        super().__init__(server_address, handler_class)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http')
+        self.sse_slots = threading.BoundedSemaphore(max_streams)
+        self.detached = set()
+    
+    def process_request(self, request, client_address):
+        # Connections beyond max_workers wait in the pool queue instead of spawning threads
+        self.pool.submit(self.process_request_thread, request, client_address)
+    
+    def detach(self, request):
+        """Keep a connection open after its handler returns, the caller closes it with close_detached"""
+        self.detached.add(request)
+    
+    def close_detached(self, request):
+        self.detached.discard(request)
+        socketserver.TCPServer.shutdown_request(self, request)
+    
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            return
+        super().shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
 
 class GameHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests; every reply sends Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; Nagle would hold the body for the client's delayed ACK
+    disable_nagle_algorithm = True
+    
     def do_GET(self):
-        if self.path == '/' or self.path == '/index.html':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(HTML_TEMPLATE.encode('utf-8'))
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        
+        if url.path == '/' or url.path == '/index.html':
+            self.send_body(HTML_PAGE, content_type='text/html; charset=utf-8')
+        elif url.path == '/api/wait_state':
+            self.handle_wait_state(query)
+        elif url.path == '/api/events':
+            self.handle_events(query)
+        elif url.path == '/api/replay':
+            self.handle_replay(query)
         else:
             self.send_error(404)
     
+    def send_json(self, response):
+        self.send_body(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+    
+    def send_body(self, body, status=200, headers=None, content_type='application/json; charset=utf-8'):
+        """Send an already encoded body"""
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_POST(self):
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
@@ -671,25 +913,29 @@ class GameHandler(BaseHTTPRequestHandler):
             response = self.handle_join_game(data)
         elif path == '/api/start_game':
             response = self.handle_start_game(data)
+        elif path == '/api/add_bot':
+            response = self.handle_add_bot(data)
         elif path == '/api/get_game_state':
-            response = self.handle_get_game_state(data)
+            self.handle_get_game_state(data)
+            return
         elif path == '/api/attack':
             response = self.handle_attack(data)
+        elif path == '/api/attack_batch':
+            response = self.handle_attack_batch(data)
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+        self.send_json(response)
     
     def handle_create_game(self, data):
         player_name = data.get('player_name', 'میزبان')
         game_id = ''.join(random.choices('0123456789', k=6))
         
-        while game_id in games:
-            game_id = ''.join(random.choices('0123456789', k=6))
-        
-        game = GameState(game_id, player_name)
-        games[game_id] = game
+        with games_lock:
+            while game_id in games:
+                game_id = ''.join(random.choices('0123456789', k=6))
+            game = GameState(game_id, player_name)
+            journal.track(game, game.init_args())
+            games[game_id] = game
+        scheduler.call_at(game.last_activity + GAME_TTL, expire_game, game_id)
         
         host_id = list(game.players.keys())[0]
         
@@ -708,10 +954,13 @@ class GameHandler(BaseHTTPRequestHandler):
             return {'success': False, 'message': 'بازی پیدا نشد'}
         
         game = games[game_id]
-        if game.status != 'waiting':
-            return {'success': False, 'message': 'بازی شروع شده است'}
-        
-        player_id = game.add_player(player_name)
+        with game.lock:
+            if game.status != 'waiting':
+                return {'success': False, 'message': 'بازی شروع شده است'}
+            
+            player_id = game.add_player(player_name)
+            if player_id:
+                game.changed()
         if not player_id:
             return {'success': False, 'message': 'بازی پر است'}
         
@@ -721,7 +970,8 @@ class GameHandler(BaseHTTPRequestHandler):
             'message': f'{player_name} به بازی پیوست'
         }
     
-    def handle_start_game(self, data):
+    def handle_add_bot(self, data):
+        """The host fills a seat with a bot player"""
         game_id = data.get('game_id')
         player_id = data.get('player_id')
         
@@ -729,25 +979,129 @@ class GameHandler(BaseHTTPRequestHandler):
             return {'success': False, 'message': 'بازی پیدا نشد'}
         
         game = games[game_id]
-        if not game.players[player_id]['is_host']:
-            return {'success': False, 'message': 'فقط میزبان می‌تواند بازی را شروع کند'}
+        with game.lock:
+            if not game.players[player_id]['is_host']:
+                return {'success': False, 'message': 'فقط میزبان می‌تواند ربات اضافه کند'}
+            if game.status != 'waiting':
+                return {'success': False, 'message': 'بازی شروع شده است'}
+            
+            bot_name = data.get('bot_name') or f'ربات {len(game.players)}'
+            bot_id = game.add_player(bot_name, is_bot=True)
+            if bot_id:
+                game.changed()
+        if not bot_id:
+            return {'success': False, 'message': 'بازی پر است'}
         
-        if game.start_game():
+        return {
+            'success': True,
+            'player_id': bot_id,
+            'message': f'{bot_name} به بازی پیوست'
+        }
+    
+    def handle_start_game(self, data):
+        game_id = data.get('game_id')
+        player_id = data.get('player_id')
+        
+        if game_id not in games:
+            return {'success': False, 'message': 'بازی پیدا نشد'}
+        
+        game = games[game_id]
+        with game.lock:
+            if not game.players[player_id]['is_host']:
+                return {'success': False, 'message': 'فقط میزبان می‌تواند بازی را شروع کند'}
+            
+            started = game.start_game()
+            if started:
+                game.changed()
+        if started:
+            schedule_bot_turn(game)
             return {'success': True, 'message': 'بازی شروع شد'}
         else:
             return {'success': False, 'message': 'حداقل 2 بازیکن لازم است'}
     
     def handle_get_game_state(self, data):
+        """Full state, or 304 / unchanged when the client already has this version"""
         game_id = data.get('game_id')
         
         if game_id not in games:
-            return {'success': False, 'message': 'بازی پیدا نشد'}
+            self.send_json({'success': False, 'message': 'بازی پیدا نشد'})
+            return
         
         game = games[game_id]
-        return {
-            'success': True,
-            'game_state': game.get_state()
-        }
+        version = game.clock.version
+        etag = state_etag(game_id, version)
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+        elif parse_version(data.get('since_version')) == version:
+            self.send_json({'success': True, 'unchanged': True, 'version': version})
+        else:
+            # ETag of the version the body was encoded at, a write may have landed since the check above
+            version, body = game.cached_view(state_cache.reply)
+            self.send_body(body, headers={'ETag': state_etag(game_id, version)})
+    
+    def handle_wait_state(self, query):
+        """Long-poll: reply once the game version passes since, or on timeout"""
+        game_id = query.get('game_id')
+        since = parse_version(query.get('since'))
+        
+        if game_id not in games:
+            self.send_json({'success': False, 'message': 'بازی پیدا نشد'})
+            return
+        
+        game = games[game_id]
+        version = game.clock.wait(since, wait_timeout(query.get('timeout')))
+        if version <= since:
+            self.send_json({'success': True, 'changed': False, 'version': version})
+        else:
+            self.send_body(game.cached_view(state_cache.changed_reply)[1])
+    
+    def handle_events(self, query):
+        """Server-Sent Events stream with one 'state' event per game version, handed to its own thread"""
+        game_id = query.get('game_id')
+        version = parse_version(self.headers.get('Last-Event-ID', query.get('since')))
+        
+        if game_id not in games:
+            self.send_error(404)
+            return
+        
+        # A stream never ends on its own, so it must not hold a pool worker
+        if not self.server.sse_slots.acquire(blocking=False):
+            body = json.dumps({'success': False, 'message': 'سرور شلوغ است، دوباره تلاش کنید'},
+                              ensure_ascii=False).encode('utf-8')
+            self.send_body(body, status=503, headers={'Retry-After': str(SSE_KEEPALIVE)})
+            return
+        
+        game = games[game_id]
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            # The stream has no length, so it ends with the connection
+            self.send_header('Connection', 'close')
+            self.end_headers()
+        except OSError:
+            self.server.sse_slots.release()
+            raise
+        self.close_connection = True
+        self.server.detach(self.connection)
+        threading.Thread(target=stream_events, args=(self.server, self.connection, game, version),
+                         name='sse', daemon=True).start()
+    
+    def handle_replay(self, query):
+        """Replay file of a game so far, for replays.py"""
+        game_id = query.get('game_id')
+        
+        if game_id not in games:
+            self.send_error(404)
+            return
+        
+        game = games[game_id]
+        with game.lock:
+            replay = record_replay(game, game.init_args(), 'main:GameState')
+        self.send_body(replay, content_type=REPLAY_MIMETYPE,
+                       headers={'Content-Disposition': f'attachment; filename="{game_id}.iwr"'})
     
     def handle_attack(self, data):
         game_id = data.get('game_id')
@@ -760,9 +1114,34 @@ class GameHandler(BaseHTTPRequestHandler):
             return {'success': False, 'message': 'بازی پیدا نشد'}
         
         game = games[game_id]
-        success, message = game.execute_attack(player_id, from_region, to_region, soldiers)
+        with game.lock:
+            turn = game.current_turn
+            success, message = game.execute_attack(player_id, from_region, to_region, soldiers)
+            # A fought battle, won or lost, ends the turn; a rejected attack changes nothing
+            if game.current_turn != turn:
+                game.changed()
+        schedule_bot_turn(game)
         
         return {'success': success, 'message': message}
+    
+    def handle_attack_batch(self, data):
+        game_id = data.get('game_id')
+        player_id = data.get('player_id')
+        attacks = parse_attacks(data.get('attacks', []), 10)
+        
+        if game_id not in games:
+            return {'success': False, 'message': 'بازی پیدا نشد'}
+        if attacks is None:
+            return {'success': False, 'message': 'حملات نامعتبر است'}
+        
+        game = games[game_id]
+        with game.lock:
+            success, message, results = game.execute_attacks(player_id, attacks)
+            if success:
+                game.changed()
+        schedule_bot_turn(game)
+        
+        return {'success': success, 'message': message, 'results': results}
 
 def get_local_ip():
     """Get device's local IP address"""
@@ -778,7 +1157,16 @@ def get_local_ip():
 def run_server():
     """Run the game server"""
     server_address = ('', 8000)
-    httpd = HTTPServer(server_address, GameHandler)
+    # Bot search processes are forked before the journal, expiry and HTTP threads start
+    start_search_pool()
+    # Matches in progress when the app was last killed; players get a full GAME_TTL to come back
+    games.update(journal.recover(data_dir('hotspot')))
+    for game_id, game in games.items():
+        game.last_activity = time.time()
+        scheduler.call_at(game.last_activity + GAME_TTL, expire_game, game_id)
+        schedule_bot_turn(game)
+    # A pool of worker threads, so one slow phone or a held long-poll does not block others
+    httpd = BoundedThreadingHTTPServer(server_address, GameHandler)
     
     local_ip = get_local_ip()
     
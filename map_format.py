@@ -0,0 +1,269 @@
+"""
+Compact binary map format for Iran War Game
+One pack file holds every map (the 25-region server map and the 15-region
+hotspot map). Each map stores region attributes as int32 columns, CSR
+adjacency (offsets + neighbor indices) and a UTF-8 string table. The pack is
+memory-mapped and region records are only materialized when accessed, so
+startup does not build any dicts.
+
+maps.json is the reviewed source of every map, one region per line;
+maps.iwm is built from it. Edit the JSON, then rebuild the pack.
+
+Run: python map_format.py build [maps.json]  (rebuild maps.iwm from the JSON source)
+     python map_format.py dump [map_name]    (print maps of the pack as JSON source)
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Mapping
+from typing import Dict, List, Tuple
+
+DEFAULT_MAPS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps.iwm')
+DEFAULT_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps.json')
+
+# All integers are native int32/uint32 (little-endian on every platform we ship to)
+# magic, format version, number of maps
+FILE_HEADER = struct.Struct('<4sHH')
+# map name, byte offset of its section
+DIRECTORY_ENTRY = struct.Struct('<16sI')
+# schema, region count, edge count
+SECTION_HEADER = struct.Struct('<III')
+MAGIC = b'IWMP'
+FORMAT_VERSION = 1
+
+# Region record layouts: IranMap.create_regions and IRAN_REGIONS of main.py
+SCHEMA_GAME = 0
+SCHEMA_HOTSPOT = 1
+SCHEMAS = {'game': SCHEMA_GAME, 'hotspot': SCHEMA_HOTSPOT}
+
+# int32 columns per region: x, y, population, strategic value
+INT_FIELDS = 4
+# strings per region: id, name, English name, resource type
+STRING_FIELDS = 4
+
+
+class MapData(Mapping):
+    """Read-only region_id -> region record mapping over one map section"""
+
+    def __init__(self, buffer, offset: int):
+        self.schema, count, edges = SECTION_HEADER.unpack_from(buffer, offset)
+        offset += SECTION_HEADER.size
+        self._ints = buffer[offset:offset + count * INT_FIELDS * 4].cast('i')
+        offset += count * INT_FIELDS * 4
+        self._adjacency_offsets = buffer[offset:offset + (count + 1) * 4].cast('I')
+        offset += (count + 1) * 4
+        self._adjacency = buffer[offset:offset + edges * 4].cast('I')
+        offset += edges * 4
+        self._string_offsets = buffer[offset:offset + (count * STRING_FIELDS + 1) * 4].cast('I')
+        offset += (count * STRING_FIELDS + 1) * 4
+        self._strings = buffer[offset:offset + self._string_offsets[-1]]
+        self._count = count
+        self._region_ids = None
+        self._index = None
+        self._neighbors = None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.region_ids)
+
+    def __contains__(self, region_id):
+        return region_id in self.index
+
+    def __getitem__(self, region_id) -> Dict:
+        return self.record(self.index[region_id])
+
+    @property
+    def region_ids(self) -> Tuple[str, ...]:
+        if self._region_ids is None:
+            self._region_ids = tuple(self._string(i, 0) for i in range(self._count))
+        return self._region_ids
+
+    @property
+    def index(self) -> Dict[str, int]:
+        if self._index is None:
+            self._index = {region_id: i for i, region_id in enumerate(self.region_ids)}
+        return self._index
+
+    def record(self, index: int) -> Dict:
+        """Materialize one region in the layout of this map's schema"""
+        base = index * INT_FIELDS
+        x, y, population, strategic_value = self._ints[base:base + INT_FIELDS]
+        if self.schema == SCHEMA_HOTSPOT:
+            return {'name': self._string(index, 1), 'x': x, 'y': y,
+                    'population': population, 'type': self._string(index, 3)}
+        return {
+            "name": self._string(index, 1),
+            "name_en": self._string(index, 2),
+            "pos": (x, y),
+            "strategic_value": strategic_value,
+            "resource_type": self._string(index, 3),
+            "population": population
+        }
+
+    def neighbor_indices(self, index: int) -> List[int]:
+        """Neighbor region indices straight from the CSR arrays"""
+        return self._adjacency[self._adjacency_offsets[index]:self._adjacency_offsets[index + 1]].tolist()
+
+    def neighbors(self, region_id: str) -> List[str]:
+        """Neighbor ids of a region, empty for unknown regions"""
+        if region_id not in self.index:
+            return []
+        region_ids = self.region_ids
+        return [region_ids[i] for i in self.neighbor_indices(self.index[region_id])]
+
+    def neighbor_map(self) -> Dict[str, List[str]]:
+        """Whole adjacency as region_id -> neighbor ids, built once"""
+        if self._neighbors is None:
+            self._neighbors = {region_id: self.neighbors(region_id) for region_id in self.region_ids}
+        return self._neighbors
+
+    def _string(self, index: int, field: int) -> str:
+        slot = index * STRING_FIELDS + field
+        return str(self._strings[self._string_offsets[slot]:self._string_offsets[slot + 1]], 'utf-8')
+
+
+class MapPack:
+    """Memory-mapped pack file with one MapData per named map"""
+
+    def __init__(self, path: str = DEFAULT_MAPS_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, version, map_count = FILE_HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} map pack")
+
+        self._buffer = buffer
+        self._offsets = {}
+        for i in range(map_count):
+            name, offset = DIRECTORY_ENTRY.unpack_from(buffer, FILE_HEADER.size + i * DIRECTORY_ENTRY.size)
+            self._offsets[name.rstrip(b'\0').decode('ascii')] = offset
+        self._maps = {}
+
+    def names(self) -> List[str]:
+        return list(self._offsets)
+
+    def get(self, name: str) -> MapData:
+        """Section of one map, parsed on first use"""
+        if name not in self._maps:
+            if name not in self._offsets:
+                raise KeyError(f"map '{name}' is not in {self.path}")
+            self._maps[name] = MapData(self._buffer, self._offsets[name])
+        return self._maps[name]
+
+
+_packs: Dict[str, MapPack] = {}
+_packs_lock = threading.Lock()
+
+
+def load_map(name: str = 'iran', path: str = DEFAULT_MAPS_PATH) -> MapData:
+    """Shared MapData of a named map, the pack is opened once per process"""
+    with _packs_lock:
+        if path not in _packs:
+            _packs[path] = MapPack(path)
+        return _packs[path].get(name)
+
+
+def encode_map(regions: Dict, neighbors: Dict[str, List[str]], schema: int = SCHEMA_GAME) -> bytes:
+    """Encode one map section (regions in either record layout)"""
+    region_ids = list(regions)
+    index = {region_id: i for i, region_id in enumerate(region_ids)}
+
+    ints = array('i')
+    adjacency_offsets = array('I', [0])
+    adjacency = array('I')
+    string_offsets = array('I', [0])
+    strings = bytearray()
+
+    for region_id in region_ids:
+        region = regions[region_id]
+        if schema == SCHEMA_HOTSPOT:
+            x, y = region['x'], region['y']
+            resource_type = region['type']
+        else:
+            x, y = region['pos']
+            resource_type = region['resource_type']
+        ints.extend((x, y, region.get('population', 0), region.get('strategic_value', 0)))
+
+        adjacency.extend(index[neighbor] for neighbor in neighbors.get(region_id, []) if neighbor in index)
+        adjacency_offsets.append(len(adjacency))
+
+        for text in (region_id, region['name'], region.get('name_en', ''), resource_type):
+            strings += text.encode('utf-8')
+            string_offsets.append(len(strings))
+
+    strings += b'\0' * (-len(strings) % 4)  # keep the next section 4-byte aligned
+    return (SECTION_HEADER.pack(schema, len(region_ids), len(adjacency)) + ints.tobytes() +
+            adjacency_offsets.tobytes() + adjacency.tobytes() + string_offsets.tobytes() + bytes(strings))
+
+
+def write_pack(maps: Dict[str, Tuple[Dict, Dict[str, List[str]], int]], path: str = DEFAULT_MAPS_PATH):
+    """Write {name: (regions, neighbors, schema)} atomically as a pack file"""
+    sections = [encode_map(*maps[name]) for name in maps]
+    offset = FILE_HEADER.size + DIRECTORY_ENTRY.size * len(maps)
+    header = FILE_HEADER.pack(MAGIC, FORMAT_VERSION, len(maps))
+    for name, section in zip(maps, sections):
+        header += DIRECTORY_ENTRY.pack(name.encode('ascii'), offset)
+        offset += len(section)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+def dump_map(name: str, path: str = DEFAULT_MAPS_PATH) -> Dict:
+    """JSON-ready {schema, regions, neighbors} of one map, input format of build"""
+    data = MapPack(path).get(name)
+    schema = next(key for key, value in SCHEMAS.items() if value == data.schema)
+    return {'schema': schema, 'regions': dict(data.items()), 'neighbors': data.neighbor_map()}
+
+
+def format_source(maps: Dict[str, Dict]) -> str:
+    """JSON source of {name: dump_map(name)}, one region or neighbor list per line for readable diffs"""
+    def lines(entries: Dict) -> str:
+        return ',\n'.join(f'      {json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}'
+                          for key, value in entries.items())
+
+    sections = []
+    for name, entry in maps.items():
+        sections.append(
+            f'  {json.dumps(name)}: {{\n'
+            f'    "schema": {json.dumps(entry["schema"])},\n'
+            f'    "regions": {{\n{lines(entry["regions"])}\n    }},\n'
+            f'    "neighbors": {{\n{lines(entry["neighbors"])}\n    }}\n'
+            f'  }}'
+        )
+    return '{\n' + ',\n'.join(sections) + '\n}\n'
+
+
+def build_pack(source_path: str = DEFAULT_SOURCE_PATH, path: str = DEFAULT_MAPS_PATH):
+    """Rebuild the pack from its JSON source"""
+    with open(source_path, encoding='utf-8') as f:
+        source = json.load(f)
+    write_pack({
+        name: (entry['regions'], entry['neighbors'], SCHEMAS[entry['schema']])
+        for name, entry in source.items()
+    }, path)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'dump':
+        pack = MapPack()
+        names = sys.argv[2:] or pack.names()
+        sys.stdout.write(format_source({name: dump_map(name) for name in names}))
+    elif command == 'build':
+        build_pack(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SOURCE_PATH)
+    else:
+        sys.exit(__doc__)
@@ -0,0 +1,108 @@
+"""
+Seeded large-map generator for Iran War Game
+Builds planar maps of any size in the IranMap region schema: region
+centres are jittered grid points and every grid cell is split by one
+diagonal, a Delaunay-style triangulation that stays planar and connected.
+Regions are grouped into provinces, counties and districts by grid block.
+"""
+
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+RESOURCE_TYPES = ('industrial', 'cultural', 'religious', 'oil', 'agricultural',
+                  'mining', 'coastal', 'port', 'border')
+
+# Grid cells per side of a county block and county blocks per side of a province
+COUNTY_CELLS = 4
+PROVINCE_COUNTIES = 5
+
+# Jitter as a fraction of the cell size; below 0.5 no two centres can swap cells
+JITTER = 0.35
+
+
+def generate_map(region_count: int, seed: Optional[int] = None, width: int = 1000,
+                 height: int = 700) -> Tuple[Dict, Dict[str, List[str]]]:
+    """
+    Generate (regions, neighbors) dicts in the same shape as
+    IranMap.create_regions and IranMap.create_neighbor_map
+    """
+    if region_count < 2:
+        raise ValueError("A map needs at least 2 regions")
+    rng = random.Random(seed)
+
+    cols = max(1, math.ceil(math.sqrt(region_count * width / height)))
+    rows = math.ceil(region_count / cols)
+    cell_w = width / cols
+    cell_h = height / rows
+
+    region_ids = []
+    regions = {}
+    for i in range(region_count):
+        row, col = divmod(i, cols)
+        region_id, name, name_en = _region_names(row, col)
+        x = (col + 0.5 + rng.uniform(-JITTER, JITTER)) * cell_w
+        y = (row + 0.5 + rng.uniform(-JITTER, JITTER)) * cell_h
+        on_edge = row == 0 or col == 0 or col == cols - 1 or i + cols >= region_count
+        region_ids.append(region_id)
+        regions[region_id] = {
+            "name": name,
+            "name_en": name_en,
+            "pos": (round(x), round(y)),
+            "strategic_value": rng.randint(1, 10),
+            "resource_type": 'border' if on_edge and rng.random() < 0.5 else rng.choice(RESOURCE_TYPES[:-1]),
+            "population": rng.randint(10, 100)
+        }
+
+    adjacent = [[] for _ in range(region_count)]
+
+    def link(a, b):
+        if a < region_count and b < region_count:
+            adjacent[a].append(b)
+            adjacent[b].append(a)
+
+    for i in range(region_count):
+        row, col = divmod(i, cols)
+        if col + 1 < cols:
+            link(i, i + 1)
+        link(i, i + cols)
+        if col + 1 < cols:
+            # One diagonal per grid cell keeps the graph planar
+            if rng.random() < 0.5:
+                link(i, i + cols + 1)
+            else:
+                link(i + 1, i + cols)
+
+    neighbors = {region_ids[i]: [region_ids[j] for j in sorted(adjacent[i])]
+                 for i in range(region_count)}
+    return regions, neighbors
+
+
+def hotspot_regions(regions: Dict) -> Dict:
+    """Convert IranMap-schema regions to the IRAN_REGIONS schema of main.py"""
+    return {
+        region_id: {
+            'name': region['name'],
+            'x': region['pos'][0],
+            'y': region['pos'][1],
+            'population': region['population'] * 10000,
+            'type': region['resource_type']
+        }
+        for region_id, region in regions.items()
+    }
+
+
+def _region_names(row: int, col: int) -> Tuple[str, str, str]:
+    """Hierarchical id and names of the region in grid cell (row, col)"""
+    county_row, district_row = divmod(row, COUNTY_CELLS)
+    county_col, district_col = divmod(col, COUNTY_CELLS)
+    province_row, county_row = divmod(county_row, PROVINCE_COUNTIES)
+    province_col, county_col = divmod(county_col, PROVINCE_COUNTIES)
+
+    province = f"{province_row}x{province_col}"
+    county = county_row * PROVINCE_COUNTIES + county_col
+    district = district_row * COUNTY_CELLS + district_col
+    region_id = f"p{province}_c{county}_d{district}"
+    name = f"استان {province} شهرستان {county} بخش {district}"
+    name_en = f"Province {province} County {county} District {district}"
+    return region_id, name, name_en
@@ -0,0 +1,466 @@
+"""
+Shared map topology and compact per-game region state for Iran War Game
+MapTopology holds the static region data once per map. GameRegions keeps
+only owner, soldiers and buildings per game, in arrays indexed by region
+number, while still behaving like the old dict of region dicts.
+"""
+
+import math
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Dict, List, Optional, Set, Tuple
+from territory import TerritoryTracker
+
+BUILDING_TYPES = ('barracks', 'factory', 'bank')
+BUILDING_SLOTS = {building: slot for slot, building in enumerate(BUILDING_TYPES)}
+STATIC_FIELDS = ('name', 'name_en', 'pos', 'strategic_value', 'resource_type', 'population')
+UNREACHABLE = -1
+# All-pairs tables take count^2 cells and O(count * edges) to build (about 0.4 s
+# at 500 regions, 6 s and 64 MB at 2000); larger maps search paths on demand
+APSP_MAX_REGIONS = 500
+
+
+class MapTopology:
+    """Immutable region data shared by every game on the same map"""
+
+    def __init__(self, regions: Dict, neighbors: Dict[str, List[str]]):
+        self.region_ids = tuple(regions)
+        self.index = MappingProxyType({region_id: i for i, region_id in enumerate(self.region_ids)})
+        self.neighbors = tuple(tuple(neighbors.get(region_id, [])) for region_id in self.region_ids)
+        self.static = tuple(
+            MappingProxyType({
+                **{field: regions[region_id][field] for field in STATIC_FIELDS if field in regions[region_id]},
+                'neighbors': self.neighbors[i]
+            })
+            for i, region_id in enumerate(self.region_ids)
+        )
+        self.neighbor_indices = tuple(
+            tuple(self.index[neighbor] for neighbor in region_neighbors if neighbor in self.index)
+            for region_neighbors in self.neighbors
+        )
+        # Undirected adjacency, the neighbor map itself is not symmetric
+        adjacent = [set(indices) for indices in self.neighbor_indices]
+        for i, indices in enumerate(self.neighbor_indices):
+            for neighbor in indices:
+                adjacent[neighbor].add(i)
+        self.adjacent_indices = tuple(tuple(sorted(indices)) for indices in adjacent)
+        # Region sets as int bitmasks: bit i is region i
+        self.all_mask = (1 << len(self.region_ids)) - 1
+        self._neighbor_masks = None
+        self._incoming_masks = None
+        self._hops = None
+        self._predecessors = None
+        self._distances = None
+
+    def __len__(self):
+        return len(self.region_ids)
+
+    @property
+    def neighbor_masks(self):
+        """Per-region bitmask of neighbors, built on first use (large maps rarely need it)"""
+        if self._neighbor_masks is None:
+            self._neighbor_masks = tuple(mask_of_indices(indices) for indices in self.neighbor_indices)
+        return self._neighbor_masks
+
+    @property
+    def incoming_masks(self):
+        """Per-region bitmask of regions listing it as neighbor"""
+        if self._incoming_masks is None:
+            incoming = [0] * len(self.region_ids)
+            for i, indices in enumerate(self.neighbor_indices):
+                for neighbor in indices:
+                    incoming[neighbor] |= 1 << i
+            self._incoming_masks = tuple(incoming)
+        return self._incoming_masks
+
+    def ensure_path_tables(self) -> bool:
+        """Build the all-pairs tables of a small map on its first path query; False if paths are searched"""
+        if self._hops is None and len(self.region_ids) <= APSP_MAX_REGIONS:
+            self.precompute_paths()
+        return self._hops is not None
+
+    def get(self, region_id: str, default=None):
+        """Neighbor lookup, so a topology can stand in for a region_neighbors dict"""
+        if region_id not in self.index:
+            return default
+        return self.neighbors[self.index[region_id]]
+
+    def mask_of(self, region_ids) -> int:
+        """Bitmask of a collection of region ids"""
+        index = self.index
+        mask = 0
+        for region_id in region_ids:
+            if region_id in index:
+                mask |= 1 << index[region_id]
+        return mask
+
+    def ids_of(self, mask: int) -> List[str]:
+        """Region ids of a bitmask, in region order"""
+        return [self.region_ids[i] for i in iter_bits(mask)]
+
+    def is_neighbor(self, from_region: str, to_region: str) -> bool:
+        """Check if to_region is in the neighbor list of from_region"""
+        index = self.index
+        if from_region not in index or to_region not in index:
+            return False
+        return index[to_region] in self.neighbor_indices[index[from_region]]
+
+    def reach_mask(self, mask: int) -> int:
+        """Regions reachable in one move from any region in mask"""
+        reach = 0
+        neighbor_masks = self.neighbor_masks
+        for i in iter_bits(mask):
+            reach |= neighbor_masks[i]
+        return reach
+
+    def attacker_mask(self, mask: int) -> int:
+        """Regions that can move into any region in mask"""
+        sources = 0
+        incoming_masks = self.incoming_masks
+        for i in iter_bits(mask):
+            sources |= incoming_masks[i]
+        return sources
+
+    def frontier_mask(self, owned_mask: int) -> int:
+        """Regions not in owned_mask that can be attacked from it"""
+        return self.reach_mask(owned_mask) & ~owned_mask
+
+    def exposed_mask(self, owned_mask: int, enemy_mask: Optional[int] = None) -> int:
+        """Owned regions that can be attacked from enemy_mask (default: every other region)"""
+        if enemy_mask is None:
+            enemy_mask = self.all_mask & ~owned_mask
+        return self.reach_mask(enemy_mask) & owned_mask
+
+    def is_connected(self, mask: int) -> bool:
+        """Check if the regions in mask form one connected territory"""
+        if not mask:
+            return True
+        return self.component_mask(mask, (mask & -mask).bit_length() - 1) == mask
+
+    def component_mask(self, mask: int, start: int) -> int:
+        """Connected part of mask containing region index start (edges in either direction)"""
+        component = 1 << start
+        frontier = component
+        while frontier:
+            grown = (self.reach_mask(frontier) | self.attacker_mask(frontier)) & mask & ~component
+            component |= grown
+            frontier = grown
+        return component
+
+    def precompute_paths(self):
+        """BFS from every region: hop-count, predecessor and Euclidean distance matrices"""
+        count = len(self.region_ids)
+        hops = array('i', [UNREACHABLE]) * (count * count)
+        predecessors = array('i', [UNREACHABLE]) * (count * count)
+
+        for source in range(count):
+            row = source * count
+            hops[row + source] = 0
+            queue = deque([source])
+            while queue:
+                current = queue.popleft()
+                next_hops = hops[row + current] + 1
+                for neighbor in self.neighbor_indices[current]:
+                    if hops[row + neighbor] == UNREACHABLE:
+                        hops[row + neighbor] = next_hops
+                        predecessors[row + neighbor] = current
+                        queue.append(neighbor)
+
+        distances = array('d', [math.inf]) * (count * count)
+        positions = [static.get('pos') for static in self.static]
+        for a in range(count):
+            if positions[a] is None:
+                continue
+            for b in range(count):
+                if positions[b] is not None:
+                    distances[a * count + b] = math.hypot(positions[a][0] - positions[b][0],
+                                                          positions[a][1] - positions[b][1])
+
+        self._hops = hops
+        self._predecessors = predecessors
+        self._distances = distances
+
+    def hops(self, start: str, end: str) -> int:
+        """Number of moves on the shortest path, UNREACHABLE if there is none"""
+        if start not in self.index or end not in self.index:
+            return UNREACHABLE
+        if not self.ensure_path_tables():
+            return len(self.path(start, end)) - 1
+        return self._hops[self.index[start] * len(self.region_ids) + self.index[end]]
+
+    def distance(self, start: str, end: str) -> float:
+        """Euclidean distance between region positions"""
+        if start not in self.index or end not in self.index:
+            return math.inf
+        if not self.ensure_path_tables():
+            a = self.static[self.index[start]].get('pos')
+            b = self.static[self.index[end]].get('pos')
+            if a is None or b is None:
+                return math.inf
+            return math.hypot(a[0] - b[0], a[1] - b[1])
+        return self._distances[self.index[start] * len(self.region_ids) + self.index[end]]
+
+    def path(self, start: str, end: str) -> List[str]:
+        """Shortest path from start to end (inclusive), empty if unreachable"""
+        if start == end:
+            return [start]
+        if start not in self.index or end not in self.index:
+            return []
+        if not self.ensure_path_tables():
+            return self._search_path(self.index[start], self.index[end])
+
+        count = len(self.region_ids)
+        row = self.index[start] * count
+        current = self.index[end]
+        if self._predecessors[row + current] == UNREACHABLE:
+            return []
+
+        path = []
+        while current != UNREACHABLE:
+            path.append(self.region_ids[current])
+            current = self._predecessors[row + current]
+        path.reverse()
+        return path
+
+    def _search_path(self, source: int, target: int) -> List[str]:
+        """Single BFS that stops at target, for maps too large for all-pairs tables"""
+        predecessors = {source: UNREACHABLE}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            if current == target:
+                break
+            for neighbor in self.neighbor_indices[current]:
+                if neighbor not in predecessors:
+                    predecessors[neighbor] = current
+                    queue.append(neighbor)
+        if target not in predecessors:
+            return []
+
+        path = []
+        current = target
+        while current != UNREACHABLE:
+            path.append(self.region_ids[current])
+            current = predecessors[current]
+        path.reverse()
+        return path
+
+    def new_game_regions(self) -> 'GameRegions':
+        """Create empty per-game region state on this map"""
+        return GameRegions(self)
+
+
+def mask_of_indices(indices) -> int:
+    """Bitmask with the given bit positions set"""
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+def iter_bits(mask: int):
+    """Yield the positions of set bits, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class GameRegions(Mapping):
+    """Per-game region state, a read/write mapping of region_id -> region record"""
+
+    def __init__(self, topology: MapTopology):
+        count = len(topology)
+        self.topology = topology
+        self.owners: List[Optional[str]] = [None] * count
+        self.owner_masks: Dict[str, int] = {}
+        self.territory = TerritoryTracker(topology)
+        # Region index -> fields written since the last take_changes (for state diffs)
+        self.changed: Dict[int, Set[str]] = {}
+        self.soldiers = array('i', [0]) * count
+        # Building counters of region i live at [i * 3 + BUILDING_SLOTS[building]]
+        self.buildings = array('H', [0]) * (count * len(BUILDING_TYPES))
+
+    def __getitem__(self, region_id):
+        return RegionRecord(self, self.topology.index[region_id])
+
+    def __contains__(self, region_id):
+        return region_id in self.topology.index
+
+    def __iter__(self):
+        return iter(self.topology.region_ids)
+
+    def __len__(self):
+        return len(self.topology.region_ids)
+
+    def set_owner(self, index: int, owner: Optional[str]):
+        """Change the owner of a region by index"""
+        bit = 1 << index
+        old_owner = self.owners[index]
+        if old_owner is not None:
+            self.owner_masks[old_owner] &= ~bit
+        if owner is not None:
+            self.owner_masks[owner] = self.owner_masks.get(owner, 0) | bit
+        self.territory.move(index, old_owner, owner)
+        self.owners[index] = owner
+        self.mark_changed(index, 'owner')
+
+    def mark_changed(self, index: int, field: str):
+        """Record that a region field was written"""
+        fields = self.changed.get(index)
+        if fields is None:
+            self.changed[index] = {field}
+        else:
+            fields.add(field)
+
+    def take_changes(self) -> Dict[str, Dict]:
+        """Current values of the fields written since the last call, then reset"""
+        changes = {}
+        for index, fields in self.changed.items():
+            record = {}
+            if 'owner' in fields:
+                record['owner'] = self.owners[index]
+            if 'soldiers' in fields:
+                record['soldiers'] = self.soldiers[index]
+            if 'buildings' in fields:
+                base = index * len(BUILDING_TYPES)
+                record['buildings'] = dict(zip(BUILDING_TYPES, self.buildings[base:base + len(BUILDING_TYPES)]))
+            changes[self.topology.region_ids[index]] = record
+        self.changed = {}
+        return changes
+
+    def dump(self) -> Tuple[List[Optional[str]], bytes, bytes]:
+        """Owners, soldiers and building counters, for a snapshot"""
+        return list(self.owners), self.soldiers.tobytes(), self.buildings.tobytes()
+
+    def load(self, dump: Tuple[List[Optional[str]], bytes, bytes]):
+        """Restore a dump() of the same map into fresh regions"""
+        owners, soldiers, buildings = dump
+        self.soldiers[:] = array('i', soldiers)
+        self.buildings[:] = array('H', buildings)
+        for index, owner in enumerate(owners):
+            if owner is not None:
+                self.set_owner(index, owner)
+        self.changed = {}
+
+    def owned_mask(self, owner: str) -> int:
+        """Bitmask of regions owned by owner"""
+        return self.owner_masks.get(owner, 0)
+
+    def attack_targets(self, owner: str) -> List[str]:
+        """Regions owner can attack from its territory"""
+        return self.topology.ids_of(self.topology.frontier_mask(self.owned_mask(owner)))
+
+    def exposed_regions(self, owner: str) -> List[str]:
+        """Regions of owner that an enemy can attack"""
+        enemy_mask = 0
+        for other, mask in self.owner_masks.items():
+            if other != owner:
+                enemy_mask |= mask
+        return self.topology.ids_of(self.topology.exposed_mask(self.owned_mask(owner), enemy_mask))
+
+    def region_dict(self, index: int) -> Dict:
+        """Materialize one region in the original dict layout"""
+        base = index * len(BUILDING_TYPES)
+        return {
+            **self.topology.static[index],
+            'owner': self.owners[index],
+            'soldiers': self.soldiers[index],
+            'buildings': dict(zip(BUILDING_TYPES, self.buildings[base:base + len(BUILDING_TYPES)]))
+        }
+
+    def to_dict(self) -> Dict:
+        """Materialize all regions for JSON, same layout as IranMap.get_regions"""
+        return {region_id: self.region_dict(i) for i, region_id in enumerate(self.topology.region_ids)}
+
+
+class RegionRecord:
+    """Dict-like view of one region inside a GameRegions table"""
+    __slots__ = ('_regions', '_index')
+
+    def __init__(self, regions: GameRegions, index: int):
+        self._regions = regions
+        self._index = index
+
+    def __getitem__(self, key):
+        if key == 'owner':
+            return self._regions.owners[self._index]
+        if key == 'soldiers':
+            return self._regions.soldiers[self._index]
+        if key == 'buildings':
+            return BuildingsView(self._regions, self._index)
+        return self._regions.topology.static[self._index][key]
+
+    def __setitem__(self, key, value):
+        if key == 'owner':
+            self._regions.set_owner(self._index, value)
+        elif key == 'soldiers':
+            self._regions.soldiers[self._index] = value
+            self._regions.mark_changed(self._index, 'soldiers')
+        elif key == 'buildings':
+            view = BuildingsView(self._regions, self._index)
+            for building in BUILDING_TYPES:
+                view[building] = value.get(building, 0)
+        else:
+            raise TypeError(f"region field '{key}' is shared map data and cannot be changed")
+
+    def __contains__(self, key):
+        return key in ('owner', 'soldiers', 'buildings') or key in self._regions.topology.static[self._index]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return self._regions.region_dict(self._index).keys()
+
+    def items(self):
+        return self._regions.region_dict(self._index).items()
+
+    def update(self, values=(), **kwargs):
+        for key, value in dict(values, **kwargs).items():
+            self[key] = value
+
+    def to_dict(self) -> Dict:
+        return self._regions.region_dict(self._index)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class BuildingsView:
+    """Dict-like view of the building counters of one region"""
+    __slots__ = ('_regions', '_index')
+
+    def __init__(self, regions: GameRegions, index: int):
+        self._regions = regions
+        self._index = index
+
+    def __getitem__(self, building):
+        return self._regions.buildings[self._index * len(BUILDING_TYPES) + BUILDING_SLOTS[building]]
+
+    def __setitem__(self, building, count):
+        self._regions.buildings[self._index * len(BUILDING_TYPES) + BUILDING_SLOTS[building]] = count
+        self._regions.mark_changed(self._index, 'buildings')
+
+    def __contains__(self, building):
+        return building in BUILDING_SLOTS
+
+    def __iter__(self):
+        return iter(BUILDING_TYPES)
+
+    def get(self, building, default=None):
+        return self[building] if building in BUILDING_SLOTS else default
+
+    def keys(self):
+        return BUILDING_TYPES
+
+    def values(self):
+        return [self[building] for building in BUILDING_TYPES]
+
+    def items(self):
+        return [(building, self[building]) for building in BUILDING_TYPES]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -19,6 +19,8 @@ import requests
 import json
 import threading
 import time
+from map_format import load_map
+from wire_codec import COMPACT_MIMETYPE, decode_message
 
 class IranMapWidget(Widget):
     def __init__(self, **kwargs):
@@ -30,22 +32,18 @@ class IranMapWidget(Widget):
         self.bind(size=self.update_graphics, pos=self.update_graphics)
     
     def get_iran_regions(self):
+        # Same map file as the server (maps.iwm), pixel positions scaled to
+        # 0.05-0.95 of the widget with y pointing up
+        map_data = load_map('iran')
+        xs = [region['pos'][0] for region in map_data.values()]
+        ys = [region['pos'][1] for region in map_data.values()]
+        width = max(max(xs) - min(xs), 1)
+        height = max(max(ys) - min(ys), 1)
         return [
-            {'id': 'tehran', 'name': 'تهران', 'pos': (0.5, 0.7)},
-            {'id': 'isfahan', 'name': 'اصفهان', 'pos': (0.4, 0.5)},
-            {'id': 'shiraz', 'name': 'شیراز', 'pos': (0.3, 0.3)},
-            {'id': 'mashhad', 'name': 'مشهد', 'pos': (0.7, 0.8)},
-            {'id': 'tabriz', 'name': 'تبریز', 'pos': (0.2, 0.9)},
-            {'id': 'ahvaz', 'name': 'اهواز', 'pos': (0.15, 0.4)},
-            {'id': 'qazvin', 'name': 'قزوین', 'pos': (0.45, 0.8)},
-            {'id': 'semnan', 'name': 'سمنان', 'pos': (0.6, 0.7)},
-            {'id': 'qom', 'name': 'قم', 'pos': (0.48, 0.6)},
-            {'id': 'yazd', 'name': 'یزد', 'pos': (0.5, 0.4)},
-            {'id': 'kerman', 'name': 'کرمان', 'pos': (0.6, 0.3)},
-            {'id': 'bushehr', 'name': 'بوشهر', 'pos': (0.25, 0.3)},
-            {'id': 'zanjan', 'name': 'زنجان', 'pos': (0.35, 0.8)},
-            {'id': 'ardabil', 'name': 'اردبیل', 'pos': (0.25, 0.95)},
-            {'id': 'lorestan', 'name': 'لرستان', 'pos': (0.3, 0.5)},
+            {'id': region_id, 'name': region['name'],
+             'pos': (0.05 + 0.9 * (region['pos'][0] - min(xs)) / width,
+                     0.95 - 0.9 * (region['pos'][1] - min(ys)) / height)}
+            for region_id, region in map_data.items()
         ]
     
     def update_graphics(self, *args):
@@ -220,11 +218,11 @@ class WaitingScreen(Screen):
         self.game_id_label.text = f'شناسه بازی: {app.game_id}'
         self.update_players()
         
-        # Start polling for updates
-        Clock.schedule_interval(self.poll_game_state, 2)
+        # Long-poll the server for updates
+        self.watch = app.watch_game_state(self.on_game_state_updated)
     
     def on_leave(self):
-        Clock.unschedule(self.poll_game_state)
+        self.watch.set()
     
     def update_players(self):
         app = App.get_running_app()
@@ -243,10 +241,6 @@ class WaitingScreen(Screen):
                 self.start_btn.opacity = 0.5
                 self.start_btn.disabled = True
     
-    def poll_game_state(self, dt):
-        app = App.get_running_app()
-        app.api_call('get_game_state', {'game_id': app.game_id}, self.on_game_state_updated)
-    
     def on_game_state_updated(self, result):
         if result.get('success'):
             app = App.get_running_app()
@@ -314,10 +308,11 @@ class GameScreen(Screen):
     
     def on_enter(self):
         self.update_interface()
-        Clock.schedule_interval(self.poll_game_state, 3)
+        app = App.get_running_app()
+        self.watch = app.watch_game_state(self.on_game_state_updated)
     
     def on_leave(self):
-        Clock.unschedule(self.poll_game_state)
+        self.watch.set()
     
     def update_interface(self):
         app = App.get_running_app()
@@ -329,10 +324,6 @@ class GameScreen(Screen):
         
         self.map_widget.update_game_data(app.game_data)
     
-    def poll_game_state(self, dt):
-        app = App.get_running_app()
-        app.api_call('get_game_state', {'game_id': app.game_id}, self.on_game_state_updated)
-    
     def on_game_state_updated(self, result):
         if result.get('success'):
             app = App.get_running_app()
@@ -424,6 +415,36 @@ class IranWarApp(App):
                 Clock.schedule_once(lambda dt: callback({'success': False, 'error': 'خطا در ارتباط'}), 0)
         
         threading.Thread(target=make_request, daemon=True).start()
+    
+    def watch_game_state(self, callback):
+        """Long-poll wait_state in the background, returns an Event that stops it"""
+        stop = threading.Event()
+        
+        def watch():
+            since = -1
+            while not stop.is_set():
+                try:
+                    # Servers that speak the compact format answer in it, older ones in JSON
+                    response = requests.get(f'{self.server_url}/api/wait_state',
+                                            params={'game_id': self.game_id, 'since': since},
+                                            headers={'Accept': f'{COMPACT_MIMETYPE}, application/json'},
+                                            timeout=35)
+                    if response.headers.get('Content-Type', '').startswith(COMPACT_MIMETYPE):
+                        result = decode_message(response.content)[0]
+                    else:
+                        result = response.json()
+                except Exception as e:
+                    print(f"Long-poll failed: {e}")
+                    stop.wait(3)
+                    continue
+                if not result.get('success'):
+                    break
+                if result.get('changed') and not stop.is_set():
+                    since = result['version']
+                    Clock.schedule_once(lambda dt, result=result: callback(result), 0)
+        
+        threading.Thread(target=watch, daemon=True).start()
+        return stop
 
 if __name__ == '__main__':
     IranWarApp().run()
\ No newline at end of file
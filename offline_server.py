@@ -4,30 +4,48 @@ Offline WiFi/Hotspot Server for Iran War Game
 Server runs on local WiFi network without internet connection
 """
 
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import copy
 import threading
 import time
 import json
 import socket
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 from iran_map import IranMap
-from game_logic import GameLogic
+from game_logic import GameLogic, parse_attacks
+from room_outbox import RoomOutbox
+from scheduler import Scheduler
+from sharding import LOBBY_INTERVAL, current_shard
+from state_sync import StateSync, etag_matches, parse_version, state_cache, state_etag
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'iran_war_offline_2025'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Set when started by sharding.py: this process owns a slice of the game ids
+shard = current_shard()
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                    **(shard.socketio_options() if shard is not None else {}))
 
-# Global game state
+# بازی بی‌استفاده پس از GAME_TTL حذف می‌شود و هر نوبت حداکثر TURN_TIMEOUT طول می‌کشد
+GAME_TTL = timedelta(hours=2)
+TURN_TIMEOUT = timedelta(seconds=90)
+
+# Global game state; games_lock guards adding and removing games, each game has its own lock
 games = {}
+games_lock = threading.Lock()
 game_logic = GameLogic()
 iran_map = IranMap()
+# Per-game deadlines (turn timeouts, idle expiry)
+scheduler = Scheduler()
+# Socket.IO events go only to the game's room, bursts are coalesced into one packet
+outbox = RoomOutbox(socketio, scheduler)
 
 class OfflineGame:
-    def __init__(self, game_id, host_player):
+    def __init__(self, game_id, host_player, seed=None, game_map=None):
         self.game_id = game_id
         self.host_player = host_player
+        self.host_profile = copy.deepcopy(host_player)
         self.players = {host_player['id']: host_player}
         self.status = 'waiting'  # waiting, playing, finished
         self.regions = {}
@@ -35,16 +53,41 @@ class OfflineGame:
         self.turn_order = []
         self.created_time = datetime.now()
         self.last_activity = datetime.now()
+        self.turn_started = self.last_activity
+        # هر بازی مولد تصادفی مخصوص خود را دارد تا از (seed, action_log) قابل بازسازی باشد
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.action_log = []
+        # نسخه‌ی وضعیت بازی برای پاسخ‌های شرطی get_game_state
+        self.sync = StateSync(game_id)
+        # قفل بازی؛ هر درخواستی که بازی را می‌خواند یا تغییر می‌دهد آن را نگه می‌دارد
+        self.lock = threading.RLock()
+        # نقشه‌ی پیش‌فرض ایران یا یک نقشه‌ی تولیدشده
+        self.game_map = game_map if game_map is not None else iran_map
         self.initialize_regions()
         
+    @classmethod
+    def replay(cls, game_id, host_profile, seed, action_log, game_map=None):
+        """Rebuild a game exactly from its seed and action log"""
+        game = cls(game_id, copy.deepcopy(host_profile), seed=seed, game_map=game_map)
+        for action, *args in action_log:
+            getattr(game, action)(*args)
+        return game
+        
+    def log_action(self, action, *args):
+        """Record a state-changing call for replay"""
+        self.action_log.append((action,) + args)
+        
     def initialize_regions(self):
         """Initialize Iran map regions for offline play"""
-        self.regions = iran_map.get_regions()
+        self.regions = self.game_map.new_game_regions()
         
     def add_player(self, player_id, player_name):
         if len(self.players) >= 8:
             return False
             
+        self.log_action('add_player', player_id, player_name)
+        
         colors = ['#e74c3c', '#3498db', '#2ecc71', '#f39c12', 
                  '#9b59b6', '#1abc9c', '#e67e22', '#95a5a6']
         player_color = colors[len(self.players)]
@@ -68,13 +111,15 @@ class OfflineGame:
         if len(self.players) < 2:
             return False
             
+        self.log_action('start_game')
+        
         self.status = 'playing'
         self.turn_order = list(self.players.keys())
-        random.shuffle(self.turn_order)
+        self.rng.shuffle(self.turn_order)
         
         # توزیع مناطق بین بازیکنان
         regions_list = list(self.regions.keys())
-        random.shuffle(regions_list)
+        self.rng.shuffle(regions_list)
         
         regions_per_player = len(regions_list) // len(self.players)
         remaining_regions = len(regions_list) % len(self.players)
@@ -94,6 +139,7 @@ class OfflineGame:
                     region_index += 1
         
         self.last_activity = datetime.now()
+        self.turn_started = self.last_activity
         return True
         
     def get_current_player(self):
@@ -101,16 +147,116 @@ class OfflineGame:
             return None
         return self.turn_order[self.current_turn % len(self.turn_order)]
         
+    def execute_attack(self, player_id, from_region, to_region, soldiers):
+        """Execute attack, returns (valid, attack_successful, message)"""
+        # بررسی نوبت بازیکن
+        if self.get_current_player() != player_id:
+            return False, False, 'نوبت شما نیست'
+        
+        if from_region not in self.regions or to_region not in self.regions:
+            return False, False, 'منطقه معتبر نیست'
+        
+        # بررسی مالکیت منطقه مهاجم
+        if self.regions[from_region]['owner'] != player_id:
+            return False, False, 'این منطقه متعلق به شما نیست'
+        
+        # بررسی تعداد سربازان
+        if self.regions[from_region]['soldiers'] <= soldiers:
+            return False, False, 'تعداد سربازان کافی نیست'
+        
+        self.log_action('execute_attack', player_id, from_region, to_region, soldiers)
+        
+        # محاسبه نتیجه نبرد
+        attacker_soldiers = soldiers
+        defender_soldiers = self.regions[to_region]['soldiers']
+        
+        success, remaining_attackers, remaining_defenders = game_logic.calculate_battle_result(
+            attacker_soldiers, defender_soldiers, rng=self.rng
+        )
+        
+        # اعمال نتیجه
+        self.regions[from_region]['soldiers'] -= soldiers
+        
+        if success:
+            # حمله موفق
+            old_owner = self.regions[to_region]['owner']
+            if old_owner and old_owner in self.players:
+                self.players[old_owner]['regions'].remove(to_region)
+            
+            self.regions[to_region]['owner'] = player_id
+            self.regions[to_region]['soldiers'] = remaining_attackers
+            self.players[player_id]['regions'].append(to_region)
+            
+            return True, True, f'حمله موفق! {to_region} تصرف شد'
+        
+        # حمله ناموفق
+        self.regions[to_region]['soldiers'] = remaining_defenders
+        return True, False, f'حمله ناموفق! {remaining_defenders} سرباز دشمن باقی ماند'
+        
+    def execute_attacks(self, player_id, attacks):
+        """Execute a batch of attacks in one pass, returns (valid, results, message)"""
+        # بررسی نوبت بازیکن
+        if self.get_current_player() != player_id:
+            return False, [], 'نوبت شما نیست'
+        
+        # دسته‌ای که چیزی را تغییر نمی‌دهد ثبت نمی‌شود
+        if game_logic.any_battle_allowed(self.regions, attacks, self.game_map.region_neighbors, player_id):
+            self.log_action('execute_attacks', player_id, attacks)
+        
+        # اجرای همه حمله‌ها در یک مرحله
+        results = game_logic.resolve_battles(
+            self.regions, attacks, self.game_map.region_neighbors, self.players, player_id, self.rng
+        )
+        captured = sum(1 for result in results if result['attacker_wins'])
+        return True, results, f'{captured} منطقه از {len(results)} حمله تصرف شد'
+        
     def next_turn(self):
         self.current_turn += 1
         self.last_activity = datetime.now()
+        self.turn_started = self.last_activity
+        
+    def skip_turn(self):
+        """نوبت بازیکنی که تا TURN_TIMEOUT کاری نکرده رد می‌شود (فعالیت حساب نمی‌شود)"""
+        self.log_action('skip_turn')
+        self.current_turn += 1
+        self.turn_started = datetime.now()
+        
+    def turn_deadline(self):
+        """Deadline of the current turn as a time.time() value"""
+        return (self.turn_started + TURN_TIMEOUT).timestamp()
+        
+    def expiry_deadline(self):
+        """Time at which the game is removed unless it sees activity first"""
+        return (self.last_activity + GAME_TTL).timestamp()
+        
+    def commit_changes(self):
+        """Bump the state version if anything changed since the last commit"""
+        return self.sync.commit(self.regions, self.players, {
+            'status': self.status,
+            'current_turn': self.current_turn,
+            'turn_order': self.turn_order
+        })
+        
+    def current_version(self):
+        """Commit pending changes and return the resulting state version"""
+        with self.lock:
+            self.commit_changes()
+            return self.sync.version
+        
+    def cached_view(self, view):
+        """(version, cached encoding) of the current state, e.g. view=state_cache.reply"""
+        with self.lock:
+            version = self.current_version()
+            return version, view(self.game_id, version, self.get_game_state)
         
     def get_game_state(self):
+        self.commit_changes()
         return {
             'game_id': self.game_id,
+            'version': self.sync.version,
             'status': self.status,
             'players': self.players,
-            'regions': self.regions,
+            'regions': self.regions.to_dict(),
             'current_player': self.get_current_player(),
             'turn_number': self.current_turn + 1,
             'created_time': self.created_time.isoformat(),
@@ -136,15 +282,29 @@ def index():
 @app.route('/api/server_info')
 def server_info():
     """اطلاعات سرور برای نمایش در کلاینت"""
+    lobby = lobby_summary()
+    if shard is not None:
+        lobby = shard.lobby(lobby)
     return jsonify({
         'server_ip': get_local_ip(),
         'server_port': 5000,
         'status': 'online',
         'mode': 'offline',
-        'total_games': len(games),
-        'active_players': sum(len(game.players) for game in games.values())
+        **lobby
     })
 
+def lobby_summary():
+    """تعداد بازی‌ها و بازیکنان این پروسه"""
+    return {
+        'total_games': len(games),
+        'active_players': sum(len(game.players) for game in list(games.values()))
+    }
+
+def publish_lobby():
+    """ارسال دوره‌ای آمار این شارد برای بقیه شاردها"""
+    shard.publish_lobby(lobby_summary())
+    scheduler.call_later(LOBBY_INTERVAL, publish_lobby)
+
 @app.route('/api/create_game', methods=['POST'])
 def create_game():
     data = request.get_json()
@@ -152,8 +312,6 @@ def create_game():
     
     # تولید Game ID منحصر به فرد
     game_id = ''.join(random.choices('0123456789', k=6))
-    while game_id in games:
-        game_id = ''.join(random.choices('0123456789', k=6))
     
     # ایجاد بازیکن میزبان
     host_player = {
@@ -167,9 +325,14 @@ def create_game():
         'is_host': True
     }
     
-    # ایجاد بازی جدید
-    game = OfflineGame(game_id, host_player)
-    games[game_id] = game
+    # ایجاد بازی جدید؛ شناسه زیر قفل انتخاب می‌شود تا دو درخواست همزمان یک شناسه نگیرند
+    with games_lock:
+        # در حالت شارد فقط شناسه‌ای که به همین شارد می‌رسد
+        while game_id in games or (shard is not None and not shard.owns(game_id)):
+            game_id = ''.join(random.choices('0123456789', k=6))
+        game = OfflineGame(game_id, host_player)
+        games[game_id] = game
+    scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
     
     return jsonify({
         'success': True,
@@ -185,41 +348,41 @@ def join_game():
     game_id = data.get('game_id')
     player_name = data.get('player_name', 'بازیکن')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    if game.status != 'waiting':
-        return jsonify({
-            'success': False,
-            'message': 'بازی قبلاً شروع شده است'
+    with game.lock:
+        if game.status != 'waiting':
+            return jsonify({
+                'success': False,
+                'message': 'بازی قبلاً شروع شده است'
+            })
+        
+        player_id = f'player_{random.randint(1000, 9999)}'
+        success = game.add_player(player_id, player_name)
+        
+        if not success:
+            return jsonify({
+                'success': False,
+                'message': 'بازی پر است (حداکثر 8 نفر)'
+            })
+        
+        # اطلاع‌رسانی به سایر بازیکنان
+        outbox.emit(game_id, 'player_joined', {
+            'player_name': player_name,
+            'total_players': len(game.players)
         })
-    
-    player_id = f'player_{random.randint(1000, 9999)}'
-    success = game.add_player(player_id, player_name)
-    
-    if not success:
+        
         return jsonify({
-            'success': False,
-            'message': 'بازی پر است (حداکثر 8 نفر)'
+            'success': True,
+            'player_id': player_id,
+            'game_id': game_id,
+            'message': f'{player_name} به بازی پیوست'
         })
-    
-    # اطلاع‌رسانی به سایر بازیکنان
-    socketio.emit('player_joined', {
-        'player_name': player_name,
-        'total_players': len(game.players)
-    })
-    
-    return jsonify({
-        'success': True,
-        'player_id': player_id,
-        'game_id': game_id,
-        'message': f'{player_name} به بازی پیوست'
-    })
 
 @app.route('/api/start_game', methods=['POST'])
 def start_game():
@@ -227,56 +390,68 @@ def start_game():
     game_id = data.get('game_id')
     player_id = data.get('player_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    # تنها میزبان می‌تواند بازی را شروع کند
-    if not game.players[player_id]['is_host']:
-        return jsonify({
-            'success': False,
-            'message': 'فقط میزبان می‌تواند بازی را شروع کند'
+    with game.lock:
+        # تنها میزبان می‌تواند بازی را شروع کند
+        if not game.players[player_id]['is_host']:
+            return jsonify({
+                'success': False,
+                'message': 'فقط میزبان می‌تواند بازی را شروع کند'
+            })
+        
+        success = game.start_game()
+        if success:
+            scheduler.call_at(game.turn_deadline(), turn_timeout, game_id, game.current_turn)
+        
+        if not success:
+            return jsonify({
+                'success': False,
+                'message': 'حداقل 2 بازیکن لازم است'
+            })
+        
+        # اطلاع‌رسانی شروع بازی
+        outbox.emit(game_id, 'game_started', {
+            'message': 'بازی شروع شد!',
+            'current_player': game.get_current_player()
         })
-    
-    success = game.start_game()
-    
-    if not success:
+        
         return jsonify({
-            'success': False,
-            'message': 'حداقل 2 بازیکن لازم است'
+            'success': True,
+            'message': 'بازی شروع شد'
         })
-    
-    # اطلاع‌رسانی شروع بازی
-    socketio.emit('game_started', {
-        'message': 'بازی شروع شد!',
-        'current_player': game.get_current_player()
-    })
-    
-    return jsonify({
-        'success': True,
-        'message': 'بازی شروع شد'
-    })
 
 @app.route('/api/get_game_state', methods=['POST'])
 def get_game_state():
     data = request.get_json()
     game_id = data.get('game_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    return jsonify({
-        'success': True,
-        'game_state': game.get_game_state()
-    })
+    version = game.current_version()
+    etag = state_etag(game_id, version)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers={'ETag': etag})
+    if parse_version(data.get('since_version')) == version:
+        return jsonify({
+            'success': True,
+            'unchanged': True,
+            'version': version
+        })
+    
+    # ETag of the version the body was encoded at, a write may have landed since the check above
+    version, body = game.cached_view(state_cache.reply)
+    return Response(body, mimetype='application/json', headers={'ETag': state_etag(game_id, version)})
 
 @app.route('/api/attack', methods=['POST'])
 def attack():
@@ -287,83 +462,77 @@ def attack():
     to_region = data.get('to_region')
     soldiers = data.get('soldiers', 10)
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    # بررسی نوبت بازیکن
-    if game.get_current_player() != player_id:
-        return jsonify({
-            'success': False,
-            'message': 'نوبت شما نیست'
+    with game.lock:
+        valid, success, result_message = game.execute_attack(player_id, from_region, to_region, soldiers)
+        
+        if not valid:
+            return jsonify({
+                'success': False,
+                'message': result_message
+            })
+        
+        # اطلاع‌رسانی به تمام بازیکنان
+        outbox.emit(game_id, 'attack_result', {
+            'success': success,
+            'from_region': from_region,
+            'to_region': to_region,
+            'attacker': game.players[player_id]['name'],
+            'message': result_message
         })
-    
-    # اجرای حمله
-    if from_region not in game.regions or to_region not in game.regions:
+        
         return jsonify({
-            'success': False,
-            'message': 'منطقه معتبر نیست'
+            'success': True,
+            'attack_successful': success,
+            'message': result_message
         })
+
+@app.route('/api/attack_batch', methods=['POST'])
+def attack_batch():
+    data = request.get_json()
+    game_id = data.get('game_id')
+    player_id = data.get('player_id')
+    attacks = parse_attacks(data.get('attacks', []), 10)
     
-    # بررسی مالکیت منطقه مهاجم
-    if game.regions[from_region]['owner'] != player_id:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
-            'message': 'این منطقه متعلق به شما نیست'
+            'message': 'بازی پیدا نشد'
         })
-    
-    # بررسی تعداد سربازان
-    if game.regions[from_region]['soldiers'] <= soldiers:
+    if attacks is None:
         return jsonify({
             'success': False,
-            'message': 'تعداد سربازان کافی نیست'
+            'message': 'حملات نامعتبر است'
         })
     
-    # محاسبه نتیجه نبرد
-    attacker_soldiers = soldiers
-    defender_soldiers = game.regions[to_region]['soldiers']
-    
-    success, remaining_attackers, remaining_defenders = game_logic.calculate_battle_result(
-        attacker_soldiers, defender_soldiers
-    )
-    
-    # اعمال نتیجه
-    game.regions[from_region]['soldiers'] -= soldiers
-    
-    if success:
-        # حمله موفق
-        old_owner = game.regions[to_region]['owner']
-        if old_owner and old_owner in game.players:
-            game.players[old_owner]['regions'].remove(to_region)
+    with game.lock:
+        valid, results, result_message = game.execute_attacks(player_id, attacks)
         
-        game.regions[to_region]['owner'] = player_id
-        game.regions[to_region]['soldiers'] = remaining_attackers
-        game.players[player_id]['regions'].append(to_region)
+        if not valid:
+            return jsonify({
+                'success': False,
+                'message': result_message
+            })
         
-        result_message = f'حمله موفق! {to_region} تصرف شد'
-    else:
-        # حمله ناموفق
-        game.regions[to_region]['soldiers'] = remaining_defenders
-        result_message = f'حمله ناموفق! {remaining_defenders} سرباز دشمن باقی ماند'
-    
-    # اطلاع‌رسانی به تمام بازیکنان
-    socketio.emit('attack_result', {
-        'success': success,
-        'from_region': from_region,
-        'to_region': to_region,
-        'attacker': game.players[player_id]['name'],
-        'message': result_message
-    })
-    
-    return jsonify({
-        'success': True,
-        'attack_successful': success,
-        'message': result_message
-    })
+        # یک اطلاع‌رسانی برای کل دسته
+        outbox.emit(game_id, 'attack_results', {
+            'attacker': game.players[player_id]['name'],
+            'results': results,
+            'message': result_message
+        })
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'message': result_message
+        })
 
 # تنظیمات Socket.IO
 @socketio.on('connect')
@@ -377,31 +546,43 @@ def handle_disconnect():
 @socketio.on('join_game_room')
 def handle_join_room(data):
     game_id = data.get('game_id')
-    if game_id in games:
+    # بازی شارد دیگر اینجا نیست ولی رویدادهای اتاقش از طریق broker می‌رسد
+    if game_id in games or (shard is not None and not shard.owns(game_id)):
         join_room(game_id)
         emit('joined_room', {'game_id': game_id})
 
-def cleanup_old_games():
-    """پاکسازی بازی‌های قدیمی"""
-    while True:
-        time.sleep(300)  # هر 5 دقیقه چک کن
-        current_time = datetime.now()
-        to_remove = []
-        
-        for game_id, game in games.items():
-            # بازی‌های بیش از 2 ساعت بی‌استفاده را پاک کن
-            if (current_time - game.last_activity).seconds > 7200:
-                to_remove.append(game_id)
-        
-        for game_id in to_remove:
-            del games[game_id]
-            print(f'Removed old game: {game_id}')
+def turn_timeout(game_id, turn):
+    """رد کردن نوبتی که تا پایان مهلتش تمام نشده و تنظیم مهلت نوبت بعدی"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    with game.lock:
+        if game.status != 'playing':
+            return
+        if game.current_turn == turn:
+            game.skip_turn()
+            game.commit_changes()
+        scheduler.call_at(game.turn_deadline(), turn_timeout, game_id, game.current_turn)
+
+def expire_game(game_id):
+    """حذف بازی‌ای که GAME_TTL بی‌استفاده مانده؛ اگر فعالیتی داشته مهلت جدید تنظیم می‌شود"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    deadline = game.expiry_deadline()
+    if time.time() < deadline:
+        scheduler.call_at(deadline, expire_game, game_id)
+        return
+    
+    with games_lock:
+        del games[game_id]
+    state_cache.invalidate(game_id)
+    outbox.discard(game_id)
+    print(f'Removed old game: {game_id}')
 
 if __name__ == '__main__':
-    # شروع thread پاکسازی
-    cleanup_thread = threading.Thread(target=cleanup_old_games, daemon=True)
-    cleanup_thread.start()
-    
     # نمایش اطلاعات شبکه
     local_ip = get_local_ip()
     print(f"""
@@ -424,4 +605,9 @@ if __name__ == '__main__':
     """)
     
     # اجرای سرور
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=True, log_output=True)
\ No newline at end of file
+    if shard is not None:
+        # فقط router فایل sharding.py به شارد وصل می‌شود
+        scheduler.call_later(LOBBY_INTERVAL, publish_lobby)
+        socketio.run(app, host='127.0.0.1', port=shard.port, log_output=True)
+    else:
+        socketio.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=True, log_output=True)
\ No newline at end of file
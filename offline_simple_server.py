@@ -5,28 +5,43 @@ Server runs on local WiFi network without internet connection
 No Socket.IO dependencies - uses REST API only
 """
 
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
+import copy
 import threading
 import time
 import json
 import socket
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 from iran_map import IranMap
-from game_logic import GameLogic
+from game_logic import GameLogic, parse_attacks
+from journal import Journal, data_dir
+from replays import REPLAY_MIMETYPE, record_replay
+from scheduler import Scheduler
+from state_sync import (SSE_KEEPALIVE, StateSync, etag_matches, parse_version, state_cache, state_etag,
+                        wait_timeout)
+from werkzeug.serving import is_running_from_reloader
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'iran_war_offline_2025'
 
-# Global game state
+# بازی بی‌استفاده پس از GAME_TTL حذف می‌شود و هر نوبت حداکثر TURN_TIMEOUT طول می‌کشد
+GAME_TTL = timedelta(hours=2)
+TURN_TIMEOUT = timedelta(seconds=90)
+
+# Global game state; games_lock guards adding and removing games, each game has its own lock
 games = {}
+games_lock = threading.Lock()
 game_logic = GameLogic()
 iran_map = IranMap()
+# Per-game deadlines (turn timeouts, idle expiry)
+scheduler = Scheduler()
 
 class OfflineGame:
-    def __init__(self, game_id, host_player):
+    def __init__(self, game_id, host_player, seed=None, game_map=None):
         self.game_id = game_id
         self.host_player = host_player
+        self.host_profile = copy.deepcopy(host_player)
         self.players = {host_player['id']: host_player}
         self.status = 'waiting'  # waiting, playing, finished
         self.regions = {}
@@ -34,16 +49,49 @@ class OfflineGame:
         self.turn_order = []
         self.created_time = datetime.now()
         self.last_activity = datetime.now()
+        self.turn_started = self.last_activity
+        # هر بازی مولد تصادفی مخصوص خود را دارد تا از (seed, action_log) قابل بازسازی باشد
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.action_log = []
+        # لاگ پیش‌نویس (write-ahead) اقدامات این بازی، پس از شروع ثبت تنظیم می‌شود
+        self.journal = None
+        # نسخه‌ی وضعیت بازی که wait_state و جریان SSE منتظر آن می‌مانند
+        self.sync = StateSync(game_id)
+        # قفل بازی؛ هر درخواستی که بازی را می‌خواند یا تغییر می‌دهد آن را نگه می‌دارد
+        self.lock = threading.RLock()
+        # نقشه‌ی پیش‌فرض ایران یا یک نقشه‌ی تولیدشده
+        self.game_map = game_map if game_map is not None else iran_map
         self.initialize_regions()
         
+    @classmethod
+    def replay(cls, game_id, host_profile, seed, action_log, game_map=None):
+        """Rebuild a game exactly from its seed and action log"""
+        game = cls(game_id, copy.deepcopy(host_profile), seed=seed, game_map=game_map)
+        for action, *args in action_log:
+            getattr(game, action)(*args)
+        return game
+        
+    def init_args(self):
+        """Arguments of replay() that rebuild this game before its first action"""
+        return self.game_id, self.host_profile, self.seed
+        
+    def log_action(self, action, *args):
+        """Record a state-changing call for replay"""
+        if self.journal is not None:
+            self.journal.record(self, action, args)
+        self.action_log.append((action,) + args)
+        
     def initialize_regions(self):
         """Initialize Iran map regions for offline play"""
-        self.regions = iran_map.get_regions()
+        self.regions = self.game_map.new_game_regions()
         
     def add_player(self, player_id, player_name):
         if len(self.players) >= 8:
             return False
             
+        self.log_action('add_player', player_id, player_name)
+        
         colors = ['#e74c3c', '#3498db', '#2ecc71', '#f39c12', 
                  '#9b59b6', '#1abc9c', '#e67e22', '#95a5a6']
         player_color = colors[len(self.players)]
@@ -67,13 +115,15 @@ class OfflineGame:
         if len(self.players) < 2:
             return False
             
+        self.log_action('start_game')
+        
         self.status = 'playing'
         self.turn_order = list(self.players.keys())
-        random.shuffle(self.turn_order)
+        self.rng.shuffle(self.turn_order)
         
         # توزیع مناطق بین بازیکنان
         regions_list = list(self.regions.keys())
-        random.shuffle(regions_list)
+        self.rng.shuffle(regions_list)
         
         regions_per_player = len(regions_list) // len(self.players)
         remaining_regions = len(regions_list) % len(self.players)
@@ -93,6 +143,7 @@ class OfflineGame:
                     region_index += 1
         
         self.last_activity = datetime.now()
+        self.turn_started = self.last_activity
         return True
         
     def get_current_player(self):
@@ -100,22 +151,157 @@ class OfflineGame:
             return None
         return self.turn_order[self.current_turn % len(self.turn_order)]
         
+    def execute_attack(self, player_id, from_region, to_region, soldiers):
+        """Execute attack, returns (valid, attack_successful, message)"""
+        # بررسی نوبت بازیکن
+        if self.get_current_player() != player_id:
+            return False, False, 'نوبت شما نیست'
+        
+        if from_region not in self.regions or to_region not in self.regions:
+            return False, False, 'منطقه معتبر نیست'
+        
+        # بررسی مالکیت منطقه مهاجم
+        if self.regions[from_region]['owner'] != player_id:
+            return False, False, 'این منطقه متعلق به شما نیست'
+        
+        # بررسی تعداد سربازان
+        if self.regions[from_region]['soldiers'] <= soldiers:
+            return False, False, 'تعداد سربازان کافی نیست'
+        
+        self.log_action('execute_attack', player_id, from_region, to_region, soldiers)
+        
+        # محاسبه نتیجه نبرد
+        attacker_soldiers = soldiers
+        defender_soldiers = self.regions[to_region]['soldiers']
+        
+        success, remaining_attackers, remaining_defenders = game_logic.calculate_battle_result(
+            attacker_soldiers, defender_soldiers, rng=self.rng
+        )
+        
+        # اعمال نتیجه
+        self.regions[from_region]['soldiers'] -= soldiers
+        
+        if success:
+            # حمله موفق
+            old_owner = self.regions[to_region]['owner']
+            if old_owner and old_owner in self.players:
+                self.players[old_owner]['regions'].remove(to_region)
+            
+            self.regions[to_region]['owner'] = player_id
+            self.regions[to_region]['soldiers'] = remaining_attackers
+            self.players[player_id]['regions'].append(to_region)
+            
+            result_message = f'حمله موفق! {to_region} تصرف شد'
+        else:
+            # حمله ناموفق
+            self.regions[to_region]['soldiers'] = remaining_defenders
+            result_message = f'حمله ناموفق! {remaining_defenders} سرباز دشمن باقی ماند'
+        
+        # پایان نوبت
+        self.next_turn()
+        return True, success, result_message
+        
+    def execute_attacks(self, player_id, attacks):
+        """Execute a batch of attacks as one turn, returns (valid, results, message)"""
+        # بررسی نوبت بازیکن
+        if self.get_current_player() != player_id:
+            return False, [], 'نوبت شما نیست'
+        
+        self.log_action('execute_attacks', player_id, attacks)
+        
+        # اجرای همه حمله‌ها در یک مرحله
+        results = game_logic.resolve_battles(
+            self.regions, attacks, self.game_map.region_neighbors, self.players, player_id, self.rng
+        )
+        captured = sum(1 for result in results if result['attacker_wins'])
+        
+        # پایان نوبت (یک نوبت برای کل دسته)
+        self.next_turn()
+        return True, results, f'{captured} منطقه از {len(results)} حمله تصرف شد'
+        
+    def build_structure(self, player_id, region_id, building_type):
+        """Build structure, returns (valid, message)"""
+        # بررسی نوبت بازیکن
+        if self.get_current_player() != player_id:
+            return False, 'نوبت شما نیست'
+        
+        # بررسی مالکیت منطقه
+        if self.regions[region_id]['owner'] != player_id:
+            return False, 'این منطقه متعلق به شما نیست'
+        
+        # بررسی هزینه
+        building_cost = game_logic.get_building_cost(building_type)
+        if self.players[player_id]['coins'] < building_cost:
+            return False, 'سکه کافی ندارید'
+        
+        self.log_action('build_structure', player_id, region_id, building_type)
+        
+        # اعمال ساخت
+        self.players[player_id]['coins'] -= building_cost
+        if region_id not in self.players[player_id]['buildings']:
+            self.players[player_id]['buildings'][region_id] = []
+        self.players[player_id]['buildings'][region_id].append(building_type)
+        
+        # پایان نوبت
+        self.next_turn()
+        return True, f'{building_type} در {region_id} ساخته شد'
+        
     def next_turn(self):
         self.current_turn += 1
         self.last_activity = datetime.now()
+        self.turn_started = self.last_activity
+        
+    def skip_turn(self):
+        """نوبت بازیکنی که تا TURN_TIMEOUT کاری نکرده رد می‌شود (فعالیت حساب نمی‌شود)"""
+        self.log_action('skip_turn')
+        self.current_turn += 1
+        self.turn_started = datetime.now()
         
+    def turn_deadline(self):
+        """Deadline of the current turn as a time.time() value"""
+        return (self.turn_started + TURN_TIMEOUT).timestamp()
+        
+    def expiry_deadline(self):
+        """Time at which the game is removed unless it sees activity first"""
+        return (self.last_activity + GAME_TTL).timestamp()
+        
+    def commit_changes(self):
+        """Bump the state version if anything changed, waking long-poll and SSE clients"""
+        return self.sync.commit(self.regions, self.players, {
+            'status': self.status,
+            'current_turn': self.current_turn,
+            'turn_order': self.turn_order
+        })
+        
+    def current_version(self):
+        """Commit pending changes and return the resulting state version"""
+        with self.lock:
+            self.commit_changes()
+            return self.sync.version
+        
+    def cached_view(self, view):
+        """(version, cached encoding) of the current state, e.g. view=state_cache.reply"""
+        with self.lock:
+            version = self.current_version()
+            return version, view(self.game_id, version, self.get_game_state)
+    
     def get_game_state(self):
+        self.commit_changes()
         return {
             'game_id': self.game_id,
+            'version': self.sync.version,
             'status': self.status,
             'players': self.players,
-            'regions': self.regions,
+            'regions': self.regions.to_dict(),
             'current_player': self.get_current_player(),
             'turn_number': self.current_turn + 1,
             'created_time': self.created_time.isoformat(),
             'last_activity': self.last_activity.isoformat()
         }
 
+# ژورنال اقدامات و snapshotهای همه‌ی بازی‌ها؛ هنگام اجرای سرور فعال می‌شود
+journal = Journal(OfflineGame)
+
 def get_local_ip():
     """Get local IP address for WiFi network"""
     try:
@@ -141,7 +327,7 @@ def server_info():
         'status': 'online',
         'mode': 'offline',
         'total_games': len(games),
-        'active_players': sum(len(game.players) for game in games.values())
+        'active_players': sum(len(game.players) for game in list(games.values()))
     })
 
 @app.route('/api/create_game', methods=['POST'])
@@ -151,8 +337,6 @@ def create_game():
     
     # تولید Game ID منحصر به فرد
     game_id = ''.join(random.choices('0123456789', k=6))
-    while game_id in games:
-        game_id = ''.join(random.choices('0123456789', k=6))
     
     # ایجاد بازیکن میزبان
     host_player = {
@@ -166,9 +350,14 @@ def create_game():
         'is_host': True
     }
     
-    # ایجاد بازی جدید
-    game = OfflineGame(game_id, host_player)
-    games[game_id] = game
+    # ایجاد بازی جدید؛ شناسه زیر قفل انتخاب می‌شود تا دو درخواست همزمان یک شناسه نگیرند
+    with games_lock:
+        while game_id in games:
+            game_id = ''.join(random.choices('0123456789', k=6))
+        game = OfflineGame(game_id, host_player)
+        journal.track(game, game.init_args())
+        games[game_id] = game
+    scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
     
     return jsonify({
         'success': True,
@@ -184,35 +373,36 @@ def join_game():
     game_id = data.get('game_id')
     player_name = data.get('player_name', 'بازیکن')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    if game.status != 'waiting':
-        return jsonify({
-            'success': False,
-            'message': 'بازی قبلاً شروع شده است'
-        })
-    
-    player_id = f'player_{random.randint(1000, 9999)}'
-    success = game.add_player(player_id, player_name)
-    
-    if not success:
+    with game.lock:
+        if game.status != 'waiting':
+            return jsonify({
+                'success': False,
+                'message': 'بازی قبلاً شروع شده است'
+            })
+        
+        player_id = f'player_{random.randint(1000, 9999)}'
+        success = game.add_player(player_id, player_name)
+        game.commit_changes()
+        
+        if not success:
+            return jsonify({
+                'success': False,
+                'message': 'بازی پر است (حداکثر 8 نفر)'
+            })
+        
         return jsonify({
-            'success': False,
-            'message': 'بازی پر است (حداکثر 8 نفر)'
+            'success': True,
+            'player_id': player_id,
+            'game_id': game_id,
+            'message': f'{player_name} به بازی پیوست'
         })
-    
-    return jsonify({
-        'success': True,
-        'player_id': player_id,
-        'game_id': game_id,
-        'message': f'{player_name} به بازی پیوست'
-    })
 
 @app.route('/api/start_game', methods=['POST'])
 def start_game():
@@ -220,50 +410,63 @@ def start_game():
     game_id = data.get('game_id')
     player_id = data.get('player_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    # تنها میزبان می‌تواند بازی را شروع کند
-    if not game.players[player_id]['is_host']:
-        return jsonify({
-            'success': False,
-            'message': 'فقط میزبان می‌تواند بازی را شروع کند'
-        })
-    
-    success = game.start_game()
-    
-    if not success:
+    with game.lock:
+        # تنها میزبان می‌تواند بازی را شروع کند
+        if not game.players[player_id]['is_host']:
+            return jsonify({
+                'success': False,
+                'message': 'فقط میزبان می‌تواند بازی را شروع کند'
+            })
+        
+        success = game.start_game()
+        if success:
+            scheduler.call_at(game.turn_deadline(), turn_timeout, game_id, game.current_turn)
+        game.commit_changes()
+        
+        if not success:
+            return jsonify({
+                'success': False,
+                'message': 'حداقل 2 بازیکن لازم است'
+            })
+        
         return jsonify({
-            'success': False,
-            'message': 'حداقل 2 بازیکن لازم است'
+            'success': True,
+            'message': 'بازی شروع شد'
         })
-    
-    return jsonify({
-        'success': True,
-        'message': 'بازی شروع شد'
-    })
 
 @app.route('/api/get_game_state', methods=['POST'])
 def get_game_state():
     data = request.get_json()
     game_id = data.get('game_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    return jsonify({
-        'success': True,
-        'game_state': game.get_game_state()
-    })
+    version = game.current_version()
+    etag = state_etag(game_id, version)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers={'ETag': etag})
+    if parse_version(data.get('since_version')) == version:
+        return jsonify({
+            'success': True,
+            'unchanged': True,
+            'version': version
+        })
+    
+    # ETag of the version the body was encoded at, a write may have landed since the check above
+    version, body = game.cached_view(state_cache.reply)
+    return Response(body, mimetype='application/json', headers={'ETag': state_etag(game_id, version)})
 
 @app.route('/api/attack', methods=['POST'])
 def attack():
@@ -274,77 +477,63 @@ def attack():
     to_region = data.get('to_region')
     soldiers = data.get('soldiers', 10)
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    # بررسی نوبت بازیکن
-    if game.get_current_player() != player_id:
-        return jsonify({
-            'success': False,
-            'message': 'نوبت شما نیست'
-        })
-    
-    # اجرای حمله
-    if from_region not in game.regions or to_region not in game.regions:
+    with game.lock:
+        valid, success, result_message = game.execute_attack(player_id, from_region, to_region, soldiers)
+        game.commit_changes()
+        
+        if not valid:
+            return jsonify({
+                'success': False,
+                'message': result_message
+            })
+        
         return jsonify({
-            'success': False,
-            'message': 'منطقه معتبر نیست'
+            'success': True,
+            'attack_successful': success,
+            'message': result_message
         })
+
+@app.route('/api/attack_batch', methods=['POST'])
+def attack_batch():
+    data = request.get_json()
+    game_id = data.get('game_id')
+    player_id = data.get('player_id')
+    attacks = parse_attacks(data.get('attacks', []), 10)
     
-    # بررسی مالکیت منطقه مهاجم
-    if game.regions[from_region]['owner'] != player_id:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
-            'message': 'این منطقه متعلق به شما نیست'
+            'message': 'بازی پیدا نشد'
         })
-    
-    # بررسی تعداد سربازان
-    if game.regions[from_region]['soldiers'] <= soldiers:
+    if attacks is None:
         return jsonify({
             'success': False,
-            'message': 'تعداد سربازان کافی نیست'
+            'message': 'حملات نامعتبر است'
         })
     
-    # محاسبه نتیجه نبرد
-    attacker_soldiers = soldiers
-    defender_soldiers = game.regions[to_region]['soldiers']
-    
-    success, remaining_attackers, remaining_defenders = game_logic.calculate_battle_result(
-        attacker_soldiers, defender_soldiers
-    )
-    
-    # اعمال نتیجه
-    game.regions[from_region]['soldiers'] -= soldiers
-    
-    if success:
-        # حمله موفق
-        old_owner = game.regions[to_region]['owner']
-        if old_owner and old_owner in game.players:
-            game.players[old_owner]['regions'].remove(to_region)
+    with game.lock:
+        valid, results, result_message = game.execute_attacks(player_id, attacks)
+        game.commit_changes()
         
-        game.regions[to_region]['owner'] = player_id
-        game.regions[to_region]['soldiers'] = remaining_attackers
-        game.players[player_id]['regions'].append(to_region)
+        if not valid:
+            return jsonify({
+                'success': False,
+                'message': result_message
+            })
         
-        result_message = f'حمله موفق! {to_region} تصرف شد'
-    else:
-        # حمله ناموفق
-        game.regions[to_region]['soldiers'] = remaining_defenders
-        result_message = f'حمله ناموفق! {remaining_defenders} سرباز دشمن باقی ماند'
-    
-    # پایان نوبت
-    game.next_turn()
-    
-    return jsonify({
-        'success': True,
-        'attack_successful': success,
-        'message': result_message
-    })
+        return jsonify({
+            'success': True,
+            'results': results,
+            'message': result_message
+        })
 
 @app.route('/api/build', methods=['POST'])
 def build():
@@ -354,70 +543,130 @@ def build():
     region_id = data.get('region_id')
     building_type = data.get('building_type', 'barracks')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
             'message': 'بازی پیدا نشد'
         })
     
-    game = games[game_id]
-    
-    # بررسی نوبت بازیکن
-    if game.get_current_player() != player_id:
+    with game.lock:
+        success, message = game.build_structure(player_id, region_id, building_type)
+        game.commit_changes()
+        
         return jsonify({
-            'success': False,
-            'message': 'نوبت شما نیست'
+            'success': success,
+            'message': message
         })
-    
-    # بررسی مالکیت منطقه
-    if game.regions[region_id]['owner'] != player_id:
+
+@app.route('/api/wait_state')
+def wait_state():
+    """Long-poll: پاسخ به محض عبور نسخه‌ی بازی از ?since= یا پس از timeout"""
+    game_id = request.args.get('game_id')
+    since = parse_version(request.args.get('since'))
+    
+    game = games.get(game_id)
+    if game is None:
         return jsonify({
             'success': False,
-            'message': 'این منطقه متعلق به شما نیست'
+            'message': 'بازی پیدا نشد'
         })
     
-    # بررسی هزینه
-    building_cost = game_logic.get_building_cost(building_type)
-    if game.players[player_id]['coins'] < building_cost:
+    version = game.sync.clock.wait(since, wait_timeout(request.args.get('timeout')))
+    if version <= since:
         return jsonify({
-            'success': False,
-            'message': 'سکه کافی ندارید'
+            'success': True,
+            'changed': False,
+            'version': version
         })
     
-    # اعمال ساخت
-    game.players[player_id]['coins'] -= building_cost
-    if region_id not in game.players[player_id]['buildings']:
-        game.players[player_id]['buildings'][region_id] = []
-    game.players[player_id]['buildings'][region_id].append(building_type)
-    
-    # پایان نوبت
-    game.next_turn()
+    return Response(game.cached_view(state_cache.changed_reply)[1], mimetype='application/json')
+
+@app.route('/api/events')
+def events():
+    """جریان Server-Sent Events با یک رویداد 'state' برای هر نسخه‌ی بازی"""
+    game_id = request.args.get('game_id')
+    since = parse_version(request.headers.get('Last-Event-ID', request.args.get('since')))
+    
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({
+            'success': False,
+            'message': 'بازی پیدا نشد'
+        }), 404
+    
+    def stream():
+        version = since
+        while games.get(game_id) is game:
+            if game.sync.clock.wait(version, SSE_KEEPALIVE) > version:
+                version, event = game.cached_view(state_cache.event)
+                yield event
+            else:
+                yield b': keep-alive\n\n'
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/replay')
+def replay():
+    """فایل بازپخش بازی تا این لحظه، برای replays.py"""
+    game_id = request.args.get('game_id')
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({
+            'success': False,
+            'message': 'بازی پیدا نشد'
+        }), 404
     
-    return jsonify({
-        'success': True,
-        'message': f'{building_type} در {region_id} ساخته شد'
-    })
+    with game.lock:
+        data = record_replay(game, game.init_args(), 'offline_simple_server:OfflineGame')
+    return Response(data, mimetype=REPLAY_MIMETYPE,
+                    headers={'Content-Disposition': f'attachment; filename="{game_id}.iwr"'})
+
+def turn_timeout(game_id, turn):
+    """رد کردن نوبتی که تا پایان مهلتش تمام نشده و تنظیم مهلت نوبت بعدی"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    with game.lock:
+        if game.status != 'playing':
+            return
+        if game.current_turn == turn:
+            game.skip_turn()
+            game.commit_changes()
+        scheduler.call_at(game.turn_deadline(), turn_timeout, game_id, game.current_turn)
+
+def expire_game(game_id):
+    """حذف بازی‌ای که GAME_TTL بی‌استفاده مانده؛ اگر فعالیتی داشته مهلت جدید تنظیم می‌شود"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    deadline = game.expiry_deadline()
+    if time.time() < deadline:
+        scheduler.call_at(deadline, expire_game, game_id)
+        return
+    
+    with games_lock:
+        del games[game_id]
+    journal.forget(game_id)
+    state_cache.invalidate(game_id)
+    print(f'Removed old game: {game_id}')
 
-def cleanup_old_games():
-    """پاکسازی بازی‌های قدیمی"""
-    while True:
-        time.sleep(300)  # هر 5 دقیقه چک کن
-        current_time = datetime.now()
-        to_remove = []
-        
-        for game_id, game in games.items():
-            # بازی‌های بیش از 2 ساعت بی‌استفاده را پاک کن
-            if (current_time - game.last_activity).seconds > 7200:
-                to_remove.append(game_id)
-        
-        for game_id in to_remove:
-            del games[game_id]
-            print(f'Removed old game: {game_id}')
+def restore_games():
+    """بازیابی بازی‌های ثبت‌شده در ژورنال پس از راه‌اندازی مجدد و تنظیم دوباره‌ی مهلت‌هایشان"""
+    for game_id, game in journal.recover(data_dir('offline_simple_server')).items():
+        with game.lock:
+            games[game_id] = game
+            if game.status == 'playing':
+                scheduler.call_at(game.turn_deadline(), turn_timeout, game_id, game.current_turn)
+        scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
 
 if __name__ == '__main__':
-    # شروع thread پاکسازی
-    cleanup_thread = threading.Thread(target=cleanup_old_games, daemon=True)
-    cleanup_thread.start()
+    # در حالت debug پردازه‌ی فرزند reloader سرور را اجرا می‌کند، نه پردازه‌ی ناظر
+    if is_running_from_reloader():
+        restore_games()
     
     # نمایش اطلاعات شبکه
     local_ip = get_local_ip()
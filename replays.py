@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Replay files for Iran War Game matches
+A replay holds what a game class needs to re-simulate a match: its
+constructor arguments (with the seed) and the action log, varint encoded
+with every string stored once. Keyframes (game state, region table and
+generator state) are written right after the regions are dealt and every
+KEYFRAME_EVERY actions, and a turn index maps turns to action positions, so
+ReplayEngine can jump to any turn by replaying at most KEYFRAME_EVERY actions.
+
+file     := magic, u8 format version, strings, header, keyframes, actions
+strings  := varint count, (varint length, utf-8)...
+header   := value {game, init, actions, turns}; turns are action counts per turn
+keyframe := varint position, varint action stream offset, value [state, regions, rng]
+action   := varint name string, varint argument count, values
+value    := u8 tag, payload (zigzag varint, f64, string id, length + items, ...)
+
+Run: python replays.py match.iwr [turn]
+"""
+
+import importlib
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from journal import TRANSIENT
+
+MAGIC = b'IWR'
+FORMAT_VERSION = 1
+REPLAY_MIMETYPE = 'application/vnd.iranwar.replay'
+# Actions between two keyframes, the most a seek replays
+KEYFRAME_EVERY = 256
+# Game attributes a keyframe leaves out: rebuilt by the constructor, secret, or not game state
+KEYFRAME_SKIP = frozenset(TRANSIENT) | {'action_log', 'reconnect_tokens', 'player_sids', 'reduction_timer',
+                                          'bot_timers', 'bot_turn'}
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_BYTES = 6
+TAG_LIST = 7
+TAG_DICT = 8
+FLOAT = struct.Struct('<d')
+
+
+def load_game_class(path: str):
+    """Game class of a 'module:Class' path"""
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+class _Writer:
+    """Value encoder that numbers each distinct string once"""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.string_ids: Dict[str, int] = {}
+
+    def string(self, text: str) -> int:
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def value(self, out: bytearray, value):
+        if value is None:
+            out.append(TAG_NONE)
+        elif value is False or value is True:
+            out.append(TAG_TRUE if value else TAG_FALSE)
+        elif isinstance(value, int):
+            out.append(TAG_INT)
+            _varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            out.append(TAG_FLOAT)
+            out += FLOAT.pack(value)
+        elif isinstance(value, str):
+            out.append(TAG_STR)
+            _varint(out, self.string(value))
+        elif isinstance(value, (bytes, bytearray)):
+            out.append(TAG_BYTES)
+            _varint(out, len(value))
+            out += value
+        elif isinstance(value, (list, tuple)):
+            out.append(TAG_LIST)
+            _varint(out, len(value))
+            for item in value:
+                self.value(out, item)
+        elif isinstance(value, dict):
+            out.append(TAG_DICT)
+            _varint(out, len(value))
+            for key, item in value.items():
+                self.value(out, key)
+                self.value(out, item)
+        else:
+            raise TypeError(f'cannot store {type(value).__name__} in a replay')
+
+    def encodable(self, value) -> Optional[bytes]:
+        """Encoding of value, None for values a replay cannot hold (datetimes, sets)"""
+        out = bytearray()
+        try:
+            self.value(out, value)
+        except TypeError:
+            return None
+        return bytes(out)
+
+
+def _varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+class _Reader:
+    __slots__ = ('data', 'pos', 'strings')
+
+    def __init__(self, data: bytes, pos: int = 0, strings: List[str] = ()):
+        self.data = data
+        self.pos = pos
+        self.strings = strings
+
+    def varint(self) -> int:
+        data = self.data
+        result = shift = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == TAG_STR:
+            return self.strings[self.varint()]
+        if tag == TAG_INT:
+            raw = self.varint()
+            return raw >> 1 if not raw & 1 else -((raw + 1) >> 1)
+        if tag == TAG_LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == TAG_DICT:
+            result = {}
+            for _ in range(self.varint()):
+                key = self.value()
+                result[key] = self.value()
+            return result
+        if tag == TAG_NONE:
+            return None
+        if tag == TAG_FALSE:
+            return False
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_FLOAT:
+            (value,) = FLOAT.unpack_from(self.data, self.pos)
+            self.pos += FLOAT.size
+            return value
+        if tag == TAG_BYTES:
+            length = self.varint()
+            self.pos += length
+            return bytes(self.data[self.pos - length:self.pos])
+        raise ValueError(f'unknown value tag {tag}')
+
+    def action(self) -> Tuple[str, list]:
+        name = self.strings[self.varint()]
+        return name, [self.value() for _ in range(self.varint())]
+
+
+def _dump_regions(regions):
+    if hasattr(regions, 'dump'):
+        owners, soldiers, buildings = regions.dump()
+        return ['table', owners, soldiers, buildings]
+    # Region dicts (main.py): only the fields a match changes
+    return ['dicts', [[region['owner'], region['soldiers'], region['buildings']] for region in regions.values()]]
+
+
+def _load_regions(game, dump):
+    if dump[0] == 'table':
+        game.regions.load(dump[1:])
+        return
+    for region, (owner, soldiers, buildings) in zip(game.regions.values(), dump[1]):
+        region.update(owner=owner, soldiers=soldiers, buildings=buildings)
+
+
+def _keyframe(writer: _Writer, game) -> bytes:
+    state = {}
+    for key, value in vars(game).items():
+        if key not in KEYFRAME_SKIP and writer.encodable(value) is not None:
+            state[key] = value
+    version, internal, gauss = game.rng.getstate()
+    out = bytearray()
+    writer.value(out, [state, _dump_regions(game.regions), [version, array('I', internal).tobytes(), gauss]])
+    return bytes(out)
+
+
+def encode_replay(game_path: str, init_args: Tuple, action_log: List[Tuple], game_class=None) -> bytes:
+    """
+    Replay file of a match
+    game_path is the 'module:Class' of the game, init_args its constructor
+    arguments as in Class.replay(*init_args, action_log). The match is
+    re-simulated once to take the keyframes and the turn index.
+    """
+    if game_class is None:
+        game_class = load_game_class(game_path)
+    writer = _Writer()
+    game = game_class.replay(*init_args, [])
+
+    stream = bytearray()
+    keyframes = bytearray()
+    keyframe_count = 0
+    turn_starts = [0]
+    for position, (action, *args) in enumerate(action_log, 1):
+        _varint(stream, writer.string(action))
+        _varint(stream, len(args))
+        for arg in args:
+            writer.value(stream, arg)
+        getattr(game, action)(*args)
+        while game.current_turn >= len(turn_starts):
+            turn_starts.append(position)
+        # Right after the regions are dealt, then at a fixed interval
+        if (action == 'start_game' and keyframe_count == 0) or position % KEYFRAME_EVERY == 0:
+            _varint(keyframes, position)
+            _varint(keyframes, len(stream))
+            keyframes += _keyframe(writer, game)
+            keyframe_count += 1
+
+    header = bytearray()
+    turns = [later - earlier for earlier, later in zip(turn_starts, turn_starts[1:])]
+    writer.value(header, {'game': game_path, 'init': list(init_args), 'actions': len(action_log), 'turns': turns})
+
+    out = bytearray(MAGIC)
+    out.append(FORMAT_VERSION)
+    _varint(out, len(writer.strings))
+    for text in writer.strings:
+        encoded = text.encode('utf-8')
+        _varint(out, len(encoded))
+        out += encoded
+    out += header
+    _varint(out, keyframe_count)
+    out += keyframes
+    out += stream
+    return bytes(out)
+
+
+def record_replay(game, init_args: Tuple, game_path: str) -> bytes:
+    """Replay file of a live game so far (caller holds game.lock)"""
+    return encode_replay(game_path, init_args, list(game.action_log), type(game))
+
+
+class Replay:
+    """Parsed replay file; actions stay encoded until an engine reads them"""
+
+    def __init__(self, data: bytes):
+        if data[:len(MAGIC)] != MAGIC or data[len(MAGIC)] != FORMAT_VERSION:
+            raise ValueError('not an Iran War replay file')
+        reader = _Reader(data, len(MAGIC) + 1)
+        strings = []
+        for _ in range(reader.varint()):
+            length = reader.varint()
+            strings.append(bytes(data[reader.pos:reader.pos + length]).decode('utf-8'))
+            reader.pos += length
+        reader.strings = strings
+
+        header = reader.value()
+        self.game_path: str = header['game']
+        self.init_args: list = header['init']
+        self.action_count: int = header['actions']
+        # Action position at which each turn begins
+        self.turn_starts = [0]
+        for length in header['turns']:
+            self.turn_starts.append(self.turn_starts[-1] + length)
+        # (position, stream offset, encoded state) of every keyframe, in position order
+        self.keyframes: List[Tuple[int, int, int]] = []
+        for _ in range(reader.varint()):
+            position = reader.varint()
+            offset = reader.varint()
+            self.keyframes.append((position, offset, reader.pos))
+            reader.value()  # decoded only when a seek lands on it
+        self.data = data
+        self.strings = strings
+        self.stream_start = reader.pos
+
+    @classmethod
+    def load(cls, path: str) -> 'Replay':
+        with open(path, 'rb') as file:
+            return cls(file.read())
+
+    @property
+    def turn_count(self) -> int:
+        return len(self.turn_starts)
+
+    def reader(self, pos: int) -> _Reader:
+        return _Reader(self.data, pos, self.strings)
+
+    def actions(self):
+        """(action, args) of every action in order"""
+        reader = self.reader(self.stream_start)
+        for _ in range(self.action_count):
+            yield reader.action()
+
+
+class ReplayEngine:
+    """Headless re-simulation of a replay that can step forward and seek to any action or turn"""
+
+    def __init__(self, replay: Replay, game_class=None):
+        self.replay = replay
+        self.game_class = game_class if game_class is not None else load_game_class(replay.game_path)
+        self.game = None
+        self.position = 0
+        self._reader = None
+        self._restore(None)
+
+    def _restore(self, keyframe: Optional[Tuple[int, int, int]]):
+        """Fresh game at the start of the match, or at a keyframe"""
+        self.game = self.game_class.replay(*self.replay.init_args, [])
+        if keyframe is None:
+            self.position = 0
+            self._reader = self.replay.reader(self.replay.stream_start)
+            return
+        position, offset, state_pos = keyframe
+        state, regions, (version, internal, gauss) = self.replay.reader(state_pos).value()
+        vars(self.game).update(state)
+        _load_regions(self.game, regions)
+        self.game.rng.setstate((version, tuple(array('I', internal)), gauss))
+        self.position = position
+        self._reader = self.replay.reader(self.replay.stream_start + offset)
+
+    def step(self, count: int = 1) -> int:
+        """Apply up to count more actions, returns how many were applied"""
+        count = min(count, self.replay.action_count - self.position)
+        game = self.game
+        reader = self._reader
+        for _ in range(count):
+            name, args = reader.action()
+            getattr(game, name)(*args)
+        self.position += count
+        return count
+
+    def run(self):
+        """Fast-forward to the end of the match"""
+        self.step(self.replay.action_count - self.position)
+
+    def seek(self, position: int):
+        """State after the first position actions, from the nearest keyframe at or before it"""
+        position = max(0, min(position, self.replay.action_count))
+        keyframe = None
+        for candidate in self.replay.keyframes:
+            if candidate[0] > position:
+                break
+            keyframe = candidate
+        start = keyframe[0] if keyframe is not None else 0
+        if position < self.position or start > self.position:
+            self._restore(keyframe)
+        self.step(position - self.position)
+
+    def seek_turn(self, turn: int):
+        """State at the beginning of turn (0-based)"""
+        turn_starts = self.replay.turn_starts
+        self.seek(turn_starts[max(0, min(turn, len(turn_starts) - 1))])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    replay = Replay.load(sys.argv[1])
+    engine = ReplayEngine(replay)
+    if len(sys.argv) > 2:
+        engine.seek_turn(int(sys.argv[2]))
+    else:
+        engine.run()
+    print(f"{replay.game_path}: {replay.action_count} actions, {replay.turn_count} turns, "
+          f"{len(replay.keyframes)} keyframes; at action {engine.position}:")
+    for player_id, player in engine.game.players.items():
+        print(f"  {player.get('name', player_id)}: {len(player.get('regions', []))} regions")
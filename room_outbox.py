@@ -0,0 +1,51 @@
+"""
+Per-room outbound queue for Iran War Game Socket.IO events
+Events of one game room are collected for a short window and sent as one
+packet, so a burst of actions costs one fan-out over the room's clients
+instead of one per event, and no event ever reaches another game's clients.
+"""
+
+import threading
+from typing import Dict, List, Tuple
+
+# How long the first queued event of a room waits for others (seconds)
+COALESCE_WINDOW = 0.05
+# Event name of a coalesced burst: [{'event': name, 'data': payload}, ...]
+BATCH_EVENT = 'events'
+
+
+class RoomOutbox:
+    """Coalescing emit queue per Socket.IO room, flushed by a Scheduler"""
+
+    def __init__(self, socketio, scheduler, window: float = COALESCE_WINDOW):
+        self.socketio = socketio
+        self.scheduler = scheduler
+        self.window = window
+        self._rooms: Dict[str, List[Tuple[str, object]]] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, room: str, event: str, data):
+        """Queue an event for room; the first event of a burst arms the flush"""
+        with self._lock:
+            queue = self._rooms.get(room)
+            if queue is None:
+                queue = self._rooms[room] = []
+                self.scheduler.call_later(self.window, self.flush, room)
+            queue.append((event, data))
+
+    def flush(self, room: str):
+        """Send everything queued for room, a lone event keeps its own name"""
+        with self._lock:
+            events = self._rooms.pop(room, None)
+        if not events:
+            return
+        if len(events) == 1:
+            event, data = events[0]
+            self.socketio.emit(event, data, room=room)
+        else:
+            self.socketio.emit(BATCH_EVENT, [{'event': event, 'data': data} for event, data in events], room=room)
+
+    def discard(self, room: str):
+        """Drop whatever is still queued for a room that no longer exists"""
+        with self._lock:
+            self._rooms.pop(room, None)
@@ -0,0 +1,85 @@
+"""
+Deadline scheduler for Iran War Game servers
+One daemon thread sleeps until the earliest deadline in a heap and runs only
+the timers that are due, so periodic game work (soldier reduction, turn
+timeouts, idle expiry) costs O(due timers) instead of a scan over every game,
+and fires within milliseconds of its deadline instead of on the next sweep.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+
+class Timer:
+    """Handle of one scheduled call"""
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when: float, callback: Callable, args: tuple):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Skip the call; the heap entry is dropped when it reaches the top"""
+        self.cancelled = True
+
+
+class Scheduler:
+    """Heap of timers (time.time() deadlines) served by one daemon thread"""
+
+    def __init__(self, name: str = 'scheduler'):
+        self.name = name
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._order = itertools.count()  # FIFO among equal deadlines
+        self._wakeup = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_at(self, when: float, callback: Callable, *args) -> Timer:
+        """Run callback(*args) on the scheduler thread at time when"""
+        timer = Timer(when, callback, args)
+        with self._wakeup:
+            heapq.heappush(self._heap, (when, next(self._order), timer))
+            if self._heap[0][2] is timer:
+                self._wakeup.notify()  # new earliest deadline, shorten the sleep
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return timer
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        """Run callback(*args) after delay seconds"""
+        return self.call_at(time.time() + delay, callback, *args)
+
+    def pending(self) -> int:
+        """Timers still waiting to run"""
+        with self._wakeup:
+            return sum(1 for _, _, timer in self._heap if not timer.cancelled)
+
+    def _next_due(self) -> Timer:
+        with self._wakeup:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        return heapq.heappop(self._heap)[2]
+                    self._wakeup.wait(delay)
+                else:
+                    self._wakeup.wait()
+
+    def _run(self):
+        while True:
+            timer = self._next_due()
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                traceback.print_exc()  # one failing timer must not stop the others
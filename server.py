@@ -4,21 +4,60 @@ import json
 import threading
 import time
 import random
+import secrets
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from game_logic import GameLogic
+from bots import SEARCH_WORKERS, ThresholdRules, start_search_pool, think
+from game_logic import GameLogic, parse_attacks
 from iran_map import IranMap
+from journal import Journal, data_dir
+from scheduler import Scheduler
+from sharding import current_shard
+from spectators import SpectatorHub
+from state_sync import RawJSON, SocketJSON, StateSync, state_cache
+from werkzeug.serving import is_running_from_reloader
+from wire_codec import CODEC_COMPACT, choose_codec, encode_message
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'iran_war_game_secret'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Set when started by sharding.py: this process owns a slice of the game ids
+shard = current_shard()
+# SocketJSON splices cached state text into packets instead of re-encoding it per emit;
+# a sharded worker shares room emits with the other shards through the broker
+socketio = SocketIO(app, cors_allowed_origins="*", json=SocketJSON,
+                    **(shard.socketio_options() if shard is not None else {}))
 
-# Global game state
+# Soldiers in every region shrink by 10% once per interval of a running game
+REDUCTION_INTERVAL = timedelta(minutes=10)
+# A game without a connected player for GAME_TTL is removed, journal files included
+GAME_TTL = timedelta(hours=2)
+
+# Global game state; games_lock guards adding and removing games, each game has its own lock
 games = {}
+games_lock = threading.Lock()
 game_logic = GameLogic()
 iran_map = IranMap()
+# Per-game deadlines (soldier reduction ticks)
+scheduler = Scheduler()
+# Socket sid -> (game_id, player_id) of every attached client, so a disconnect needs no scan over games
+sessions = {}
+sessions_lock = threading.Lock()
+# Wire codec each socket negotiated on connect; compact sockets share a second room per game
+socket_codecs = {}
+# Read-only state feeds of spectators, at most SPECTATOR_FPS frames per second per game
+SPECTATOR_FPS = 5
+spectators = SpectatorHub(socketio, scheduler, max_fps=SPECTATOR_FPS)
+
+# Seconds between two moves of a bot player, and of search per move
+BOT_INTERVAL = 3.0
+BOT_BUDGET = 1.0
+bot_rules = ThresholdRules()
+# Bots wait for their searches on these threads, never on the scheduler's
+bot_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='bot')
 
 class Game:
-    def __init__(self, game_id, host_player):
+    def __init__(self, game_id, host_player, seed=None, game_map=None):
         self.game_id = game_id
         self.players = {}
         self.regions = {}
@@ -27,22 +66,59 @@ class Game:
         self.max_players = 8
         self.min_players = 2
         self.last_reduction_time = datetime.now()
+        self.reduction_timer = None
+        # Last time a player (not a bot) was connected
+        self.last_activity = datetime.now()
+        # Bot player_id -> timer of its next move
+        self.bot_timers = {}
         self.turn_order = []
         self.current_turn = 0
+        # Every random draw of this game goes through its own generator, so a
+        # game is reproducible from (seed, action_log)
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.action_log = []
+        # Write-ahead log of this game's actions, set once it is journaled
+        self.journal = None
+        # Socket currently holding each player slot, and reconnect token -> player_id
+        self.player_sids = {}
+        self.reconnect_tokens = {}
+        # Version counter and recent diffs for broadcasts and client resync
+        self.sync = StateSync(game_id)
+        # Held by every handler that reads or changes this game
+        self.lock = threading.RLock()
+        # Shared Iran map unless a generated map is given
+        self.game_map = game_map if game_map is not None else iran_map
         self.initialize_regions()
     
+    @classmethod
+    def replay(cls, game_id, host_player, seed, action_log, game_map=None):
+        """Rebuild a game exactly from its seed and action log"""
+        game = cls(game_id, host_player, seed=seed, game_map=game_map)
+        for action, *args in action_log:
+            getattr(game, action)(*args)
+        return game
+    
+    def init_args(self):
+        """Arguments of replay() that rebuild this game before its first action"""
+        return self.game_id, self.host, self.seed
+    
+    def log_action(self, action, *args):
+        """Record a state-changing call for replay"""
+        if self.journal is not None:
+            self.journal.record(self, action, args)
+        self.action_log.append((action,) + args)
+    
     def initialize_regions(self):
         """Initialize Iran map regions"""
-        self.regions = iran_map.get_regions()
-        for region_id, region in self.regions.items():
-            region['owner'] = None
-            region['soldiers'] = 0
-            region['buildings'] = {'barracks': 0, 'factory': 0, 'bank': 0}
+        self.regions = self.game_map.new_game_regions()
     
-    def add_player(self, player_id, player_name):
+    def add_player(self, player_id, player_name, is_bot=False):
         if len(self.players) >= self.max_players:
             return False
         
+        self.log_action('add_player', player_id, player_name, is_bot)
+        
         self.players[player_id] = {
             'name': player_name,
             'coins': 1000,
@@ -50,13 +126,31 @@ class Game:
             'companies': 1,
             'color': self.get_player_color(len(self.players)),
             'regions': [],
-            'connected': True
+            'connected': True,
+            'is_bot': is_bot
         }
         
         # Assign regions to player
         self.assign_regions_to_player(player_id)
         return True
     
+    def issue_reconnect_token(self, player_id):
+        """New secret that lets a returning device take over player_id"""
+        token = secrets.token_urlsafe(16)
+        self.add_reconnect_token(token, player_id)
+        return token
+    
+    def add_reconnect_token(self, token, player_id):
+        """Accept token for player_id (logged, so tokens survive a restart)"""
+        self.log_action('add_reconnect_token', token, player_id)
+        self.reconnect_tokens[token] = player_id
+    
+    def forget_reconnect_tokens(self, player_id):
+        """Revoke every token of a player that left on purpose"""
+        self.log_action('forget_reconnect_tokens', player_id)
+        self.reconnect_tokens = {token: owner for token, owner in self.reconnect_tokens.items()
+                                 if owner != player_id}
+    
     def get_player_color(self, player_index):
         colors = ['#FF0000', '#00FF00', '#0000FF', '#FFFF00', '#FF00FF', '#00FFFF', '#FFA500', '#800080']
         return colors[player_index % len(colors)]
@@ -71,13 +165,20 @@ class Game:
         unassigned_regions = [rid for rid, region in self.regions.items() if region['owner'] is None]
         
         # Assign regions to this player
-        player_regions = random.sample(unassigned_regions, min(regions_per_player, len(unassigned_regions)))
+        player_regions = self.rng.sample(unassigned_regions, min(regions_per_player, len(unassigned_regions)))
         
         for region_id in player_regions:
             self.regions[region_id]['owner'] = player_id
             self.regions[region_id]['soldiers'] = 10
             self.players[player_id]['regions'].append(region_id)
     
+    def start_game(self):
+        """Start the game with a shuffled turn order"""
+        self.log_action('start_game')
+        self.game_state = "playing"
+        self.turn_order = list(self.players.keys())
+        self.rng.shuffle(self.turn_order)
+    
     def can_attack(self, attacker_id, from_region, to_region):
         """Check if attack is valid"""
         if from_region not in self.regions or to_region not in self.regions:
@@ -90,14 +191,42 @@ class Game:
             return False
         
         # Check if regions are neighbors
-        return iran_map.are_neighbors(from_region, to_region)
+        return self.game_map.are_neighbors(from_region, to_region)
     
     def execute_attack(self, attacker_id, from_region, to_region, soldiers):
         """Execute attack between regions"""
-        if not self.can_attack(attacker_id, from_region, to_region):
+        if not self.attack_allowed(attacker_id, from_region, to_region, soldiers):
             return False
         
-        if self.regions[from_region]['soldiers'] <= soldiers:
+        self.log_action('execute_attack', attacker_id, from_region, to_region, soldiers)
+        return self.resolve_attack(attacker_id, from_region, to_region, soldiers)
+    
+    def execute_attacks(self, attacker_id, attacks):
+        """Execute a batch of (from_region, to_region, soldiers) attacks in order, each as execute_attack would"""
+        # Whatever goes through first is allowed before anything is applied, so
+        # a batch with no attack allowed now changes nothing and is not logged
+        if any(self.attack_allowed(attacker_id, *attack) for attack in attacks):
+            self.log_action('execute_attacks', attacker_id, attacks)
+        results = []
+        for from_region, to_region, soldiers in attacks:
+            valid = self.attack_allowed(attacker_id, from_region, to_region, soldiers)
+            results.append({
+                'from_region': from_region,
+                'to_region': to_region,
+                'soldiers': soldiers,
+                'valid': valid,
+                'attacker_wins': valid and self.resolve_attack(attacker_id, from_region, to_region, soldiers)
+            })
+        return results
+    
+    def attack_allowed(self, attacker_id, from_region, to_region, soldiers):
+        """Whether an attack can be made in the current state"""
+        return (self.can_attack(attacker_id, from_region, to_region)
+                and self.regions[from_region]['soldiers'] > soldiers)
+    
+    def resolve_attack(self, attacker_id, from_region, to_region, soldiers):
+        """Apply one attack without logging it, returns whether the attacker took the region"""
+        if not self.attack_allowed(attacker_id, from_region, to_region, soldiers):
             return False
         
         # Calculate battle result
@@ -146,69 +275,229 @@ class Game:
         if self.players[player_id]['coins'] < costs[structure_type]:
             return False
         
+        self.log_action('build_structure', player_id, region_id, structure_type)
+        
         self.players[player_id]['coins'] -= costs[structure_type]
         self.regions[region_id]['buildings'][structure_type] += 1
         return True
     
     def reduce_soldiers(self):
-        """Reduce soldiers every 10 minutes"""
+        """Apply the soldier reduction if an interval has passed since the last one"""
         now = datetime.now()
-        if now - self.last_reduction_time >= timedelta(minutes=10):
-            for region_id, region in self.regions.items():
-                if region['soldiers'] > 0:
-                    reduction = max(1, region['soldiers'] // 10)
-                    region['soldiers'] = max(0, region['soldiers'] - reduction)
-            
+        if now - self.last_reduction_time >= REDUCTION_INTERVAL:
+            self.apply_soldier_reduction()
             self.last_reduction_time = now
             return True
         return False
     
+    def players_connected(self):
+        """Whether any player other than a bot is connected"""
+        return any(player['connected'] and not player.get('is_bot') for player in self.players.values())
+    
+    def expiry_deadline(self):
+        """Time at which the game is removed unless a player connects first"""
+        return (self.last_activity + GAME_TTL).timestamp()
+    
+    def next_reduction_time(self):
+        """Deadline of the next soldier reduction as a time.time() value"""
+        return (self.last_reduction_time + REDUCTION_INTERVAL).timestamp()
+    
+    def apply_soldier_reduction(self):
+        """Reduce soldiers in every region by 10%"""
+        self.log_action('apply_soldier_reduction')
+        for region_id, region in self.regions.items():
+            if region['soldiers'] > 0:
+                reduction = max(1, region['soldiers'] // 10)
+                region['soldiers'] = max(0, region['soldiers'] - reduction)
+    
+    def commit_changes(self):
+        """Bump the state version, returns the diff since the last commit (None if unchanged)"""
+        return self.sync.commit(self.regions, self.players, {
+            'game_state': self.game_state,
+            'current_turn': self.current_turn,
+            'turn_order': self.turn_order
+        })
+    
+    def shared_state(self):
+        """Current state as cached JSON text, encoded once per version for every socket"""
+        with self.lock:
+            self.commit_changes()
+            return state_cache.socket_state(self.game_id, self.sync.version, self.get_game_state)
+    
+    def compact_state(self):
+        """Current state walked once per version by the compact encoder"""
+        with self.lock:
+            self.commit_changes()
+            return state_cache.compact_state(self.game_id, self.sync.version, self.get_game_state,
+                                             self.regions.topology)
+    
     def get_game_state(self):
         """Get current game state"""
+        self.commit_changes()
         return {
             'game_id': self.game_id,
+            'version': self.sync.version,
             'players': self.players,
-            'regions': self.regions,
+            'regions': self.regions.to_dict(),
             'game_state': self.game_state,
             'current_turn': self.current_turn,
-            'turn_order': self.turn_order
+            'turn_order': self.turn_order,
+            'host': self.host
         }
 
+# Action log and snapshots of every game, enabled by restore_games() when the server starts
+journal = Journal(Game, transient=('reduction_timer', 'bot_timers', 'player_sids'))
+
+def attach_session(sid, game, player_id):
+    """Bind a socket to a player slot, replacing the socket that held it before (caller holds game.lock)"""
+    with sessions_lock:
+        old_sid = game.player_sids.get(player_id)
+        if old_sid is not None and old_sid != sid:
+            sessions.pop(old_sid, None)
+        sessions[sid] = (game.game_id, player_id)
+    game.player_sids[player_id] = sid
+
+def detach_session(sid):
+    """Unbind a socket, returns the (game_id, player_id) it held or None"""
+    with sessions_lock:
+        return sessions.pop(sid, None)
+
+def session_player(game_id):
+    """player_id the calling socket holds in game_id, None if it has no slot there"""
+    session = sessions.get(request.sid)
+    if session is None or session[0] != game_id:
+        return None
+    return session[1]
+
+def release_player(game_id, player_id, sid, forget_tokens=False):
+    """Mark a player disconnected unless another socket has already taken over the slot"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    with game.lock:
+        if forget_tokens:
+            game.forget_reconnect_tokens(player_id)
+        if game.player_sids.get(player_id) != sid:
+            return
+        del game.player_sids[player_id]
+        game.players[player_id]['connected'] = False
+        game.last_activity = datetime.now()
+        emit_game(game, 'player_disconnected', {
+            'player_id': player_id,
+            'diff': game.commit_changes()
+        })
+
+def game_room(game_id):
+    """Room of a game for the codec of the calling socket"""
+    if socket_codecs.get(request.sid) == CODEC_COMPACT:
+        return f'{game_id}/{CODEC_COMPACT}'
+    return game_id
+
+def compact_payload(game, payload):
+    """Compact encoding of an event payload, cached state text swapped for the cached compact state"""
+    if isinstance(payload, RawJSON):
+        payload = game.compact_state()
+    else:
+        payload = {key: game.compact_state() if isinstance(value, RawJSON) else value
+                   for key, value in payload.items()}
+    return encode_message(payload, game.regions.topology)
+
+def emit_game(game, event, payload, skip_sid=None):
+    """Emit to every socket of a game, encoded once per codec in use, and arm the spectators' next frame"""
+    socketio.emit(event, payload, room=game.game_id, skip_sid=skip_sid)
+    if any(socket_codecs.get(sid) == CODEC_COMPACT for sid in game.player_sids.values()):
+        socketio.emit(event, compact_payload(game, payload), room=f'{game.game_id}/{CODEC_COMPACT}',
+                      skip_sid=skip_sid)
+    spectators.publish(game)
+
+def emit_self(game, event, payload):
+    """Emit to the calling socket in its codec"""
+    if socket_codecs.get(request.sid) == CODEC_COMPACT:
+        payload = compact_payload(game, payload)
+    emit(event, payload)
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     print(f"Client connected: {request.sid}")
-    emit('connected', {'status': 'success'})
+    # Clients offer codecs in the connect auth, the rest stay on JSON
+    codec = choose_codec((auth or {}).get('codecs'))
+    socket_codecs[request.sid] = codec
+    emit('connected', {'status': 'success', 'codec': codec})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print(f"Client disconnected: {request.sid}")
-    # Handle player disconnection
-    for game_id, game in games.items():
-        if request.sid in game.players:
-            game.players[request.sid]['connected'] = False
-            emit('player_disconnected', {'player_id': request.sid}, room=game_id)
+    session = detach_session(request.sid)
+    if session is not None:
+        release_player(session[0], session[1], request.sid)
+    spectators.remove(request.sid)
+    socket_codecs.pop(request.sid, None)
+
+@socketio.on('spectate')
+def handle_spectate(data):
+    """Watch a game read-only: spectator_frame events, acknowledged with spectator_ack"""
+    game_id = data.get('game_id')
+    
+    game = games.get(game_id)
+    if game is None:
+        emit('error', {'message': 'بازی پیدا نشد'})
+        return
+    
+    spectators.add(game, request.sid)
+
+@socketio.on('spectator_ack')
+def handle_spectator_ack(data):
+    spectators.ack(request.sid, data.get('version'))
+
+@socketio.on('stop_spectating')
+def handle_stop_spectating(data=None):
+    spectators.remove(request.sid)
+
+@socketio.on('leave_game')
+def handle_leave_game(data):
+    """Give up the player slot for good, its reconnect tokens stop working"""
+    session = detach_session(request.sid)
+    if session is None:
+        return
+    game_id, player_id = session
+    leave_room(game_room(game_id))
+    release_player(game_id, player_id, request.sid, forget_tokens=True)
 
 @socketio.on('create_game')
 def handle_create_game(data):
     player_name = data.get('player_name', 'Player')
-    game_id = f"game_{len(games) + 1}_{int(time.time())}"
     
     # Create new game
-    game = Game(game_id, request.sid)
-    game.add_player(request.sid, player_name)
-    games[game_id] = game
+    with games_lock:
+        game_id = f"game_{len(games) + 1}_{int(time.time())}"
+        if shard is not None:
+            # Only an id this shard owns, so the router sends the game's traffic here
+            base_id = game_id
+            game_id = shard.new_game_id(lambda attempt: f"{base_id}_{attempt}" if attempt else base_id)
+        game = Game(game_id, request.sid)
+        journal.track(game, game.init_args())
+        game.add_player(request.sid, player_name)
+        games[game_id] = game
+    scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
+    
+    # The first sid of a player is its id for the whole game, reconnects reuse it
+    with game.lock:
+        attach_session(request.sid, game, request.sid)
+        reconnect_token = game.issue_reconnect_token(request.sid)
     
     # Join room
-    join_room(game_id)
+    join_room(game_room(game_id))
     
-    emit('game_created', {
+    emit_self(game, 'game_created', {
         'game_id': game_id,
         'player_id': request.sid,
-        'game_state': game.get_game_state()
+        'reconnect_token': reconnect_token,
+        'game_state': game.shared_state()
     })
 
 @socketio.on('join_game')
@@ -216,51 +505,127 @@ def handle_join_game(data):
     game_id = data.get('game_id')
     player_name = data.get('player_name', 'Player')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    game = games[game_id]
+    with game.lock:
+        if not game.add_player(request.sid, player_name):
+            emit('error', {'message': 'بازی پر است'})
+            return
+        
+        # Notify the players already in the room with a diff
+        emit_game(game, 'player_joined', {
+            'player_id': request.sid,
+            'player_name': player_name,
+            'diff': game.commit_changes()
+        })
+        
+        # Join room, the new player starts from a full snapshot
+        attach_session(request.sid, game, request.sid)
+        join_room(game_room(game_id))
+        emit_self(game, 'player_joined', {
+            'player_id': request.sid,
+            'player_name': player_name,
+            'reconnect_token': game.issue_reconnect_token(request.sid),
+            'game_state': game.shared_state()
+        })
+
+@socketio.on('rejoin_game')
+def handle_rejoin_game(data):
+    """Reattach a returning device to its player slot and catch it up from its version"""
+    game_id = data.get('game_id')
+    version = data.get('version', -1)
     
-    if not game.add_player(request.sid, player_name):
-        emit('error', {'message': 'بازی پر است'})
+    game = games.get(game_id)
+    if game is None:
+        emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    # Join room
-    join_room(game_id)
-    
-    # Notify all players
-    emit('player_joined', {
-        'player_id': request.sid,
-        'player_name': player_name,
-        'game_state': game.get_game_state()
-    }, room=game_id)
+    with game.lock:
+        player_id = game.reconnect_tokens.get(data.get('reconnect_token'))
+        if player_id is None or player_id not in game.players:
+            emit('error', {'message': 'توکن اتصال مجدد نامعتبر است'})
+            return
+        
+        attach_session(request.sid, game, player_id)
+        join_room(game_room(game_id))
+        game.players[player_id]['connected'] = True
+        emit_game(game, 'player_reconnected', {
+            'player_id': player_id,
+            'diff': game.commit_changes()
+        }, skip_sid=request.sid)
+        
+        # Missed diffs are enough unless the gap outgrew the history
+        diffs = game.sync.diffs_since(version) if isinstance(version, int) else None
+        reply = {'game_id': game_id, 'player_id': player_id}
+        if diffs is None:
+            reply['game_state'] = game.shared_state()
+        else:
+            reply['diffs'] = diffs
+        emit_self(game, 'rejoined', reply)
 
-@socketio.on('start_game')
-def handle_start_game(data):
+@socketio.on('add_bot')
+def handle_add_bot(data):
+    """The host fills a free seat with a bot player"""
     game_id = data.get('game_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    game = games[game_id]
-    
-    if request.sid != game.host:
-        emit('error', {'message': 'فقط میزبان می‌تواند بازی را شروع کند'})
-        return
+    player_id = session_player(game_id)
+    with game.lock:
+        if player_id != game.host:
+            emit('error', {'message': 'فقط میزبان می‌تواند ربات اضافه کند'})
+            return
+        
+        if game.game_state != "waiting":
+            emit('error', {'message': 'بازی شروع شده است'})
+            return
+        
+        bot_id = f"bot_{secrets.token_hex(4)}"
+        bot_name = data.get('bot_name') or f"ربات {len(game.players)}"
+        if not game.add_player(bot_id, bot_name, is_bot=True):
+            emit('error', {'message': 'بازی پر است'})
+            return
+        
+        emit_game(game, 'player_joined', {
+            'player_id': bot_id,
+            'player_name': bot_name,
+            'diff': game.commit_changes()
+        })
+
+@socketio.on('start_game')
+def handle_start_game(data):
+    game_id = data.get('game_id')
     
-    if len(game.players) < game.min_players:
-        emit('error', {'message': 'حداقل 2 بازیکن نیاز است'})
+    game = games.get(game_id)
+    if game is None:
+        emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    game.game_state = "playing"
-    game.turn_order = list(game.players.keys())
-    random.shuffle(game.turn_order)
-    
-    emit('game_started', {
-        'game_state': game.get_game_state()
-    }, room=game_id)
+    player_id = session_player(game_id)
+    with game.lock:
+        if player_id != game.host:
+            emit('error', {'message': 'فقط میزبان می‌تواند بازی را شروع کند'})
+            return
+        
+        if len(game.players) < game.min_players:
+            emit('error', {'message': 'حداقل 2 بازیکن نیاز است'})
+            return
+        
+        game.start_game()
+        if game.reduction_timer is not None:
+            game.reduction_timer.cancel()
+        game.reduction_timer = scheduler.call_at(game.next_reduction_time(), reduction_tick, game_id)
+        start_bots(game)
+        
+        emit_game(game, 'game_started', {
+            'game_state': game.shared_state()
+        })
 
 @socketio.on('attack')
 def handle_attack(data):
@@ -269,29 +634,70 @@ def handle_attack(data):
     to_region = data.get('to_region')
     soldiers = data.get('soldiers', 1)
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    game = games[game_id]
+    player_id = session_player(game_id)
+    if player_id is None:
+        emit('error', {'message': 'شما بازیکن این بازی نیستید'})
+        return
     
-    if game.game_state != "playing":
-        emit('error', {'message': 'بازی شروع نشده است'})
+    with game.lock:
+        if game.game_state != "playing":
+            emit('error', {'message': 'بازی شروع نشده است'})
+            return
+        
+        success = game.execute_attack(player_id, from_region, to_region, soldiers)
+        diff = game.commit_changes()
+        
+        if success:
+            emit_game(game, 'attack_success', {
+                'attacker': player_id,
+                'from_region': from_region,
+                'to_region': to_region,
+                'soldiers': soldiers,
+                'diff': diff
+            })
+        else:
+            emit('attack_failed', {
+                'message': 'حمله ناموفق بود'
+            })
+            # A lost battle still changes soldier counts
+            if diff is not None:
+                emit_game(game, 'state_diff', diff)
+
+@socketio.on('attack_batch')
+def handle_attack_batch(data):
+    game_id = data.get('game_id')
+    attacks = parse_attacks(data.get('attacks', []), 1)
+    
+    game = games.get(game_id)
+    if game is None:
+        emit('error', {'message': 'بازی پیدا نشد'})
+        return
+    if attacks is None:
+        emit('error', {'message': 'حملات نامعتبر است'})
         return
     
-    success = game.execute_attack(request.sid, from_region, to_region, soldiers)
+    player_id = session_player(game_id)
+    if player_id is None:
+        emit('error', {'message': 'شما بازیکن این بازی نیستید'})
+        return
     
-    if success:
-        emit('attack_success', {
-            'attacker': request.sid,
-            'from_region': from_region,
-            'to_region': to_region,
-            'soldiers': soldiers,
-            'game_state': game.get_game_state()
-        }, room=game_id)
-    else:
-        emit('attack_failed', {
-            'message': 'حمله ناموفق بود'
+    with game.lock:
+        if game.game_state != "playing":
+            emit('error', {'message': 'بازی شروع نشده است'})
+            return
+        
+        results = game.execute_attacks(player_id, attacks)
+        
+        # One broadcast covers the whole batch
+        emit_game(game, 'attacks_resolved', {
+            'attacker': player_id,
+            'results': results,
+            'diff': game.commit_changes()
         })
 
 @socketio.on('build')
@@ -300,55 +706,177 @@ def handle_build(data):
     region_id = data.get('region_id')
     structure_type = data.get('structure_type')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    game = games[game_id]
-    
-    if game.game_state != "playing":
-        emit('error', {'message': 'بازی شروع نشده است'})
+    player_id = session_player(game_id)
+    if player_id is None:
+        emit('error', {'message': 'شما بازیکن این بازی نیستید'})
         return
     
-    success = game.build_structure(request.sid, region_id, structure_type)
-    
-    if success:
-        emit('build_success', {
-            'player_id': request.sid,
-            'region_id': region_id,
-            'structure_type': structure_type,
-            'game_state': game.get_game_state()
-        }, room=game_id)
-    else:
-        emit('build_failed', {
-            'message': 'ساخت ناموفق بود'
-        })
+    with game.lock:
+        if game.game_state != "playing":
+            emit('error', {'message': 'بازی شروع نشده است'})
+            return
+        
+        success = game.build_structure(player_id, region_id, structure_type)
+        
+        if success:
+            emit_game(game, 'build_success', {
+                'player_id': player_id,
+                'region_id': region_id,
+                'structure_type': structure_type,
+                'diff': game.commit_changes()
+            })
+        else:
+            emit('build_failed', {
+                'message': 'ساخت ناموفق بود'
+            })
 
 @socketio.on('get_game_state')
 def handle_get_game_state(data):
     game_id = data.get('game_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
+        emit('error', {'message': 'بازی پیدا نشد'})
+        return
+    
+    emit_self(game, 'game_state_update', game.shared_state())
+
+@socketio.on('resync')
+def handle_resync(data):
+    """Catch a client up from its version: missed diffs, or a snapshot if the gap is too large"""
+    game_id = data.get('game_id')
+    version = data.get('version', -1)
+    
+    game = games.get(game_id)
+    if game is None:
         emit('error', {'message': 'بازی پیدا نشد'})
         return
     
-    game = games[game_id]
-    emit('game_state_update', game.get_game_state())
+    with game.lock:
+        game.commit_changes()
+        diffs = game.sync.diffs_since(version) if isinstance(version, int) else None
+        if diffs is None:
+            emit_self(game, 'game_state_update', game.shared_state())
+        else:
+            emit_self(game, 'state_diffs', {'diffs': diffs})
 
-def soldier_reduction_thread():
-    """Background thread to reduce soldiers every 10 minutes"""
-    while True:
-        time.sleep(60)  # Check every minute
-        for game_id, game in games.items():
+def reduction_tick(game_id):
+    """Scheduled soldier reduction of one game, re-arms itself for the next interval"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    with game.lock:
+        if game.game_state != "playing":
+            return
+        if game.reduce_soldiers():
+            emit_game(game, 'soldiers_reduced', {
+                'diff': game.commit_changes()
+            })
+        game.reduction_timer = scheduler.call_at(game.next_reduction_time(), reduction_tick, game_id)
+
+def start_bots(game):
+    """Arm the first move of every bot of a game that is playing (caller holds game.lock)"""
+    for player_id, player in game.players.items():
+        if player.get('is_bot') and player_id not in game.bot_timers:
+            game.bot_timers[player_id] = scheduler.call_later(BOT_INTERVAL, bot_tick, game.game_id, player_id)
+
+def bot_tick(game_id, player_id):
+    """A bot's move is due; it searches on a bot thread so the scheduler keeps its timing"""
+    bot_executor.submit(bot_turn, game_id, player_id)
+
+def bot_turn(game_id, player_id):
+    """Search and play one move of a bot, then arm its next one"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    # The search runs without game.lock, players keep playing meanwhile
+    try:
+        move = think(game, player_id, bot_rules, time_budget=BOT_BUDGET)
+    except Exception:
+        traceback.print_exc()  # a failed search skips this move, the bot is still armed for its next one
+        move = None
+    
+    with game.lock:
+        if game.game_state != "playing" or games.get(game_id) is not game:
+            game.bot_timers.pop(player_id, None)
+            return
+        
+        # Moves are checked again against the state they now meet
+        if move is not None and move[0] == 'attack':
+            emit_game(game, 'attacks_resolved', {
+                'attacker': player_id,
+                'results': game.execute_attacks(player_id, [move[1:]]),
+                'diff': game.commit_changes()
+            })
+        elif move is not None and game.build_structure(player_id, *move[1:]):
+            emit_game(game, 'build_success', {
+                'player_id': player_id,
+                'region_id': move[1],
+                'structure_type': move[2],
+                'diff': game.commit_changes()
+            })
+        
+        if not game.players[player_id]['regions']:
+            game.bot_timers.pop(player_id, None)  # out of the game
+            return
+        game.bot_timers[player_id] = scheduler.call_later(BOT_INTERVAL, bot_tick, game_id, player_id)
+
+def expire_game(game_id):
+    """Remove a game no player has been connected to for GAME_TTL, or check again at its new deadline"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    with game.lock:
+        if game.players_connected():
+            game.last_activity = datetime.now()
+        deadline = game.expiry_deadline()
+        if time.time() < deadline:
+            scheduler.call_at(deadline, expire_game, game_id)
+            return
+        if game.reduction_timer is not None:
+            game.reduction_timer.cancel()
+        for timer in game.bot_timers.values():
+            timer.cancel()
+        game.bot_timers.clear()
+    
+    with games_lock:
+        games.pop(game_id, None)
+    journal.forget(game_id)
+    state_cache.invalidate(game_id)
+    print(f"Removed idle game: {game_id}")
+
+def restore_games():
+    """Reload the games journaled before a restart and re-arm their reduction ticks, bots and expiry"""
+    directory = data_dir('server' if shard is None else f'server-shard{shard.index}')
+    for game_id, game in journal.recover(directory).items():
+        with game.lock:
+            # Their sockets went down with the old process; players come back through rejoin_game
+            for player in game.players.values():
+                player['connected'] = player.get('is_bot', False)
+            # Players get a full GAME_TTL to rejoin
+            game.last_activity = datetime.now()
+            games[game_id] = game
             if game.game_state == "playing":
-                if game.reduce_soldiers():
-                    socketio.emit('soldiers_reduced', {
-                        'game_state': game.get_game_state()
-                    }, room=game_id)
+                game.reduction_timer = scheduler.call_at(game.next_reduction_time(), reduction_tick, game_id)
+                start_bots(game)
+        scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
 
 if __name__ == '__main__':
-    # Start soldier reduction thread
-    reduction_thread = threading.Thread(target=soldier_reduction_thread, daemon=True)
-    reduction_thread.start()
-    
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    # With debug the reloader's child process serves, the watching parent keeps no games
+    if shard is not None or is_running_from_reloader():
+        # Bot search processes are forked before any timer runs; shards split them
+        start_search_pool(max(1, SEARCH_WORKERS // shard.shards) if shard is not None else SEARCH_WORKERS)
+        restore_games()
+    if shard is not None:
+        # Only the router of sharding.py talks to a shard
+        socketio.run(app, host='127.0.0.1', port=shard.port)
+    else:
+        socketio.run(app, host='0.0.0.0', port=5000, debug=True)
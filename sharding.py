@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Sharded hosting for the Iran War Game Socket.IO servers
+N worker processes each own the game_ids that a consistent hash ring maps
+to them. A front router forwards every HTTP request, Socket.IO long-poll
+and WebSocket to the owner of the game_id in its query string or JSON body
+(requests without one go by client address, and a shard only creates games
+it owns). Room emits and lobby summaries travel through the local broker.
+
+Run: python sharding.py server [shards] [port]
+     python sharding.py offline_server [shards] [port]
+"""
+
+import bisect
+import hashlib
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from broker import Broker, BrokerClient, BrokerManager
+
+# Environment of a worker process, set by the launcher
+SHARD_ENV = 'IRANWAR_SHARD'
+SHARDS_ENV = 'IRANWAR_SHARDS'
+PORT_ENV = 'IRANWAR_SHARD_PORT'
+BROKER_ENV = 'IRANWAR_BROKER'
+
+# Ring points per shard; more points spread games more evenly
+VNODES = 64
+LOBBY_CHANNEL = 'lobby'
+# Seconds between lobby summaries of a shard; summaries older than LOBBY_TTL are dropped
+LOBBY_INTERVAL = 2.0
+LOBBY_TTL = 3 * LOBBY_INTERVAL
+# Headers that belong to one connection and are not forwarded
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'te', 'trailer', 'upgrade'}
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash of keys onto shard numbers"""
+
+    def __init__(self, shards: int, vnodes: int = VNODES):
+        points = sorted((_hash(f'{shard}:{point}'), shard) for shard in range(shards) for point in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: str) -> int:
+        return self._shards[bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+class Shard:
+    """This worker's place in a sharded deployment"""
+
+    def __init__(self, index: int, shards: int, port: int, broker_path: str):
+        self.index = index
+        self.shards = shards
+        self.port = port
+        self.broker_path = broker_path
+        self.ring = HashRing(shards)
+        self.broker = BrokerClient(broker_path)
+        # Latest lobby summary of every other shard: shard -> (received at, summary)
+        self._lobby: Dict[int, Tuple[float, Dict]] = {}
+        self._lobby_lock = threading.Lock()
+        threading.Thread(target=self._listen_lobby, name='lobby', daemon=True).start()
+
+    def owns(self, game_id: str) -> bool:
+        return self.ring.shard_for(game_id) == self.index
+
+    def new_game_id(self, make_id: Callable[[int], str]) -> str:
+        """First of make_id(0), make_id(1), ... that this shard owns"""
+        for attempt in count():
+            game_id = make_id(attempt)
+            if self.owns(game_id):
+                return game_id
+
+    def socketio_options(self) -> Dict:
+        """SocketIO keyword arguments that carry room emits between shards"""
+        return {'client_manager': BrokerManager(self.broker_path)}
+
+    def publish_lobby(self, summary: Dict):
+        """Share this shard's lobby numbers with the others"""
+        self.broker.publish(LOBBY_CHANNEL, json.dumps({'shard': self.index, 'summary': summary}).encode('utf-8'))
+
+    def lobby(self, summary: Dict) -> Dict:
+        """Lobby numbers of the whole deployment: summary of this shard plus the others' latest"""
+        totals = dict(summary)
+        now = time.time()
+        with self._lobby_lock:
+            others = [other for received, other in self._lobby.values() if now - received < LOBBY_TTL]
+        for other in others:
+            for key, value in other.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _listen_lobby(self):
+        for _, payload in self.broker.listen(LOBBY_CHANNEL):
+            message = json.loads(payload)
+            if message['shard'] != self.index:
+                with self._lobby_lock:
+                    self._lobby[message['shard']] = (time.time(), message['summary'])
+
+
+def current_shard() -> Optional[Shard]:
+    """Shard of this process when started by the launcher, None for a standalone server"""
+    if SHARD_ENV not in os.environ:
+        return None
+    return Shard(int(os.environ[SHARD_ENV]), int(os.environ[SHARDS_ENV]),
+                 int(os.environ[PORT_ENV]), os.environ[BROKER_ENV])
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    """Forwards each request to the shard that owns its game"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.forward()
+
+    do_POST = do_PUT = do_DELETE = do_OPTIONS = do_HEAD = do_GET
+
+    def route_key(self, body: bytes) -> str:
+        """game_id of the request, or the client address for requests outside any game"""
+        query = parse_qs(urlsplit(self.path).query)
+        if query.get('game_id'):
+            return query['game_id'][0]
+        if body and 'json' in self.headers.get('Content-Type', ''):
+            try:
+                game_id = json.loads(body).get('game_id')
+            except (ValueError, AttributeError):
+                game_id = None
+            if game_id:
+                return str(game_id)
+        return self.client_address[0]
+
+    def forward(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        backend = self.server.backend(self.route_key(body))
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self.tunnel(backend, body)
+            return
+
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_HEADERS}
+        headers['X-Forwarded-For'] = self.client_address[0]
+        upstream = http.client.HTTPConnection(*backend)
+        try:
+            upstream.request(self.command, self.path, body, headers)
+            response = upstream.getresponse()
+            self.send_response_only(response.status, response.reason)
+            for key, value in response.getheaders():
+                if key.lower() not in HOP_HEADERS:
+                    self.send_header(key, value)
+            if response.getheader('Content-Length') is None:
+                # Streamed reply (SSE, chunked): pass it through until the shard closes it
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                while True:
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+            else:
+                self.end_headers()
+                self.wfile.write(response.read())
+        finally:
+            upstream.close()
+
+    def tunnel(self, backend: Tuple[str, int], body: bytes):
+        """Hand a WebSocket upgrade to the shard and relay raw bytes both ways"""
+        upstream = socket.create_connection(backend)
+        head = self.requestline + '\r\n' + ''.join(f'{key}: {value}\r\n' for key, value in self.headers.items())
+        upstream.sendall(head.encode('latin-1') + b'\r\n' + body)
+        self.close_connection = True
+
+        def relay(source, target):
+            try:
+                while True:
+                    data = source.recv(65536)
+                    if not data:
+                        break
+                    target.sendall(data)
+            except OSError:
+                pass
+            finally:
+                for sock in (source, target):
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        downstream = threading.Thread(target=relay, args=(upstream, self.connection), daemon=True)
+        downstream.start()
+        relay(self.connection, upstream)
+        downstream.join()
+        upstream.close()
+
+    def log_message(self, format, *args):
+        pass  # the shards log their own requests
+
+
+class ShardRouter(ThreadingHTTPServer):
+    """Front HTTP server of a sharded deployment"""
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], backends: List[Tuple[str, int]]):
+        super().__init__(address, RouterHandler)
+        self.backends = backends
+        self.ring = HashRing(len(backends))
+
+    def backend(self, key: str) -> Tuple[str, int]:
+        return self.backends[self.ring.shard_for(key)]
+
+
+def launch(module: str, shards: int, port: int):
+    """Start the broker, one worker of module per shard, and the router on port"""
+    broker_path = os.path.join(tempfile.mkdtemp(prefix='iranwar-'), 'broker.sock')
+    Broker(broker_path).start()
+
+    backends = [('127.0.0.1', port + 1 + index) for index in range(shards)]
+    workers = []
+    for index, (_, shard_port) in enumerate(backends):
+        env = dict(os.environ, **{SHARD_ENV: str(index), SHARDS_ENV: str(shards),
+                                  PORT_ENV: str(shard_port), BROKER_ENV: broker_path})
+        workers.append(subprocess.Popen([sys.executable, '-m', module], env=env))
+
+    router = ShardRouter(('0.0.0.0', port), backends)
+    print(f"Routing port {port} to {shards} shards of {module} on ports {port + 1}-{port + shards}")
+    try:
+        router.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('server', 'offline_server'):
+        sys.exit(__doc__)
+    launch(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 2,
+           int(sys.argv[3]) if len(sys.argv) > 3 else 5000)
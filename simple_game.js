@@ -8,7 +8,7 @@ class IranWarGame {
         this.selectedRegion = null;
         this.targetRegion = null;
         this.regionElements = {};
-        this.pollInterval = null;
+        this.pollSession = null;
         
         this.initializeElements();
         this.setupEventListeners();
@@ -230,47 +230,58 @@ class IranWarGame {
     }
     
     startPolling() {
-        this.stopPolling();
-        this.pollInterval = setInterval(() => {
-            this.pollGameState();
-        }, 2000); // Poll every 2 seconds
+        // A fresh session object ends any long-poll loop still running
+        const session = {};
+        this.pollSession = session;
+        this.waitForState(session, -1);
     }
     
     stopPolling() {
-        if (this.pollInterval) {
-            clearInterval(this.pollInterval);
-            this.pollInterval = null;
-        }
+        this.pollSession = null;
     }
     
-    async pollGameState() {
-        if (!this.gameId) return;
-        
-        const result = await this.apiCall('get_game_state', { game_id: this.gameId });
-        
-        if (result.success) {
-            const oldState = this.gameData.game_state;
-            this.gameData = result.game_state;
-            
-            // Check if game state changed
-            if (oldState !== this.gameData.game_state) {
-                if (this.gameData.game_state === 'playing' && this.gameState === 'waiting') {
-                    this.gameState = 'playing';
-                    this.showScreen('game-screen');
-                    this.initializeGameMap();
-                    this.updateGameInterface();
-                    this.showNotification('بازی شروع شد!', 'success');
+    async waitForState(session, since) {
+        // Long-poll: the server replies only when the game version passes `since`
+        while (this.pollSession === session && this.gameId) {
+            try {
+                const response = await fetch(
+                    `/api/wait_state?game_id=${encodeURIComponent(this.gameId)}&since=${since}`
+                );
+                const result = await response.json();
+                if (this.pollSession !== session || !result.success) return;
+                if (result.changed) {
+                    since = result.version;
+                    this.applyGameState(result.game_state);
                 }
+            } catch (error) {
+                console.error('Long-poll failed:', error);
+                await new Promise(resolve => setTimeout(resolve, 2000));
             }
-            
-            // Update UI based on current screen
-            if (this.gameState === 'waiting') {
-                this.updateWaitingRoom();
-            } else if (this.gameState === 'playing') {
+        }
+    }
+    
+    applyGameState(gameState) {
+        const oldState = this.gameData.game_state;
+        this.gameData = gameState;
+        
+        // Check if game state changed
+        if (oldState !== this.gameData.game_state) {
+            if (this.gameData.game_state === 'playing' && this.gameState === 'waiting') {
+                this.gameState = 'playing';
+                this.showScreen('game-screen');
+                this.initializeGameMap();
                 this.updateGameInterface();
-                this.updateMap();
+                this.showNotification('بازی شروع شد!', 'success');
             }
         }
+        
+        // Update UI based on current screen
+        if (this.gameState === 'waiting') {
+            this.updateWaitingRoom();
+        } else if (this.gameState === 'playing') {
+            this.updateGameInterface();
+            this.updateMap();
+        }
     }
     
     showScreen(screenName) {
@@ -1,22 +1,33 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import json
 import threading
 import time
 import random
 from datetime import datetime, timedelta
-from game_logic import GameLogic
+from functools import partial
+from game_logic import GameLogic, parse_attacks
 from iran_map import IranMap
+from journal import Journal, data_dir
+from scheduler import Scheduler
+from state_sync import (SSE_KEEPALIVE, StateSync, etag_matches, parse_version, state_cache, state_etag,
+                        wait_timeout)
+from werkzeug.serving import is_running_from_reloader
+from wire_codec import COMPACT_MIMETYPE
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'iran_war_game_secret'
 
-# Global game state
+# Global game state; games_lock guards adding and removing games, each game has its own lock
 games = {}
+games_lock = threading.Lock()
 game_logic = GameLogic()
 iran_map = IranMap()
+# A game nobody acts in for GAME_TTL is removed, journal files included
+GAME_TTL = timedelta(hours=2)
+scheduler = Scheduler()
 
 class Game:
-    def __init__(self, game_id, host_player):
+    def __init__(self, game_id, host_player, seed=None, game_map=None):
         self.game_id = game_id
         self.players = {}
         self.regions = {}
@@ -25,22 +36,57 @@ class Game:
         self.max_players = 8
         self.min_players = 2
         self.last_reduction_time = datetime.now()
+        self.last_activity = datetime.now()
         self.turn_order = []
         self.current_turn = 0
+        # Every random draw of this game goes through its own generator, so a
+        # game is reproducible from (seed, action_log)
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.action_log = []
+        # Write-ahead log of this game's actions, set once it is journaled
+        self.journal = None
+        # State version that wait_state and the SSE stream block on
+        self.sync = StateSync(game_id)
+        # Held by every request that reads or changes this game
+        self.lock = threading.RLock()
+        # Shared Iran map unless a generated map is given
+        self.game_map = game_map if game_map is not None else iran_map
         self.initialize_regions()
     
+    @classmethod
+    def replay(cls, game_id, host_player, seed, action_log, game_map=None):
+        """Rebuild a game exactly from its seed and action log"""
+        game = cls(game_id, host_player, seed=seed, game_map=game_map)
+        for action, *args in action_log:
+            getattr(game, action)(*args)
+        return game
+    
+    def init_args(self):
+        """Arguments of replay() that rebuild this game before its first action"""
+        return self.game_id, self.host, self.seed
+    
+    def log_action(self, action, *args):
+        """Record a state-changing call for replay"""
+        if self.journal is not None:
+            self.journal.record(self, action, args)
+        self.action_log.append((action,) + args)
+        self.last_activity = datetime.now()
+    
+    def expiry_deadline(self):
+        """Time at which the game is removed unless it sees an action first"""
+        return (self.last_activity + GAME_TTL).timestamp()
+    
     def initialize_regions(self):
         """Initialize Iran map regions"""
-        self.regions = iran_map.get_regions()
-        for region_id, region in self.regions.items():
-            region['owner'] = None
-            region['soldiers'] = 0
-            region['buildings'] = {'barracks': 0, 'factory': 0, 'bank': 0}
+        self.regions = self.game_map.new_game_regions()
     
     def add_player(self, player_id, player_name):
         if len(self.players) >= self.max_players:
             return False
         
+        self.log_action('add_player', player_id, player_name)
+        
         self.players[player_id] = {
             'name': player_name,
             'coins': 1000,
@@ -69,13 +115,20 @@ class Game:
         unassigned_regions = [rid for rid, region in self.regions.items() if region['owner'] is None]
         
         # Assign regions to this player
-        player_regions = random.sample(unassigned_regions, min(regions_per_player, len(unassigned_regions)))
+        player_regions = self.rng.sample(unassigned_regions, min(regions_per_player, len(unassigned_regions)))
         
         for region_id in player_regions:
             self.regions[region_id]['owner'] = player_id
             self.regions[region_id]['soldiers'] = 10
             self.players[player_id]['regions'].append(region_id)
     
+    def start_game(self):
+        """Start the game with a shuffled turn order"""
+        self.log_action('start_game')
+        self.game_state = "playing"
+        self.turn_order = list(self.players.keys())
+        self.rng.shuffle(self.turn_order)
+    
     def can_attack(self, attacker_id, from_region, to_region):
         """Check if attack is valid"""
         if from_region not in self.regions or to_region not in self.regions:
@@ -88,7 +141,7 @@ class Game:
             return False
         
         # Check if regions are neighbors
-        return iran_map.are_neighbors(from_region, to_region)
+        return self.game_map.are_neighbors(from_region, to_region)
     
     def execute_attack(self, attacker_id, from_region, to_region, soldiers):
         """Execute attack between regions"""
@@ -98,13 +151,15 @@ class Game:
         if self.regions[from_region]['soldiers'] <= soldiers:
             return False
         
+        self.log_action('execute_attack', attacker_id, from_region, to_region, soldiers)
+        
         # Calculate battle result
         attacking_soldiers = soldiers
         defending_soldiers = self.regions[to_region]['soldiers']
         
         # Use game logic for battle calculation
         attacker_wins, remaining_attackers, remaining_defenders = game_logic.calculate_battle_result(
-            attacking_soldiers, defending_soldiers
+            attacking_soldiers, defending_soldiers, rng=self.rng
         )
         
         if attacker_wins:
@@ -129,6 +184,15 @@ class Game:
             self.regions[to_region]['soldiers'] = remaining_defenders
             return False
     
+    def execute_attacks(self, attacker_id, attacks):
+        """Execute a batch of (from_region, to_region, soldiers) attacks in one pass"""
+        # A batch that changes nothing is not logged
+        if game_logic.any_battle_allowed(self.regions, attacks, self.game_map.region_neighbors, attacker_id):
+            self.log_action('execute_attacks', attacker_id, attacks)
+        return game_logic.resolve_battles(
+            self.regions, attacks, self.game_map.region_neighbors, self.players, attacker_id, self.rng
+        )
+    
     def build_structure(self, player_id, region_id, structure_type):
         """Build structure in region"""
         if region_id not in self.regions:
@@ -137,27 +201,57 @@ class Game:
         if self.regions[region_id]['owner'] != player_id:
             return False
         
+        if structure_type not in self.regions[region_id]['buildings']:
+            return False
+        
         cost = game_logic.get_building_cost(structure_type)
         
         if self.players[player_id]['coins'] < cost:
             return False
         
+        self.log_action('build_structure', player_id, region_id, structure_type)
+        
         self.players[player_id]['coins'] -= cost
         self.regions[region_id]['buildings'][structure_type] += 1
         return True
     
+    def commit_changes(self):
+        """Bump the state version if anything changed, waking long-poll and SSE clients"""
+        return self.sync.commit(self.regions, self.players, {
+            'game_state': self.game_state,
+            'current_turn': self.current_turn,
+            'turn_order': self.turn_order
+        })
+    
+    def current_version(self):
+        """Commit pending changes and return the resulting state version"""
+        with self.lock:
+            self.commit_changes()
+            return self.sync.version
+    
+    def cached_view(self, view):
+        """(version, cached encoding) of the current state, e.g. view=state_cache.reply"""
+        with self.lock:
+            version = self.current_version()
+            return version, view(self.game_id, version, self.get_game_state)
+    
     def get_game_state(self):
         """Get current game state"""
+        self.commit_changes()
         return {
             'game_id': self.game_id,
+            'version': self.sync.version,
             'players': self.players,
-            'regions': self.regions,
+            'regions': self.regions.to_dict(),
             'game_state': self.game_state,
             'current_turn': self.current_turn,
             'turn_order': self.turn_order,
             'host': self.host
         }
 
+# Action log and snapshots of every game, enabled when the server starts
+journal = Journal(Game)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -167,19 +261,23 @@ def create_game():
     data = request.json
     player_name = data.get('player_name', 'Player')
     player_id = f"player_{int(time.time() * 1000)}"
-    game_id = f"game_{len(games) + 1}_{int(time.time())}"
     
     # Create new game
-    game = Game(game_id, player_id)
-    game.add_player(player_id, player_name)
-    games[game_id] = game
-    
-    return jsonify({
-        'success': True,
-        'game_id': game_id,
-        'player_id': player_id,
-        'game_state': game.get_game_state()
-    })
+    with games_lock:
+        game_id = f"game_{len(games) + 1}_{int(time.time())}"
+        game = Game(game_id, player_id)
+        journal.track(game, game.init_args())
+        game.add_player(player_id, player_name)
+        games[game_id] = game
+    scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
+    
+    with game.lock:
+        return jsonify({
+            'success': True,
+            'game_id': game_id,
+            'player_id': player_id,
+            'game_state': game.get_game_state()
+        })
 
 @app.route('/api/join_game', methods=['POST'])
 def join_game():
@@ -188,19 +286,19 @@ def join_game():
     player_name = data.get('player_name', 'Player')
     player_id = f"player_{int(time.time() * 1000)}"
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
     
-    game = games[game_id]
-    
-    if not game.add_player(player_id, player_name):
-        return jsonify({'success': False, 'error': 'بازی پر است'})
-    
-    return jsonify({
-        'success': True,
-        'player_id': player_id,
-        'game_state': game.get_game_state()
-    })
+    with game.lock:
+        if not game.add_player(player_id, player_name):
+            return jsonify({'success': False, 'error': 'بازی پر است'})
+        
+        return jsonify({
+            'success': True,
+            'player_id': player_id,
+            'game_state': game.get_game_state()
+        })
 
 @app.route('/api/start_game', methods=['POST'])
 def start_game():
@@ -208,25 +306,23 @@ def start_game():
     game_id = data.get('game_id')
     player_id = data.get('player_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
     
-    game = games[game_id]
-    
-    if player_id != game.host:
-        return jsonify({'success': False, 'error': 'فقط میزبان می‌تواند بازی را شروع کند'})
-    
-    if len(game.players) < game.min_players:
-        return jsonify({'success': False, 'error': 'حداقل 2 بازیکن نیاز است'})
-    
-    game.game_state = "playing"
-    game.turn_order = list(game.players.keys())
-    random.shuffle(game.turn_order)
-    
-    return jsonify({
-        'success': True,
-        'game_state': game.get_game_state()
-    })
+    with game.lock:
+        if player_id != game.host:
+            return jsonify({'success': False, 'error': 'فقط میزبان می‌تواند بازی را شروع کند'})
+        
+        if len(game.players) < game.min_players:
+            return jsonify({'success': False, 'error': 'حداقل 2 بازیکن نیاز است'})
+        
+        game.start_game()
+        
+        return jsonify({
+            'success': True,
+            'game_state': game.get_game_state()
+        })
 
 @app.route('/api/attack', methods=['POST'])
 def attack():
@@ -237,21 +333,46 @@ def attack():
     to_region = data.get('to_region')
     soldiers = data.get('soldiers', 1)
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
     
-    game = games[game_id]
-    
-    if game.game_state != "playing":
-        return jsonify({'success': False, 'error': 'بازی شروع نشده است'})
+    with game.lock:
+        if game.game_state != "playing":
+            return jsonify({'success': False, 'error': 'بازی شروع نشده است'})
+        
+        success = game.execute_attack(player_id, from_region, to_region, soldiers)
+        
+        return jsonify({
+            'success': success,
+            'game_state': game.get_game_state(),
+            'message': 'حمله موفق بود!' if success else 'حمله ناموفق بود!'
+        })
+
+@app.route('/api/attack_batch', methods=['POST'])
+def attack_batch():
+    data = request.json
+    game_id = data.get('game_id')
+    player_id = data.get('player_id')
+    attacks = parse_attacks(data.get('attacks', []), 1)
     
-    success = game.execute_attack(player_id, from_region, to_region, soldiers)
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
+    if attacks is None:
+        return jsonify({'success': False, 'error': 'حملات نامعتبر است'})
     
-    return jsonify({
-        'success': success,
-        'game_state': game.get_game_state(),
-        'message': 'حمله موفق بود!' if success else 'حمله ناموفق بود!'
-    })
+    with game.lock:
+        if game.game_state != "playing":
+            return jsonify({'success': False, 'error': 'بازی شروع نشده است'})
+        
+        results = game.execute_attacks(player_id, attacks)
+        
+        return jsonify({
+            'success': any(result['attacker_wins'] for result in results),
+            'results': results,
+            'game_state': game.get_game_state()
+        })
 
 @app.route('/api/build', methods=['POST'])
 def build():
@@ -261,35 +382,112 @@ def build():
     region_id = data.get('region_id')
     structure_type = data.get('structure_type')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
         return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
     
-    game = games[game_id]
-    
-    if game.game_state != "playing":
-        return jsonify({'success': False, 'error': 'بازی شروع نشده است'})
-    
-    success = game.build_structure(player_id, region_id, structure_type)
-    
-    return jsonify({
-        'success': success,
-        'game_state': game.get_game_state(),
-        'message': 'ساخت موفق بود!' if success else 'ساخت ناموفق بود!'
-    })
+    with game.lock:
+        if game.game_state != "playing":
+            return jsonify({'success': False, 'error': 'بازی شروع نشده است'})
+        
+        success = game.build_structure(player_id, region_id, structure_type)
+        
+        return jsonify({
+            'success': success,
+            'game_state': game.get_game_state(),
+            'message': 'ساخت موفق بود!' if success else 'ساخت ناموفق بود!'
+        })
 
 @app.route('/api/get_game_state', methods=['POST'])
 def get_game_state():
     data = request.json
     game_id = data.get('game_id')
     
-    if game_id not in games:
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
+    
+    version = game.current_version()
+    etag = state_etag(game_id, version)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers={'ETag': etag})
+    if parse_version(data.get('since_version')) == version:
+        return jsonify({'success': True, 'unchanged': True, 'version': version})
+    
+    # ETag of the version the body was encoded at, a write may have landed since the check above
+    version, body = game.cached_view(state_cache.reply)
+    return Response(body, mimetype='application/json', headers={'ETag': state_etag(game_id, version)})
+
+@app.route('/api/wait_state')
+def wait_state():
+    """Long-poll: reply once the game version passes ?since=, or on timeout"""
+    game_id = request.args.get('game_id')
+    since = parse_version(request.args.get('since'))
+    
+    game = games.get(game_id)
+    if game is None:
         return jsonify({'success': False, 'error': 'بازی پیدا نشد'})
     
-    game = games[game_id]
-    return jsonify({
-        'success': True,
-        'game_state': game.get_game_state()
-    })
+    version = game.sync.clock.wait(since, wait_timeout(request.args.get('timeout')))
+    if version <= since:
+        return jsonify({'success': True, 'changed': False, 'version': version})
+    
+    if COMPACT_MIMETYPE in request.headers.get('Accept', ''):
+        # Clients that speak the compact format get packed region tables
+        view = partial(state_cache.compact_changed_reply, topology=game.regions.topology)
+        return Response(game.cached_view(view)[1], mimetype=COMPACT_MIMETYPE)
+    
+    return Response(game.cached_view(state_cache.changed_reply)[1], mimetype='application/json')
+
+@app.route('/api/events')
+def events():
+    """Server-Sent Events stream with one 'state' event per game version"""
+    game_id = request.args.get('game_id')
+    since = parse_version(request.headers.get('Last-Event-ID', request.args.get('since')))
+    
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({'success': False, 'error': 'بازی پیدا نشد'}), 404
+    
+    def stream():
+        version = since
+        while games.get(game_id) is game:
+            if game.sync.clock.wait(version, SSE_KEEPALIVE) > version:
+                version, event = game.cached_view(state_cache.event)
+                yield event
+            else:
+                yield b': keep-alive\n\n'
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def expire_game(game_id):
+    """Remove a game left without actions for GAME_TTL, or check again at its new deadline"""
+    game = games.get(game_id)
+    if game is None:
+        return
+    
+    deadline = game.expiry_deadline()
+    if time.time() < deadline:
+        scheduler.call_at(deadline, expire_game, game_id)
+        return
+    
+    with games_lock:
+        games.pop(game_id, None)
+    journal.forget(game_id)
+    state_cache.invalidate(game_id)
+    print(f'Removed idle game: {game_id}')
+
+def restore_games():
+    """Reload the games journaled before a restart and arm their expiry"""
+    for game_id, game in journal.recover(data_dir('simple_server')).items():
+        # Players get a full GAME_TTL to come back
+        game.last_activity = datetime.now()
+        games[game_id] = game
+        scheduler.call_at(game.expiry_deadline(), expire_game, game_id)
 
 if __name__ == '__main__':
+    # With debug the reloader's child process serves, the watching parent keeps no games
+    if is_running_from_reloader():
+        restore_games()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
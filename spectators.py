@@ -0,0 +1,166 @@
+"""
+Spectator fan-out for Iran War Game Socket.IO servers
+Spectators are not in a game's rooms: they get state frames on a read-only
+feed. Each frame is encoded once into an engine.io packet and that same
+packet goes to every spectator, at most max_fps frames per second per game
+(changes in between are coalesced). A spectator acknowledges a frame before
+it is sent the next, so a slow one skips intermediate frames and catches up
+with the latest instead of queueing frames without bound.
+
+frame := {version, base, diffs}  diffs since the frame at version base
+       | {version, game_state}   full state, for spectators that skipped frames
+Frames are JSON whatever codec the spectator's socket negotiated.
+"""
+
+import threading
+import time
+from typing import Dict
+
+from engineio import packet as eio_packet
+from socketio import packet as sio_packet
+
+FRAME_EVENT = 'spectator_frame'
+# Frames per second of a game's feed; 0 sends every change
+DEFAULT_FPS = 5
+
+
+class _Spectator:
+    __slots__ = ('eio_sid', 'version', 'waiting')
+
+    def __init__(self, eio_sid: str, version: int):
+        self.eio_sid = eio_sid
+        self.version = version  # version of the last frame sent
+        self.waiting = True     # that frame is not acknowledged yet
+
+
+class _Feed:
+    """Latest frame of one game and who watches it"""
+
+    def __init__(self):
+        self.spectators: Dict[str, _Spectator] = {}
+        self.version = -1
+        self.base = -1
+        self.delta = None  # engine.io packet with the diffs from base, None if history ran out
+        self.full = None   # engine.io packet with the full state
+        self.next_frame = 0.0
+        self.timer = None
+
+
+class SpectatorHub:
+    """Read-only state feeds of games, fanned out as shared pre-encoded packets"""
+
+    def __init__(self, socketio, scheduler, max_fps: float = DEFAULT_FPS, namespace: str = '/'):
+        self.socketio = socketio
+        self.scheduler = scheduler
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.namespace = namespace
+        self._feeds: Dict[str, _Feed] = {}
+        # Spectator sid -> game_id
+        self._watching: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _packet(self, payload: Dict):
+        """One engine.io packet of a frame, sent as is to every spectator"""
+        server = self.socketio.server
+        event = server.packet_class(sio_packet.EVENT, namespace=self.namespace, data=[FRAME_EVENT, payload])
+        return eio_packet.Packet(eio_packet.MESSAGE, data=event.encode())
+
+    def _send(self, spectator: _Spectator, frame):
+        self.socketio.server.eio.send_packet(spectator.eio_sid, frame)
+
+    def add(self, game, sid: str):
+        """Start a feed for sid with the current full state (caller must not hold game.lock)"""
+        self.remove(sid)
+        eio_sid = self.socketio.server.manager.eio_sid_from_sid(sid, self.namespace)
+        if eio_sid is None:
+            return
+        with game.lock:
+            state = game.shared_state()
+            version = game.sync.version
+        with self._lock:
+            feed = self._feeds.setdefault(game.game_id, _Feed())
+            frame = feed.full if feed.version == version else None
+        if frame is None:
+            frame = self._packet({'version': version, 'game_state': state})
+        with self._lock:
+            if feed.version < version:
+                # The next frame can then be a delta from this one
+                feed.version, feed.base, feed.delta, feed.full = version, -1, None, frame
+            feed.spectators[sid] = spectator = _Spectator(eio_sid, version)
+            self._watching[sid] = game.game_id
+        self._send(spectator, frame)
+
+    def remove(self, sid: str):
+        """Stop the feed of sid, if it watches a game"""
+        with self._lock:
+            game_id = self._watching.pop(sid, None)
+            feed = self._feeds.get(game_id)
+            if feed is None:
+                return
+            feed.spectators.pop(sid, None)
+            if not feed.spectators:
+                if feed.timer is not None:
+                    feed.timer.cancel()
+                del self._feeds[game_id]
+
+    def count(self, game_id: str) -> int:
+        with self._lock:
+            feed = self._feeds.get(game_id)
+            return len(feed.spectators) if feed is not None else 0
+
+    def ack(self, sid: str, version):
+        """sid has handled the frame at version; send it the latest frame if it fell behind"""
+        with self._lock:
+            feed = self._feeds.get(self._watching.get(sid))
+            spectator = feed.spectators.get(sid) if feed is not None else None
+            if spectator is None or version != spectator.version:
+                return  # not watching, or an ack of a frame since superseded
+            spectator.waiting = False
+            frame = self._next_frame(feed, spectator)
+        if frame is not None:
+            self._send(spectator, frame)
+
+    @staticmethod
+    def _next_frame(feed: _Feed, spectator: _Spectator):
+        """Latest frame for a spectator that is not waiting, marking it sent (caller holds _lock)"""
+        if spectator.waiting or spectator.version >= feed.version:
+            return None
+        frame = feed.delta if feed.delta is not None and spectator.version == feed.base else feed.full
+        spectator.version = feed.version
+        spectator.waiting = True
+        return frame
+
+    def publish(self, game):
+        """The state of game changed: arm its next frame, coalescing changes until then"""
+        with self._lock:
+            feed = self._feeds.get(game.game_id)
+            if feed is None or feed.timer is not None:
+                return
+            feed.timer = self.scheduler.call_at(max(time.time(), feed.next_frame), self._flush, game)
+
+    def _flush(self, game):
+        with self._lock:
+            feed = self._feeds.get(game.game_id)
+            if feed is None:
+                return
+            feed.timer = None
+            base = feed.version
+
+        with game.lock:
+            state = game.shared_state()
+            version = game.sync.version
+            if version == base:
+                return
+            diffs = game.sync.diffs_since(base) if base >= 0 else None
+        delta = self._packet({'version': version, 'base': base, 'diffs': diffs}) if diffs else None
+        full = self._packet({'version': version, 'game_state': state})
+
+        with self._lock:
+            if self._feeds.get(game.game_id) is not feed:
+                return  # the last spectator left meanwhile
+            feed.version, feed.base, feed.delta, feed.full = version, base, delta, full
+            feed.next_frame = time.time() + self.interval
+            sends = [(spectator, self._next_frame(feed, spectator)) for spectator in feed.spectators.values()]
+        for spectator, frame in sends:
+            if frame is not None:
+                self._send(spectator, frame)
@@ -25,50 +25,23 @@ from kivy.uix.widget import Widget
 from kivy.graphics import Color, Ellipse, Line, Rectangle
 from kivy.clock import Clock
 from kivy.core.window import Window
+from map_format import load_map
 
 # Import game logic directly
 class IranMap:
     def __init__(self):
+        # Same hotspot map as main.py, memory-mapped from maps.iwm
+        self.map_data = load_map('hotspot')
         self.regions = self.create_regions()
         self.neighbors = self.create_neighbor_map()
     
     def create_regions(self):
-        return {
-            'tehran': {'name': 'تهران', 'x': 400, 'y': 300, 'population': 15000000, 'type': 'capital', 'owner': None, 'soldiers': 0},
-            'isfahan': {'name': 'اصفهان', 'x': 380, 'y': 250, 'population': 5000000, 'type': 'cultural', 'owner': None, 'soldiers': 0},
-            'mashhad': {'name': 'مشهد', 'x': 500, 'y': 320, 'population': 3500000, 'type': 'religious', 'owner': None, 'soldiers': 0},
-            'shiraz': {'name': 'شیراز', 'x': 380, 'y': 200, 'population': 2000000, 'type': 'cultural', 'owner': None, 'soldiers': 0},
-            'tabriz': {'name': 'تبریز', 'x': 320, 'y': 380, 'population': 1800000, 'type': 'industrial', 'owner': None, 'soldiers': 0},
-            'ahvaz': {'name': 'اهواز', 'x': 300, 'y': 220, 'population': 1500000, 'type': 'industrial', 'owner': None, 'soldiers': 0},
-            'qom': {'name': 'قم', 'x': 390, 'y': 280, 'population': 1200000, 'type': 'religious', 'owner': None, 'soldiers': 0},
-            'karaj': {'name': 'کرج', 'x': 390, 'y': 310, 'population': 1100000, 'type': 'industrial', 'owner': None, 'soldiers': 0},
-            'urmia': {'name': 'ارومیه', 'x': 300, 'y': 380, 'population': 900000, 'type': 'cultural', 'owner': None, 'soldiers': 0},
-            'arak': {'name': 'اراک', 'x': 370, 'y': 270, 'population': 800000, 'type': 'industrial', 'owner': None, 'soldiers': 0},
-            'yazd': {'name': 'یزد', 'x': 420, 'y': 240, 'population': 700000, 'type': 'cultural', 'owner': None, 'soldiers': 0},
-            'ardabil': {'name': 'اردبیل', 'x': 340, 'y': 400, 'population': 650000, 'type': 'industrial', 'owner': None, 'soldiers': 0},
-            'bandar_abbas': {'name': 'بندرعباس', 'x': 420, 'y': 160, 'population': 600000, 'type': 'port', 'owner': None, 'soldiers': 0},
-            'abadan': {'name': 'آبادان', 'x': 280, 'y': 200, 'population': 400000, 'type': 'port', 'owner': None, 'soldiers': 0},
-            'kish': {'name': 'کیش', 'x': 430, 'y': 150, 'population': 50000, 'type': 'port', 'owner': None, 'soldiers': 0}
-        }
+        return {region_id: {**region, 'owner': None, 'soldiers': 0}
+                for region_id, region in self.map_data.items()}
     
     def create_neighbor_map(self):
-        return {
-            'tehran': ['karaj', 'qom', 'arak'],
-            'isfahan': ['yazd', 'shiraz', 'arak'],
-            'mashhad': [],
-            'shiraz': ['isfahan', 'yazd'],
-            'tabriz': ['urmia', 'ardabil'],
-            'ahvaz': ['abadan'],
-            'qom': ['tehran', 'arak'],
-            'karaj': ['tehran'],
-            'urmia': ['tabriz'],
-            'arak': ['tehran', 'qom', 'isfahan'],
-            'yazd': ['isfahan', 'shiraz'],
-            'ardabil': ['tabriz'],
-            'bandar_abbas': ['kish'],
-            'abadan': ['ahvaz'],
-            'kish': ['bandar_abbas']
-        }
+        # main.py's adjacency: this app's old copy left mashhad with no neighbors, it now borders ardabil
+        return self.map_data.neighbor_map()
 
 class GameLogic:
     def calculate_battle_result(self, attacking_soldiers, defending_soldiers):
@@ -113,7 +86,7 @@ class LocalGameServer:
             'id': game_id,
             'players': {host_player['id']: host_player},
             'status': 'waiting',
-            'regions': self.iran_map.regions.copy(),
+            'regions': self.iran_map.create_regions(),
             'current_turn': 0,
             'turn_order': [],
             'created_time': datetime.now()
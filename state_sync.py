@@ -0,0 +1,300 @@
+"""
+Versioned state diffs for Iran War Game broadcasts
+Every committed change bumps a game's version and yields a diff holding only
+the region and player fields that changed. Recent diffs are kept so a client
+that missed a few can catch up; larger gaps get a full snapshot instead.
+Long-poll and SSE requests block on the version until it advances.
+Serialized states are cached per (game_id, version, view), so every HTTP
+reply, SSE stream and socket event of one version shares the same buffer.
+"""
+
+import copy
+import json
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from wire_codec import EncodedState, encode_message, encode_state
+
+# Diffs kept per game for catch-up; older gaps resync with a full snapshot
+DIFF_HISTORY = 64
+# Player fields clients rebuild from region owner changes instead of receiving them
+DERIVED_PLAYER_FIELDS = ('regions',)
+# Longest a wait_state request is held open, and the SSE keep-alive interval (seconds)
+LONG_POLL_TIMEOUT = 25
+SSE_KEEPALIVE = 15
+
+# Cached encodings of one game version: bare state JSON, get_game_state reply,
+# wait_state reply (JSON and compact), SSE message, and state text for Socket.IO events
+VIEW_STATE = 'state'
+VIEW_REPLY = 'reply'
+VIEW_CHANGED = 'changed'
+VIEW_COMPACT_CHANGED = 'compact_changed'
+VIEW_EVENT = 'event'
+VIEW_SOCKET = 'socket'
+VIEW_COMPACT_STATE = 'compact_state'
+
+
+class VersionClock:
+    """Game version counter that waiting requests can block on"""
+
+    def __init__(self):
+        self.version = 0
+        self._advanced = threading.Condition()
+
+    def advance(self) -> int:
+        """Bump the version and wake every waiter"""
+        with self._advanced:
+            self.version += 1
+            self._advanced.notify_all()
+            return self.version
+
+    def resume(self, version: int):
+        """Continue counting from version, for a game rebuilt after a restart"""
+        with self._advanced:
+            self.version = version
+            self._advanced.notify_all()
+
+    def wait(self, since: int, timeout: float = LONG_POLL_TIMEOUT) -> int:
+        """Block until the version is past since or timeout expires, returns the version"""
+        with self._advanced:
+            self._advanced.wait_for(lambda: self.version > since, timeout)
+            return self.version
+
+
+class RawJSON(str):
+    """Already encoded JSON text, embedded verbatim by SocketJSON"""
+
+
+class StateCache:
+    """Encoded game states keyed by (game_id, version, view), shared by every reader"""
+
+    def __init__(self):
+        self._games: Dict[str, Dict[str, Tuple[int, Union[bytes, str]]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, game_id: str, version: int, view: str, encode: Callable[[], Union[bytes, str]]):
+        """Cached encoding of a version, encode() only runs when it is missing"""
+        with self._lock:
+            entry = self._games.get(game_id, {}).get(view)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        # Encode outside the lock; two readers racing on a new version both get valid bytes
+        body = encode()
+        with self._lock:
+            views = self._games.setdefault(game_id, {})
+            if view not in views or views[view][0] < version:
+                views[view] = (version, body)
+        return body
+
+    def invalidate(self, game_id: str):
+        """Drop every cached view of a game after a mutation or when it ends"""
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def state(self, game_id: str, version: int, build: Callable[[], Dict]) -> bytes:
+        """UTF-8 JSON of build(), the game state at version"""
+        return self.get(game_id, version, VIEW_STATE,
+                        lambda: json.dumps(build(), ensure_ascii=False).encode('utf-8'))
+
+    def reply(self, game_id: str, version: int, build: Callable[[], Dict]) -> bytes:
+        """get_game_state reply {success, game_state}"""
+        return self.get(game_id, version, VIEW_REPLY,
+                        lambda: state_reply(self.state(game_id, version, build)))
+
+    def changed_reply(self, game_id: str, version: int, build: Callable[[], Dict]) -> bytes:
+        """wait_state reply {success, changed, version, game_state}"""
+        return self.get(game_id, version, VIEW_CHANGED,
+                        lambda: state_reply(self.state(game_id, version, build), changed=True, version=version))
+
+    def compact_changed_reply(self, game_id: str, version: int, build: Callable[[], Dict], topology) -> bytes:
+        """wait_state reply in the compact wire format, region indices resolved through topology"""
+        return self.get(game_id, version, VIEW_COMPACT_CHANGED,
+                        lambda: encode_message({'success': True, 'changed': True, 'version': version,
+                                                'game_state': build()}, topology))
+
+    def event(self, game_id: str, version: int, build: Callable[[], Dict]) -> bytes:
+        """SSE 'state' message"""
+        return self.get(game_id, version, VIEW_EVENT,
+                        lambda: sse_event(version, self.state(game_id, version, build)))
+
+    def socket_state(self, game_id: str, version: int, build: Callable[[], Dict]) -> RawJSON:
+        """State text for Socket.IO payloads, spliced in by SocketJSON"""
+        return self.get(game_id, version, VIEW_SOCKET,
+                        lambda: RawJSON(self.state(game_id, version, build).decode('utf-8')))
+
+    def compact_state(self, game_id: str, version: int, build: Callable[[], Dict], topology) -> EncodedState:
+        """State walked by the compact encoder, spliced into compact Socket.IO payloads"""
+        return self.get(game_id, version, VIEW_COMPACT_STATE, lambda: encode_state(build(), topology))
+
+
+# One cache for every game of the process
+state_cache = StateCache()
+
+
+class SocketJSON:
+    """
+    json module for Socket.IO packets that embeds RawJSON values verbatim
+    Packets are [event, payload], so RawJSON is looked for in the packet and
+    one level inside it; anything else is encoded by the json module.
+    """
+
+    loads = staticmethod(json.loads)
+
+    @staticmethod
+    def dumps(obj, **kwargs) -> str:
+        if isinstance(obj, RawJSON):
+            return obj
+        if isinstance(obj, (list, tuple)) and _holds_raw(obj):
+            return '[' + ','.join(SocketJSON.dumps(item, **kwargs) for item in obj) + ']'
+        if isinstance(obj, dict) and _holds_raw(obj.values()):
+            return '{' + ','.join(json.dumps(str(key)) + ':' + SocketJSON.dumps(value, **kwargs)
+                                  for key, value in obj.items()) + '}'
+        return json.dumps(obj, **kwargs)
+
+
+def _holds_raw(items) -> bool:
+    return any(isinstance(item, RawJSON) or
+               (isinstance(item, dict) and any(isinstance(value, RawJSON) for value in item.values()))
+               for item in items)
+
+
+class StateSync:
+    """Version counter and diff history of one game"""
+
+    def __init__(self, game_id: Optional[str] = None, history: int = DIFF_HISTORY):
+        self.game_id = game_id
+        self.clock = VersionClock()
+        self.history = deque(maxlen=history)
+        self._sent_players: Dict[str, Dict] = {}
+        self._sent_meta: Dict = {}
+
+    def commit(self, regions, players: Dict, meta: Dict) -> Optional[Dict]:
+        """
+        Collect everything changed since the last commit into a new version
+        regions is a GameRegions table, meta holds top-level game fields.
+        Returns the diff, or None if nothing changed.
+        """
+        diff = {}
+
+        region_changes = regions.take_changes()
+        if region_changes:
+            diff['regions'] = region_changes
+
+        player_changes = {}
+        for player_id, player in players.items():
+            sent = self._sent_players.get(player_id)
+            if sent is None:
+                player_changes[player_id] = copy.deepcopy(player)
+                continue
+            fields = {key: copy.deepcopy(value) for key, value in player.items()
+                      if key not in DERIVED_PLAYER_FIELDS and sent.get(key) != value}
+            if fields:
+                player_changes[player_id] = fields
+        removed = [player_id for player_id in self._sent_players if player_id not in players]
+        if player_changes:
+            diff['players'] = player_changes
+            for player_id, fields in player_changes.items():
+                self._sent_players.setdefault(player_id, {}).update(copy.deepcopy(fields))
+        if removed:
+            diff['removed_players'] = removed
+            for player_id in removed:
+                del self._sent_players[player_id]
+
+        meta_changes = {key: value for key, value in meta.items() if self._sent_meta.get(key) != value}
+        if meta_changes:
+            diff['game'] = copy.deepcopy(meta_changes)
+            self._sent_meta.update(diff['game'])
+
+        if not diff:
+            return None
+        diff['version'] = self.version + 1
+        self.history.append(diff)
+        if self.game_id is not None:
+            state_cache.invalidate(self.game_id)
+        self.clock.advance()
+        return diff
+
+    @property
+    def version(self) -> int:
+        return self.clock.version
+
+    def diffs_since(self, version: int) -> Optional[List[Dict]]:
+        """Diffs a client at version needs, None if it must take a full snapshot"""
+        if version > self.version or version < 0:
+            return None
+        missing = self.version - version
+        if missing > len(self.history):
+            return None
+        return list(self.history)[len(self.history) - missing:]
+
+
+def parse_version(value, default: int = -1) -> int:
+    """Version from a query string or JSON field, default if missing or malformed"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def wait_timeout(value) -> float:
+    """Client-requested long-poll timeout clamped to (0, LONG_POLL_TIMEOUT]"""
+    try:
+        return min(max(float(value), 0.1), LONG_POLL_TIMEOUT)
+    except (TypeError, ValueError):
+        return LONG_POLL_TIMEOUT
+
+
+def state_etag(game_id: str, version: int) -> str:
+    """Strong ETag of one game version"""
+    return f'"{game_id}.{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header names etag (weak tags and * included)"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def state_reply(state_json: bytes, **fields) -> bytes:
+    """JSON reply {success, **fields, game_state} around already serialized state bytes"""
+    head = json.dumps({'success': True, **fields}, ensure_ascii=False)[:-1]
+    return head.encode('utf-8') + b', "game_state": ' + state_json + b'}'
+
+
+def sse_event(version: int, state_json: bytes) -> bytes:
+    """One Server-Sent Events message carrying a full state"""
+    return b'id: %d\nevent: state\ndata: %s\n\n' % (version, state_json)
+
+
+def apply_diff(state: Dict, diff: Optional[Dict]) -> bool:
+    """
+    Merge a diff into a client-side copy of get_game_state
+    Returns False if versions were skipped and the client must resync.
+    """
+    if not diff or diff['version'] <= state.get('version', 0):
+        return True
+    if diff['version'] != state.get('version', 0) + 1:
+        return False
+
+    players = state['players']
+    for player_id, fields in diff.get('players', {}).items():
+        players.setdefault(player_id, {}).update(fields)
+    for player_id in diff.get('removed_players', []):
+        players.pop(player_id, None)
+    for region_id, fields in diff.get('regions', {}).items():
+        region = state['regions'][region_id]
+        if 'owner' in fields and fields['owner'] != region['owner']:
+            # Keep the derived player region lists in step with ownership
+            old_owner = players.get(region['owner'])
+            if old_owner is not None and region_id in old_owner.get('regions', []):
+                old_owner['regions'].remove(region_id)
+            new_owner = players.get(fields['owner'])
+            if new_owner is not None and region_id not in new_owner.setdefault('regions', []):
+                new_owner['regions'].append(region_id)
+        region.update(fields)
+    state.update(diff.get('game', {}))
+    state['version'] = diff['version']
+    return True
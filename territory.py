@@ -0,0 +1,249 @@
+"""
+Incremental territory connectivity for Iran War Game
+Keeps a union-find of each player's regions that is updated on every
+capture and loss, so cluster and largest-territory queries never rescan
+the map. Regions are connected if either lists the other as neighbor.
+
+A capture is a near-constant union. Union-find cannot split, so a loss
+searches outward from the lost region's neighbors in lockstep and stops as
+soon as one search is left running: only the pieces that broke away are
+walked and moved to new clusters, the largest piece keeps its cluster
+untouched. A loss costs O(size of the smaller pieces); losing a region
+in the middle of a big territory that stays whole costs O(degree).
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class PlayerTerritory:
+    """
+    Union-find over the regions one player owns
+    Regions map to tree nodes; a lost region leaves its node behind as a
+    tombstone so the tree paths through it keep working, and the trees are
+    rebuilt once tombstones outnumber live regions.
+    """
+
+    def __init__(self):
+        self.node_of: Dict[int, int] = {}     # region -> node
+        self.parent: Dict[int, int] = {}      # node -> parent node
+        self.members: Dict[int, Set[int]] = {}  # root node -> regions of that cluster
+        self.size_counts: Dict[int, int] = {}   # cluster size -> number of clusters
+        self._next_node = 0
+
+    def __contains__(self, index: int) -> bool:
+        return index in self.node_of
+
+    def _new_node(self) -> int:
+        node = self._next_node
+        self._next_node += 1
+        self.parent[node] = node
+        return node
+
+    def _find_node(self, node: int) -> int:
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:  # path compression
+            parent[node], node = root, parent[node]
+        return root
+
+    def find(self, index: int) -> int:
+        """Root node of the cluster holding region index"""
+        return self._find_node(self.node_of[index])
+
+    def add(self, index: int):
+        node = self._new_node()
+        self.node_of[index] = node
+        self.members[node] = {index}
+        self._count_size(1, 1)
+
+    def union(self, a: int, b: int):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return
+        # Union by size, merging the smaller member set into the larger
+        if len(self.members[root_a]) < len(self.members[root_b]):
+            root_a, root_b = root_b, root_a
+        size_a = len(self.members[root_a])
+        size_b = len(self.members[root_b])
+        self.parent[root_b] = root_a
+        self.members[root_a].update(self.members.pop(root_b))
+        self._count_size(size_a, -1)
+        self._count_size(size_b, -1)
+        self._count_size(size_a + size_b, 1)
+
+    def remove(self, index: int, adjacent) -> None:
+        """Drop region index and split its cluster if index held it together"""
+        root = self.find(index)
+        cluster = self.members[root]
+        self._count_size(len(cluster), -1)
+        cluster.discard(index)
+        del self.node_of[index]
+
+        starts = [neighbor for neighbor in adjacent[index] if neighbor in cluster]
+        if len(starts) > 1:
+            for piece in self._split_pieces(starts, cluster, adjacent):
+                cluster.difference_update(piece)
+                new_root = self._new_node()
+                for member in piece:
+                    self.node_of[member] = new_root
+                self.members[new_root] = piece
+                self._count_size(len(piece), 1)
+
+        if cluster:
+            self._count_size(len(cluster), 1)
+        else:
+            del self.members[root]
+        if len(self.parent) > 2 * len(self.node_of) + 16:
+            self._compact()
+
+    @staticmethod
+    def _split_pieces(starts: List[int], cluster: Set[int], adjacent) -> List[Set[int]]:
+        """
+        Pieces of cluster that broke away from the rest, searched in lockstep from starts
+        A search that runs out of regions has found a whole piece. Searches that
+        meet are one piece and merge. The last search still running is the rest
+        of the cluster and is never walked to its end.
+        """
+        label: Dict[int, int] = {}
+        queues: Dict[int, deque] = {}
+        seen: Dict[int, Set[int]] = {}
+        for search, start in enumerate(starts):
+            if start in label:
+                continue  # listed twice
+            label[start] = search
+            queues[search] = deque([start])
+            seen[search] = {start}
+
+        pieces = []
+        while len(queues) > 1:
+            for search in list(queues):
+                queue = queues.get(search)
+                if queue is None:
+                    continue  # merged into another search this round
+                if not queue:
+                    pieces.append(seen.pop(search))
+                    del queues[search]
+                    if len(queues) <= 1:
+                        break
+                    continue
+                current = queue.popleft()
+                for neighbor in adjacent[current]:
+                    if neighbor not in cluster:
+                        continue
+                    other = label.get(neighbor)
+                    if other is None:
+                        label[neighbor] = search
+                        seen[search].add(neighbor)
+                        queue.append(neighbor)
+                    elif other != search:
+                        # Same piece: fold the smaller search into the larger
+                        small, large = (other, search) if len(seen[other]) < len(seen[search]) else (search, other)
+                        for member in seen[small]:
+                            label[member] = large
+                        seen[large].update(seen.pop(small))
+                        queues[large].extend(queues.pop(small))
+                        if small == search:
+                            search, queue = large, queues[large]
+                if len(queues) <= 1:
+                    break
+        return pieces
+
+    def _compact(self):
+        """Rebuild the trees without tombstones, one flat tree per cluster"""
+        self.parent = {}
+        self.node_of = {}
+        members = {}
+        for cluster in self.members.values():
+            root = self._new_node()
+            for member in cluster:
+                self.node_of[member] = root
+            members[root] = cluster
+        self.members = members
+
+    def largest(self) -> int:
+        return max(self.size_counts, default=0)
+
+    def _count_size(self, size: int, delta: int):
+        count = self.size_counts.get(size, 0) + delta
+        if count:
+            self.size_counts[size] = count
+        else:
+            del self.size_counts[size]
+
+
+class TerritoryTracker:
+    """Per-game connectivity of every player's territory"""
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.adjacent = topology.adjacent_indices
+        self.players: Dict[str, PlayerTerritory] = {}
+
+    def move(self, index: int, old_owner: Optional[str], new_owner: Optional[str]):
+        """Update connectivity when a region changes hands"""
+        if old_owner == new_owner:
+            return
+        if old_owner is not None:
+            self.players[old_owner].remove(index, self.adjacent)
+        if new_owner is not None:
+            self._capture(new_owner, index)
+
+    def _capture(self, owner: str, index: int):
+        territory = self.players.setdefault(owner, PlayerTerritory())
+        territory.add(index)
+        for neighbor in self.adjacent[index]:
+            if neighbor in territory:
+                territory.union(index, neighbor)
+
+    def cluster_id(self, owner: str, region_id: str) -> Optional[int]:
+        """Id of the cluster containing region_id, None if owner does not hold it"""
+        territory = self.players.get(owner)
+        index = self.topology.index.get(region_id)
+        if territory is None or index not in territory:
+            return None
+        return territory.find(index)
+
+    def cluster_sizes(self, owner: str) -> Dict[int, int]:
+        """Cluster id -> number of regions"""
+        territory = self.players.get(owner)
+        if territory is None:
+            return {}
+        return {root: len(members) for root, members in territory.members.items()}
+
+    def clusters(self, owner: str) -> List[List[str]]:
+        """Connected clusters of region ids, largest first"""
+        territory = self.players.get(owner)
+        if territory is None:
+            return []
+        return _cluster_ids(territory, self.topology.region_ids)
+
+    def largest_territory(self, owner: str) -> int:
+        """Size of the largest connected territory of owner"""
+        territory = self.players.get(owner)
+        return territory.largest() if territory is not None else 0
+
+
+def _cluster_ids(territory: PlayerTerritory, region_ids) -> List[List[str]]:
+    clusters = [[region_ids[i] for i in sorted(members)] for members in territory.members.values()]
+    clusters.sort(key=len, reverse=True)
+    return clusters
+
+
+def connected_clusters(topology, region_ids: Iterable[str]) -> List[List[str]]:
+    """Connected clusters of any set of region ids, largest first (unknown ids are skipped)"""
+    territory = PlayerTerritory()
+    index = topology.index
+    adjacent = topology.adjacent_indices
+    for region_id in region_ids:
+        i = index.get(region_id)
+        if i is None or i in territory:
+            continue
+        territory.add(i)
+        for neighbor in adjacent[i]:
+            if neighbor in territory:
+                territory.union(i, neighbor)
+    return _cluster_ids(territory, topology.region_ids)
@@ -0,0 +1,231 @@
+"""
+Compact wire format for Iran War Game states and diffs
+Region tables, the bulk of every state and diff, are packed as binary
+records addressed by map index instead of JSON objects keyed by region id,
+and owner ids are listed once per message and referenced by slot. Static
+region fields travel only with full states. Everything else stays JSON.
+
+message := u32 meta length, meta JSON, region sections...
+section := u32 record count, records
+record  := u32 region index, u8 field mask, [u8 owner slot] [i32 soldiers] [u16 x 3 buildings]
+
+In the meta every region table is replaced by its section number. A full
+state also carries region_ids and region_static, which the receiver keeps
+to resolve the indices of later diffs.
+
+A state shared by many messages is walked once with encode_state and the
+result spliced into each of them: its sections and owner slots come first.
+"""
+
+import json
+import struct
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from map_topology import BUILDING_TYPES
+
+CODEC_COMPACT = 'compact'
+CODEC_JSON = 'json'
+# Codecs this side speaks, most preferred first
+CODECS = (CODEC_COMPACT, CODEC_JSON)
+# Content type of compact HTTP replies, asked for in the Accept header
+COMPACT_MIMETYPE = 'application/vnd.iranwar.compact'
+
+COUNT = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<IB')
+OWNER = struct.Struct('<B')
+SOLDIERS = struct.Struct('<i')
+BUILDINGS = struct.Struct('<' + 'H' * len(BUILDING_TYPES))
+
+# Field mask bits of a record
+HAS_OWNER = 1
+HAS_SOLDIERS = 2
+HAS_BUILDINGS = 4
+NO_OWNER = 0xFF
+# Meta key of the owner slot table
+OWNERS_KEY = '$owners'
+
+
+class ResyncRequired(ValueError):
+    """A diff arrived before any full state, the receiver has to ask for one"""
+
+
+def choose_codec(offered) -> str:
+    """First codec of the peer's offer that this side speaks, JSON if none"""
+    if isinstance(offered, (list, tuple)):
+        for codec in offered:
+            if codec in CODECS:
+                return codec
+    return CODEC_JSON
+
+
+class EncodedState:
+    """A state already walked by the compact encoder, spliced into messages by encode_message"""
+
+    __slots__ = ('meta', 'owners', 'sections')
+
+    def __init__(self, meta: Dict, owners: List[str], sections: List[bytes]):
+        self.meta = meta
+        self.owners = owners
+        self.sections = sections
+
+
+def encode_state(state: Dict, topology) -> EncodedState:
+    """Walk a state once so any number of messages can carry it without re-encoding"""
+    encoder = _Encoder(topology)
+    meta = encoder.walk(state)
+    return EncodedState(meta, encoder.owners, encoder.sections)
+
+
+def encode_message(payload: Dict, topology) -> bytes:
+    """
+    Compact encoding of an event payload holding states and diffs of a game on topology
+    The payload may be, or hold at its top level, one EncodedState.
+    """
+    encoder = _Encoder(topology)
+    if isinstance(payload, EncodedState):
+        encoder.splice(payload)
+        meta = dict(payload.meta)
+    else:
+        for value in payload.values():
+            if isinstance(value, EncodedState):
+                encoder.splice(value)
+                break
+        meta = encoder.walk(payload)
+    if encoder.owners:
+        meta[OWNERS_KEY] = encoder.owners
+    meta_json = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return COUNT.pack(len(meta_json)) + meta_json + b''.join(encoder.sections)
+
+
+def decode_message(data: bytes, region_ids: Optional[Sequence[str]] = None) -> Tuple[Dict, Optional[Sequence[str]]]:
+    """
+    Payload of a compact message and the region ids to decode the next one
+    region_ids comes from the last full state the receiver got; without it
+    a diff raises ResyncRequired.
+    """
+    (meta_length,) = COUNT.unpack_from(data, 0)
+    offset = COUNT.size
+    meta = json.loads(bytes(data[offset:offset + meta_length]).decode('utf-8'))
+    offset += meta_length
+    owners = meta.pop(OWNERS_KEY, [])
+
+    sections = []
+    while offset < len(data):
+        records, offset = _read_section(data, offset, owners)
+        sections.append(records)
+
+    decoder = _Decoder(sections, region_ids)
+    return decoder.walk(meta), decoder.region_ids
+
+
+class _Encoder:
+    def __init__(self, topology):
+        self.topology = topology
+        self.owners: List[str] = []
+        self.owner_slots: Dict[str, int] = {}
+        self.sections: List[bytes] = []
+        self.spliced: Optional[EncodedState] = None
+
+    def splice(self, state: EncodedState):
+        """Start from a walked state, whose section numbers and owner slots then stay valid"""
+        self.owners = list(state.owners)
+        self.owner_slots = {owner: slot for slot, owner in enumerate(self.owners)}
+        self.sections = list(state.sections)
+        self.spliced = state
+
+    def walk(self, value):
+        if isinstance(value, EncodedState):
+            if value is not self.spliced:
+                raise ValueError('a compact message carries at most one encoded state')
+            return value.meta
+        if isinstance(value, Mapping):
+            result = {}
+            for key, item in value.items():
+                if key == 'regions' and isinstance(item, Mapping):
+                    result[key] = self.section(item)
+                    if item and 'name' in next(iter(item.values())):
+                        # Full state: static fields ride along once
+                        result['region_ids'] = list(self.topology.region_ids)
+                        result['region_static'] = [dict(static) for static in self.topology.static]
+                else:
+                    result[key] = self.walk(item)
+            return result
+        if isinstance(value, (list, tuple)):
+            return [self.walk(item) for item in value]
+        return value
+
+    def section(self, regions: Mapping) -> int:
+        index = self.topology.index
+        parts = [COUNT.pack(len(regions))]
+        for region_id, fields in regions.items():
+            mask = ((HAS_OWNER if 'owner' in fields else 0) | (HAS_SOLDIERS if 'soldiers' in fields else 0) |
+                    (HAS_BUILDINGS if 'buildings' in fields else 0))
+            parts.append(RECORD_HEADER.pack(index[region_id], mask))
+            if mask & HAS_OWNER:
+                parts.append(OWNER.pack(self.owner_slot(fields['owner'])))
+            if mask & HAS_SOLDIERS:
+                parts.append(SOLDIERS.pack(fields['soldiers']))
+            if mask & HAS_BUILDINGS:
+                buildings = fields['buildings']
+                parts.append(BUILDINGS.pack(*(buildings.get(building, 0) for building in BUILDING_TYPES)))
+        self.sections.append(b''.join(parts))
+        return len(self.sections) - 1
+
+    def owner_slot(self, owner: Optional[str]) -> int:
+        if owner is None:
+            return NO_OWNER
+        slot = self.owner_slots.get(owner)
+        if slot is None:
+            slot = self.owner_slots[owner] = len(self.owners)
+            self.owners.append(owner)
+        return slot
+
+
+def _read_section(data: bytes, offset: int, owners: List[str]) -> Tuple[List[Tuple[int, Dict]], int]:
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    records = []
+    for _ in range(count):
+        index, mask = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        fields = {}
+        if mask & HAS_OWNER:
+            (slot,) = OWNER.unpack_from(data, offset)
+            offset += OWNER.size
+            fields['owner'] = None if slot == NO_OWNER else owners[slot]
+        if mask & HAS_SOLDIERS:
+            (fields['soldiers'],) = SOLDIERS.unpack_from(data, offset)
+            offset += SOLDIERS.size
+        if mask & HAS_BUILDINGS:
+            fields['buildings'] = dict(zip(BUILDING_TYPES, BUILDINGS.unpack_from(data, offset)))
+            offset += BUILDINGS.size
+        records.append((index, fields))
+    return records, offset
+
+
+class _Decoder:
+    def __init__(self, sections: List[List[Tuple[int, Dict]]], region_ids: Optional[Sequence[str]]):
+        self.sections = sections
+        self.region_ids = region_ids
+
+    def walk(self, value):
+        if isinstance(value, dict):
+            result = {key: self.walk(item) for key, item in value.items()
+                      if key not in ('regions', 'region_ids', 'region_static')}
+            if isinstance(value.get('regions'), int):
+                static = value.get('region_static')
+                if 'region_ids' in value:
+                    self.region_ids = value['region_ids']
+                if self.region_ids is None:
+                    raise ResyncRequired('compact diff received before a full state')
+                regions = {}
+                for index, fields in self.sections[value['regions']]:
+                    regions[self.region_ids[index]] = {**static[index], **fields} if static else fields
+                result['regions'] = regions
+            elif 'regions' in value:
+                result['regions'] = self.walk(value['regions'])
+            return result
+        if isinstance(value, list):
+            return [self.walk(item) for item in value]
+        return value